@@ -1,16 +1,21 @@
 import qlib
 from qlib.config import REG_CN
+from qlib.data import D
 from qlib.utils import init_instance_by_config
 from qlib.workflow import R
 from qlib.workflow.record_temp import SignalRecord, PortAnaRecord
+import argparse
 import sys
 from pathlib import Path
 import pandas as pd
 
-# Initialize Qlib
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.feature_cache import load_features, static_loader_config
+from data_processing.tradability import BITMAP_PATH, exchange_config
+from backtest.run_catalog import record_run
+from tracing import span
+
 provider_uri = str(Path("qlib_data/cn_data").resolve())
-qlib.init(provider_uri=provider_uri, region=REG_CN)
-print(f"Qlib 初始化完成, 数据源: {provider_uri}")
 
 # 定义特征集 
 fields = []
@@ -51,6 +56,8 @@ TRAIN_START = "2021-01-01"
 TRAIN_END   = "2024-06-30"
 TEST_START  = "2024-07-01"
 TEST_END    = "2025-12-30"
+USE_FEATURE_CACHE = True  # 表达式/数据未变化时直接读磁盘缓存, 跳过特征计算
+USE_BOARD_LIMITS = True  # 有涨跌停位图 (data_processing/tradability.py) 时按板块判断涨跌停, 替代统一的 0.095
 
 conf = {
     "task": {
@@ -89,15 +96,15 @@ conf = {
                                 },
                             },
                         },
-                        # 用 CSRankNorm 把横截面排名标准化, 这将把所有特征转换为 0~1 之间的排名, 解决数值爆炸和异常值问题
+                        # 用 CSRankNorm (向量化实现 FastCSRankNorm, 结果一致) 把横截面排名标准化, 这将把所有特征转换为 0~1 之间的排名, 解决数值爆炸和异常值问题
                         "infer_processors": [
-                             {'class': 'CSRankNorm', 'kwargs': {'fields_group': 'feature'}},
+                             {'class': 'FastCSRankNorm', 'module_path': 'data_processing.processors', 'kwargs': {'fields_group': 'feature'}},
                              {'class': 'Fillna', 'kwargs': {'fields_group': 'feature'}}
                         ],
                         # 训练时对 Label 也做排名处理, 可以让模型更关注相对强弱, 而不是绝对涨幅
                         "learn_processors": [
                             {'class': 'DropnaLabel'},
-                            {'class': 'CSRankNorm', 'kwargs': {'fields_group': 'label'}}
+                            {'class': 'FastCSRankNorm', 'module_path': 'data_processing.processors', 'kwargs': {'fields_group': 'label'}}
                         ],
                     },
                 },
@@ -150,23 +157,75 @@ conf = {
 }
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="洗盘策略训练 + 回测")
+    parser.add_argument("--pred", default=None,
+                        help="可选: 已有的预测文件 (如 research/walk_forward.py 输出的 pred.pkl), 跳过训练直接回测")
+    args = parser.parse_args()
+
+    # Initialize Qlib (放在入口处, 导入本模块不触发初始化)
+    qlib.init(provider_uri=provider_uri, region=REG_CN)
+    print(f"Qlib 初始化完成, 数据源: {provider_uri}")
+
     # 实验管理
     with R.start(experiment_name="washout_strategy_rank"):
-        print("1. 构建数据集 & 训练模型...")
-        model = init_instance_by_config(conf["task"]["model"])
-        dataset = init_instance_by_config(conf["task"]["dataset"])
-        model.fit(dataset)
-
-        print("2. 生成预测结果...")
         recorder = R.get_recorder()
-        sr = SignalRecord(model, dataset, recorder)
-        sr.generate()
+        port_config = conf["record"][1]["kwargs"]["config"]
+
+        if args.pred:
+            print(f"1. 读取已有预测: {args.pred}")
+            pred = pd.read_pickle(args.pred)
+            # 回测区间取预测覆盖的日期
+            pred_dates = pred.index.get_level_values("datetime")
+            port_config["backtest"]["start_time"] = str(pred_dates.min().date())
+            port_config["backtest"]["end_time"] = str(pred_dates.max().date())
+            # PortAnaRecord 依赖 SignalRecord 的 pred.pkl + label.pkl, 标签直接按表达式取原始值
+            label = D.features(D.instruments(market), label_fields, start_time=pred_dates.min(), end_time=pred_dates.max())
+            label.columns = label_names
+            label = label.swaplevel().sort_index()
+            recorder.save_objects(**{"pred.pkl": pred, "label.pkl": label})
+        else:
+            # 原始特征/标签走磁盘缓存, 替换掉 QlibDataLoader; CSRankNorm 等处理器照常执行
+            handler_kwargs = conf["task"]["dataset"]["kwargs"]["handler"]["kwargs"]
+            raw_df = load_features(handler_kwargs["data_loader"]["kwargs"]["config"], instruments=market,
+                                   start_time=TRAIN_START, end_time=TEST_END, use_cache=USE_FEATURE_CACHE)
+            handler_kwargs["data_loader"] = static_loader_config(raw_df)
+            handler_kwargs["instruments"] = None
+
+            print("1. 构建数据集 & 训练模型...")
+            model = init_instance_by_config(conf["task"]["model"])
+            with span("backtest.build_dataset"):
+                dataset = init_instance_by_config(conf["task"]["dataset"])
+            with span("backtest.fit"):
+                model.fit(dataset)
+
+            print("2. 生成预测结果...")
+            sr = SignalRecord(model, dataset, recorder)
+            with span("backtest.predict"):
+                sr.generate()
+
+        if USE_BOARD_LIMITS and BITMAP_PATH.exists():
+            bt = port_config["backtest"]
+            bt["exchange_kwargs"] = exchange_config(bt["start_time"], bt["end_time"], codes=market,
+                                                    deal_price=bt["exchange_kwargs"]["deal_price"])
+            print(f"   使用分板块涨跌停位图: {BITMAP_PATH}")
 
         print("3. 执行回测...")
-        par = PortAnaRecord(recorder, conf["record"][1]["kwargs"]["config"])
-        par.generate()
+        par = PortAnaRecord(recorder, port_config)
+        with span("backtest.portfolio"):
+            par.generate()
 
         print(f"\n 回测完成！结果已保存.")
+
+        # 登记到运行目录, 之后查找/筛选/对比不再扫描 mlruns
+        run_config = {"model": conf["task"]["model"], "features": names, "pred": args.pred,
+                      "strategy": {k: v for k, v in port_config["strategy"]["kwargs"].items() if k != "signal"},
+                      "backtest": port_config["backtest"]}
+        try:
+            record = record_run(recorder, "washout_strategy_rank", run_config)
+            print(f"已登记运行 {record['run_id']} (配置 {record['config_hash']}), "
+                  f"年化 {record['annual_return']:.2%}, 夏普 {record['sharpe']:.2f}")
+        except Exception as e:
+            print(f"登记运行目录失败 (不影响回测结果): {e}")
         
         try:
             # 加载回测指标文件 (DataFrame)
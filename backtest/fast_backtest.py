@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+向量化 Top-K 轮动回测
+
+PortAnaRecord + TopkDropoutStrategy 每天通过 Order 对象逐笔撮合, 一次回测要几分钟, 调参时很慢.
+这里把行情读成 (日期 x 股票) 矩阵, 复刻 Qlib 的回测规则:
+  - T 日使用 T-1 日的预测分数, 以 T 日收盘价成交 (deal_price="close");
+  - TopkDropout 的买卖逻辑 (topk / n_drop / hold_thresh), 持仓按分数排序, 候选股用 argpartition 一次选出;
+  - 停牌 ($close 为 NaN) 与涨跌停 (|$change| >= limit_threshold) 的可交易掩码, 涨跌停时买卖都禁止;
+    limit_threshold="board" 时改用 data_processing/tradability.py 预先算好的分板块涨跌停位图;
+  - 手续费 (open_cost / close_cost / min_cost)、100 股整手、risk_degree 的现金比例.
+输出与 Qlib 的 report_normal_1day 同列 (account/return/total_turnover/turnover/total_cost/cost/value/cash/bench),
+可直接交给 visualize_results.plot_performance.
+
+逐日循环只处理持仓和候选股 (十几只), 选股、掩码、估值全部在矩阵上完成, 一年的回测在 1 秒以内.
+
+用法:
+    python backtest/fast_backtest.py --pred models/walk_forward/pred.pkl --output report_normal_1day.pkl
+    python backtest/fast_backtest.py --pred pred.pkl --parity   # 同时跑一遍 Qlib 回测并比较
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Config (与 backtest_washout.py 的 PortAnaRecord 配置一致)
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+MARKET = "all"
+BENCHMARK = "SH000300"
+TOPK = 5
+N_DROP = 5
+HOLD_THRESH = 1
+ACCOUNT = 1_000_000
+RISK_DEGREE = 0.95
+LIMIT_THRESHOLD = 0.095
+OPEN_COST = 0.0015
+CLOSE_COST = 0.0025
+MIN_COST = 5.0
+TRADE_UNIT = 100
+
+REPORT_COLUMNS = ["account", "return", "total_turnover", "turnover", "total_cost", "cost", "value", "cash", "bench"]
+
+
+class PricePanel:
+    """
+    回测所需的行情矩阵 (日期 x 股票). dates 比回测区间多一天 (前一交易日), 用于读取 T-1 的分数.
+    prices 是成交价字段 ({"close": ..., "open": ...}), 缺失或非正的价格已按 Qlib 的做法回退为收盘价.
+    只读使用, 同一个面板可以跑不同的 limit_threshold / deal_price 组合.
+    """
+
+    def __init__(self, dates, codes, close, change, factor, bench, prices=None):
+        self.dates = pd.DatetimeIndex(dates)
+        self.codes = pd.Index(codes)
+        self.close = close
+        self.change = change
+        self.factor = factor
+        self.bench = bench
+        self.prices = {"close": close}
+        for name, mat in (prices or {}).items():
+            with np.errstate(invalid="ignore"):
+                self.prices[name] = np.where(np.isnan(mat) | (mat <= 1e-8), close, mat)
+        self.suspended = np.isnan(close)
+        # 分板块涨跌停位图 (load_price_panel(bitmap=...) 时才有), 对应 limit_threshold="board"
+        self.board_limit_buy = self.board_limit_sell = None
+        # 有收盘价却没有复权因子时 Qlib 改用复权价交易, 不再按整手取整
+        self.round_lot = not np.any(np.isnan(factor) & ~self.suspended)
+
+    def tradable(self, limit_threshold=LIMIT_THRESHOLD) -> np.ndarray:
+        """
+        可交易掩码. forbid_all_trade_at_limit=True: 停牌、涨停或跌停时买卖都不允许;
+        None 表示不限制涨跌停, "board" 表示使用位图中的分板块涨跌停
+        """
+        if limit_threshold is None:
+            return ~self.suspended
+        if limit_threshold == "board":
+            if self.board_limit_buy is None:
+                raise ValueError('limit_threshold="board" 需要在 load_price_panel 时传入 bitmap')
+            return ~(self.board_limit_buy | self.board_limit_sell | self.suspended)
+        with np.errstate(invalid="ignore"):
+            at_limit = (self.change >= limit_threshold) | (self.change <= -limit_threshold)
+        return ~(at_limit | self.suspended)
+
+    def arrays(self) -> dict:
+        """面板中的全部矩阵 (成交价字段加 price_ 前缀), 与 from_arrays 配对, 用于放进共享内存"""
+        arrays = {"close": self.close, "change": self.change, "factor": self.factor,
+                  "suspended": self.suspended, "bench": self.bench}
+        arrays.update({f"price_{name}": mat for name, mat in self.prices.items() if name != "close"})
+        if self.board_limit_buy is not None:
+            arrays.update(board_limit_buy=self.board_limit_buy, board_limit_sell=self.board_limit_sell)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, dates, codes, arrays: dict, round_lot: bool) -> "PricePanel":
+        """用现成的矩阵 (如共享内存上的 view) 构造面板, 不复制数据"""
+        panel = cls.__new__(cls)
+        panel.dates, panel.codes, panel.round_lot = pd.DatetimeIndex(dates), pd.Index(codes), round_lot
+        panel.close, panel.change, panel.factor = arrays["close"], arrays["change"], arrays["factor"]
+        panel.suspended, panel.bench = arrays["suspended"], arrays["bench"]
+        panel.board_limit_buy, panel.board_limit_sell = arrays.get("board_limit_buy"), arrays.get("board_limit_sell")
+        panel.prices = {"close": panel.close}
+        panel.prices.update({k[len("price_"):]: v for k, v in arrays.items() if k.startswith("price_")})
+        return panel
+
+    def extend(self, extra_codes) -> "PricePanel":
+        """加入行情中没有的股票 (视为停牌), 使预测中的任意股票都有对应的列"""
+        extra = pd.Index(extra_codes).difference(self.codes)
+        if len(extra) == 0:
+            return self
+        shape = (len(self.dates), len(extra))
+        arrays = {
+            name: mat if name == "bench" else np.hstack([mat, np.ones(shape, dtype=bool) if mat.dtype == bool
+                                                        else np.full(shape, np.nan)])
+            for name, mat in self.arrays().items()
+        }
+        return PricePanel.from_arrays(self.dates, self.codes.append(extra), arrays, self.round_lot)
+
+
+def _read_from_server(start_time, end_time, benchmark, fields):
+    """
+    面板服务 (data_processing/panel_server.py) 在运行、版本与 bin 一致且发布了所需字段时, 直接从共享内存取矩阵,
+    不经过 D.features; 否则返回 None. 股票取区间内有收盘价的, 与 D.features 返回的股票一致
+    """
+    from data_processing.panel_server import attach_current, take
+
+    panel = attach_current(QLIB_DATA_DIR)
+    if panel is None:
+        return None
+    with panel:
+        if not set(fields) <= set(panel.fields) or benchmark not in panel.codes:
+            return None
+        end_pos = int(panel.dates.searchsorted(pd.Timestamp(end_time), "right"))
+        start_pos = max(int(panel.dates.searchsorted(pd.Timestamp(start_time))) - 1, 0)
+        rows = np.arange(start_pos, end_pos)
+        dates = panel.dates[rows]
+        codes = panel.codes[~np.isnan(panel["close"][rows]).all(axis=0)]
+        cols = panel.codes.get_indexer(codes)
+        mats = [take(panel[f], rows, cols) for f in fields]
+        # 与 $close/Ref($close,1)-1 相同: float32 计算, 第一行用区间前一天的收盘价
+        bench_close = panel["close"][:, panel.codes.get_loc(benchmark)]
+        prev = np.full(len(rows), np.nan, dtype=np.float32)
+        prev[rows > 0] = bench_close[rows[rows > 0] - 1]
+        bench = np.nan_to_num(bench_close[rows] / prev - 1).astype(np.float32)
+        del bench_close
+    print(f"行情取自共享内存面板 {panel.version}")
+    return dates, codes, mats, bench
+
+
+def load_price_panel(start_time, end_time, market=MARKET, benchmark=BENCHMARK, deal_prices=("close",),
+                     bitmap=None) -> PricePanel:
+    """
+    读取 $close/$change/$factor、成交价字段和基准收益. market 为默认股票池且面板服务可用时取自共享内存,
+    否则从 Qlib 读取 (调用前需要先 qlib.init).
+    bitmap: 可选的 TradabilityBitmap, 与 BitmapExchange 相同: 开盘或收盘涨停不能买, 收盘跌停不能卖
+    """
+    extra = [p.lstrip("$") for p in deal_prices if p.lstrip("$") != "close"]
+    fields = ["close", "change", "factor"] + extra
+    served = _read_from_server(start_time, end_time, benchmark, fields) if market == MARKET else None
+    if served is not None:
+        dates, codes, mats, bench = served
+    else:
+        dates, codes, mats, bench = _read_from_qlib(start_time, end_time, market, benchmark, fields)
+    if np.isnan(mats[1]).all():
+        print("提示: 数据中没有 $change 字段, 涨跌停限制不生效 (与 Qlib 行为一致)")
+
+    panel = PricePanel(dates, codes, mats[0], mats[1], mats[2], bench, dict(zip(extra, mats[3:])))
+    if bitmap is not None:
+        from data_processing.tradability import LIMIT_DOWN, LIMIT_UP, LIMIT_UP_OPEN, SUSPENDED
+
+        suspended = bitmap.matrix(SUSPENDED, dates, codes)
+        panel.board_limit_buy = suspended | bitmap.matrix(LIMIT_UP, dates, codes) | bitmap.matrix(LIMIT_UP_OPEN, dates, codes)
+        panel.board_limit_sell = suspended | bitmap.matrix(LIMIT_DOWN, dates, codes)
+    return panel
+
+
+def _read_from_qlib(start_time, end_time, market, benchmark, fields):
+    from qlib.data import D
+
+    calendar = D.calendar(end_time=end_time)
+    start_pos = max(int(np.searchsorted(calendar, pd.Timestamp(start_time))) - 1, 0)
+    dates = pd.DatetimeIndex(calendar[start_pos:])
+
+    df = D.features(D.instruments(market), [f"${f}" for f in fields], start_time=dates[0], end_time=dates[-1])
+    codes = pd.Index(sorted(df.index.get_level_values("instrument").unique()))
+    d_idx = dates.get_indexer(df.index.get_level_values("datetime"))
+    s_idx = codes.get_indexer(df.index.get_level_values("instrument"))
+    mats = []
+    for col in df.columns:
+        mat = np.full((len(dates), len(codes)), np.nan)
+        mat[d_idx, s_idx] = df[col].to_numpy(dtype=np.float64)
+        mats.append(mat)
+
+    bench = D.features([benchmark], ["$close/Ref($close,1)-1"], start_time=dates[0], end_time=dates[-1])
+    bench = bench.droplevel("instrument").iloc[:, 0].reindex(dates).fillna(0).to_numpy(dtype=np.float32)
+    return dates, codes, mats, bench
+
+
+def score_matrix(pred, panel: PricePanel) -> np.ndarray:
+    """pred: (datetime, instrument) 索引的 Series/DataFrame (取第一列) -> 与 panel 对齐的分数矩阵, 无预测为 NaN"""
+    if isinstance(pred, pd.DataFrame):
+        pred = pred.iloc[:, 0]
+    d_idx = panel.dates.get_indexer(pred.index.get_level_values("datetime"))
+    s_idx = panel.codes.get_indexer(pred.index.get_level_values("instrument"))
+    keep = (d_idx >= 0) & (s_idx >= 0)
+    scores = np.full((len(panel.dates), len(panel.codes)), np.nan)
+    scores[d_idx[keep], s_idx[keep]] = pred.to_numpy(dtype=np.float64)[keep]
+    return scores
+
+
+def top_candidates(scores: np.ndarray, n: int):
+    """每行分数最高的 n 个列号 (降序), 一次 argpartition 完成所有交易日"""
+    n = min(n, scores.shape[1])
+    key = np.where(np.isnan(scores), -np.inf, scores)
+    part = np.argpartition(-key, n - 1, axis=1)[:, :n]
+    order = np.argsort(-np.take_along_axis(key, part, axis=1), axis=1, kind="stable")
+    top = np.take_along_axis(part, order, axis=1)
+    valid = np.isfinite(np.take_along_axis(key, top, axis=1))
+    return top, valid
+
+
+def run_backtest(pred, panel: PricePanel, start_time=None, end_time=None, **kwargs) -> pd.DataFrame:
+    """TopkDropout 回测, 返回与 Qlib report_normal_1day 相同格式的 DataFrame. kwargs 见 simulate"""
+    panel = panel.extend(pred.index.get_level_values("instrument").unique())
+    return simulate(score_matrix(pred, panel), panel, start_time, end_time, **kwargs)
+
+
+def simulate(scores: np.ndarray, panel: PricePanel, start_time=None, end_time=None, topk=TOPK, n_drop=N_DROP,
+             hold_thresh=HOLD_THRESH, account=ACCOUNT, risk_degree=RISK_DEGREE, open_cost=OPEN_COST,
+             close_cost=CLOSE_COST, min_cost=MIN_COST, trade_unit=TRADE_UNIT,
+             limit_threshold=LIMIT_THRESHOLD, deal_price="close", return_weights=False):
+    """
+    在已对齐的分数矩阵 (与 panel 同形状, 不修改) 上回测.
+    return_weights=True 时额外返回每日收盘后的持仓权重矩阵 (市值 / 账户总值, 行与 report 对齐, 列为 panel.codes)
+    """
+    close, suspended, factor = panel.close, panel.suspended, panel.factor
+    deal = panel.prices[deal_price.lstrip("$")]
+    tradable = panel.tradable(limit_threshold)
+
+    start = 1 if start_time is None else max(int(panel.dates.searchsorted(pd.Timestamp(start_time))), 1)
+    stop = len(panel.dates) if end_time is None else int(panel.dates.searchsorted(pd.Timestamp(end_time), "right"))
+    # 候选数: 持仓 + 新买入最多 topk + n_drop, 多留一些余量, 不够时当天单独全排序
+    n_cand = 2 * (topk + n_drop) + 10
+    top, top_valid = top_candidates(scores[start - 1:stop - 1], n_cand)
+
+    def round_lot(amount, f):
+        if not panel.round_lot:
+            return amount
+        return (amount * f + 0.1) // trade_unit * trade_unit / f
+
+    cash = float(account)
+    position = {}  # 列号 -> [股数, 最新价, 持有天数], 保持插入顺序 (与 Qlib Position 一致)
+    last_value, total_turnover, total_cost = float(account), 0.0, 0.0
+    rows = []
+    weights = np.zeros((max(stop - start, 0), len(panel.codes))) if return_weights else None
+    for i, t in enumerate(range(start, stop)):
+        sig = scores[t - 1]
+        turnover, cost = 0.0, 0.0
+        if not np.isnan(sig).all():
+            held = list(position)
+            # 持仓按分数降序, 无分数的排最后
+            last = sorted(held, key=lambda c: (np.isnan(sig[c]), -sig[c] if not np.isnan(sig[c]) else 0))
+            n_new = n_drop + topk - len(last)
+            cand = [c for c in top[i][top_valid[i]] if c not in position]
+            if len(cand) < max(n_new, 0) and top_valid[i].all():
+                key = np.where(np.isnan(sig), -np.inf, sig)
+                order = np.argsort(-key, kind="stable")
+                cand = [c for c in order[np.isfinite(key[order])] if c not in position]
+            today = cand[:n_new]
+            comb = sorted(set(last) | set(today), key=lambda c: (np.isnan(sig[c]), -sig[c] if not np.isnan(sig[c]) else 0))
+            drop = set(comb[-n_drop:])
+            sell = [c for c in last if c in drop]
+            buy = today[:len(sell) + topk - len(last)]
+
+            for c in held:
+                if not tradable[t, c] or c not in sell or position[c][2] < hold_thresh:
+                    continue
+                amount = position[c][0]
+                val = amount * deal[t, c]
+                fee = max(val * close_cost, min_cost)
+                if cash + val < fee or val <= 1e-5:
+                    continue
+                cash += val - fee
+                turnover += val
+                cost += fee
+                del position[c]
+
+            value = cash * risk_degree / len(buy) if len(buy) > 0 else 0
+            for c in buy:
+                if not tradable[t, c]:
+                    continue
+                price = deal[t, c]
+                amount = round_lot(value / price, factor[t, c])
+                val = amount * price
+                fee = max(val * open_cost, min_cost)
+                if cash < fee:
+                    continue
+                if cash < val + fee:
+                    # 现金不足: 按现金上限重新计算股数
+                    critical = min_cost / open_cost + min_cost
+                    max_amount = cash / (1 + open_cost) / price if cash >= critical else (cash - min_cost) / price
+                    amount = round_lot(min(max_amount, amount), factor[t, c])
+                    val = amount * price
+                    fee = max(val * open_cost, min_cost)
+                if val <= 1e-5:
+                    continue
+                cash -= val + fee
+                turnover += val
+                cost += fee
+                position[c] = [amount, price, 0]
+
+        # 收盘: 未停牌的持仓更新价格, 持有天数 +1
+        stock_value = 0.0
+        for c, state in position.items():
+            if not suspended[t, c]:
+                state[1] = close[t, c]
+            state[2] += 1
+            stock_value += state[0] * state[1]
+        account_value = cash + stock_value
+        if return_weights:
+            for c, state in position.items():
+                weights[i, c] = state[0] * state[1] / account_value
+        total_turnover += turnover
+        total_cost += cost
+        rows.append((
+            account_value, (account_value - last_value + cost) / last_value, total_turnover,
+            turnover / last_value, total_cost, cost / last_value, stock_value, cash, panel.bench[t],
+        ))
+        last_value = account_value
+
+    report = pd.DataFrame(rows, index=pd.Index(panel.dates[start:stop], name="datetime"), columns=REPORT_COLUMNS)
+    report["bench"] = report["bench"].astype(np.float32)
+    return (report, weights) if return_weights else report
+
+
+def limit_arg(value: str):
+    """命令行的涨跌停参数: 数字阈值或 board"""
+    return value if value == "board" else float(value)
+
+
+def qlib_backtest(pred, start_time, end_time, topk=TOPK, n_drop=N_DROP, hold_thresh=HOLD_THRESH,
+                  limit_threshold=LIMIT_THRESHOLD, deal_price="close") -> pd.DataFrame:
+    """用 Qlib 原生的 TopkDropoutStrategy 跑同样的配置, 用于一致性检查"""
+    from data_processing.tradability import exchange_config
+    from qlib.backtest import backtest
+    from qlib.contrib.strategy import TopkDropoutStrategy
+
+    strategy = TopkDropoutStrategy(signal=pred, topk=topk, n_drop=n_drop, hold_thresh=hold_thresh)
+    executor = {
+        "class": "SimulatorExecutor",
+        "module_path": "qlib.backtest.executor",
+        "kwargs": {"time_per_step": "day", "generate_portfolio_metrics": True},
+    }
+    portfolio, _ = backtest(
+        start_time=start_time, end_time=end_time, strategy=strategy, executor=executor,
+        benchmark=BENCHMARK, account=ACCOUNT,
+        exchange_kwargs=exchange_config(start_time, end_time, deal_price=deal_price) if limit_threshold == "board"
+        else {"limit_threshold": limit_threshold, "deal_price": deal_price},
+    )
+    return portfolio["1day"][0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="向量化 Top-K 轮动回测")
+    parser.add_argument("--pred", required=True, help="预测文件 (pred.pkl, (datetime, instrument) 索引)")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--topk", type=int, default=TOPK)
+    parser.add_argument("--n_drop", type=int, default=N_DROP)
+    parser.add_argument("--limit_threshold", type=limit_arg, default=LIMIT_THRESHOLD,
+                        help='涨跌停阈值, "board" 表示使用分板块位图')
+    parser.add_argument("--deal_price", default="close", choices=["close", "open"])
+    parser.add_argument("--output", default=None, help="保存 report_normal_1day 格式的 pkl")
+    parser.add_argument("--parity", action="store_true", help="同时运行 Qlib 回测并比较结果")
+    args = parser.parse_args()
+
+    import qlib
+    from backtest.visualize_results import calculate_metrics
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+    pred = pd.read_pickle(args.pred)
+    pred_dates = pred.index.get_level_values("datetime")
+    start = args.start or str(pred_dates.min().date())
+    end = args.end or str(pred_dates.max().date())
+
+    t0 = time.time()
+    bitmap = None
+    if args.limit_threshold == "board":
+        from data_processing.tradability import TradabilityBitmap
+
+        bitmap = TradabilityBitmap.load()
+    panel = load_price_panel(start, end, deal_prices=[args.deal_price], bitmap=bitmap)
+    t1 = time.time()
+    report = run_backtest(pred, panel, start, end, topk=args.topk, n_drop=args.n_drop,
+                          limit_threshold=args.limit_threshold, deal_price=args.deal_price)
+    t2 = time.time()
+    print(f"行情加载 {t1 - t0:.2f}s, 回测 {t2 - t1:.3f}s ({len(report)} 个交易日)")
+
+    cum = (report["return"] - report["cost"] + 1).cumprod()
+    tot, ann, shp, mdd = calculate_metrics(report["return"] - report["cost"], cum)
+    print(f"累计收益 {tot * 100:.2f}%  年化 {ann * 100:.2f}%  夏普 {shp:.4f}  最大回撤 {mdd * 100:.2f}%  "
+          f"日均换手 {report['turnover'].mean():.4f}")
+    if args.output:
+        report.to_pickle(args.output)
+        print(f"报告已保存: {args.output}")
+
+    if args.parity:
+        t0 = time.time()
+        expected = qlib_backtest(pred, start, end, topk=args.topk, n_drop=args.n_drop,
+                                 limit_threshold=args.limit_threshold, deal_price=args.deal_price)
+        print(f"Qlib 回测耗时 {time.time() - t0:.1f}s")
+        expected = expected[REPORT_COLUMNS]
+        diff = (report - expected).abs() / expected.abs().clip(lower=1)
+        print("各列最大相对误差:")
+        print(diff.max().to_string(float_format=lambda v: f"{v:.2e}"))
+        if len(report) != len(expected) or diff.max().max() > 1e-4:
+            raise SystemExit("向量化回测与 Qlib 结果不一致!")
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+批量绩效指标
+
+visualize_results.calculate_metrics 一次只算一条 Series, 参数网格 / 叠加层 / 稳健性分析
+对几百条收益序列逐条调用. 这里把收益排成 (日期 x 运行) 矩阵, 一次向量化算出每一列的:
+累计收益、年化收益、夏普、最大回撤 (口径与 calculate_metrics 一致), 以及最长回撤天数、
+Calmar、滚动夏普 (最新值 / 最差值) 和平均换手率.
+
+MetricsAccumulator 只保存每列的少量状态 (净值、峰值、均值/平方和、滚动窗口尾部等),
+新交易日追加进来时只处理新增的行, 不用从头重算.
+
+用法:
+    from backtest.metrics import evaluate
+    table = evaluate(returns_df, bench=report["bench"], turnover=turnover_df)   # 列为各次运行, 按夏普排序
+
+    acc = MetricsAccumulator(n_runs)
+    acc.update(first_block)       # (天, 运行) 矩阵
+    acc.update(new_days)          # 之后每天追加
+    acc.result()
+"""
+import numpy as np
+import pandas as pd
+
+# Config
+ANNUAL_DAYS = 252
+ROLLING_WINDOW = 63  # 滚动夏普窗口, 约一个季度
+
+METRIC_COLUMNS = [
+    "total_return", "annual_return", "sharpe", "max_drawdown", "max_drawdown_days", "calmar",
+    "rolling_sharpe", "rolling_sharpe_min", "turnover",
+]
+
+
+def rolling_sharpe(returns: np.ndarray, window: int = ROLLING_WINDOW) -> np.ndarray:
+    """(天, 运行) -> 同形状的滚动年化夏普; 窗口内有缺失 (NaN) 或不满 window 天时为 NaN"""
+    valid = ~np.isnan(returns)
+    r = np.where(valid, returns, 0.0)
+    pad = np.zeros((1, r.shape[1]))
+    s1 = np.cumsum(np.vstack([pad, r]), axis=0)
+    s2 = np.cumsum(np.vstack([pad, r * r]), axis=0)
+    cnt = np.cumsum(np.vstack([pad, valid]), axis=0)
+    out = np.full(r.shape, np.nan)
+    if len(r) < window:
+        return out
+    w1 = s1[window:] - s1[:-window]
+    w2 = s2[window:] - s2[:-window]
+    full = (cnt[window:] - cnt[:-window]) == window
+    mean = w1 / window
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(np.maximum(w2 - w1 * mean, 0) / (window - 1))
+        sharpe = np.where(std > 0, mean / std * np.sqrt(ANNUAL_DAYS), 0.0)
+    out[window - 1:] = np.where(full, sharpe, np.nan)
+    return out
+
+
+class MetricsAccumulator:
+    """
+    按列 (运行) 累积的绩效状态, update 每次接收若干新交易日的 (天, 运行) 收益矩阵.
+    NaN 表示该运行当天没有数据 (如区间较短的运行在末尾补齐), 不计入天数.
+    """
+
+    def __init__(self, n_runs: int, window: int = ROLLING_WINDOW):
+        self.window = window
+        self.n = np.zeros(n_runs)  # 有效天数
+        self.mean = np.zeros(n_runs)
+        self.m2 = np.zeros(n_runs)  # 离差平方和 (Chan 分块合并, 比直接累加平方和稳定)
+        self.nav = np.ones(n_runs)
+        self.peak = np.zeros(n_runs)  # 与 calculate_metrics 相同, 峰值从第一天的净值算起 (不是 1)
+        self.max_dd = np.zeros(n_runs)
+        self.last_high = np.zeros(n_runs)  # 最近一次创新高的有效天序号
+        self.max_dd_days = np.zeros(n_runs)
+        self.turnover_sum = np.zeros(n_runs)
+        self.turnover_n = np.zeros(n_runs)
+        self.rolling_last = np.full(n_runs, np.nan)
+        self.rolling_min = np.full(n_runs, np.nan)
+        self._tail = np.empty((0, n_runs))  # 最近 window-1 行, 供滚动窗口跨块衔接
+
+    def update(self, returns, turnover=None) -> "MetricsAccumulator":
+        returns = np.asarray(returns, dtype=np.float64)
+        if returns.ndim == 1:
+            returns = returns[:, None]
+        if len(returns) == 0:
+            return self
+        valid = ~np.isnan(returns)
+        r = np.where(valid, returns, 0.0)
+
+        # 均值 / 方差: 块内统计量与已有状态合并
+        n_b = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.where(n_b > 0, r.sum(axis=0) / n_b, 0.0)
+        m2_b = (((r - mean_b) * valid) ** 2).sum(axis=0)
+        n_total = self.n + n_b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean_b - self.mean
+            self.mean = np.where(n_total > 0, self.mean + delta * n_b / n_total, 0.0)
+            self.m2 = self.m2 + m2_b + np.where(n_total > 0, delta ** 2 * self.n * n_b / n_total, 0.0)
+
+        # 净值 / 回撤 / 回撤持续天数
+        cum = self.nav * np.cumprod(1 + r, axis=0)
+        peak = np.maximum(self.peak, np.maximum.accumulate(np.where(valid, cum, 0.0), axis=0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            dd = np.where(valid, cum / peak - 1, 0.0)
+        self.max_dd = np.minimum(self.max_dd, dd.min(axis=0))
+        day = self.n + np.cumsum(valid, axis=0)
+        high = np.where(valid & (cum >= peak), day, -1.0)
+        last_high = np.maximum(self.last_high, np.maximum.accumulate(high, axis=0))
+        self.max_dd_days = np.maximum(self.max_dd_days, (day - last_high).max(axis=0))
+        self.nav, self.peak, self.last_high, self.n = cum[-1], peak[-1], last_high[-1], n_total
+
+        # 滚动夏普: 接上一块留下的尾部再算, 只取本块对应的行
+        joined = np.vstack([self._tail, returns])
+        roll = rolling_sharpe(joined, self.window)[len(self._tail):]
+        seen = ~np.isnan(roll)
+        if seen.any():
+            self.rolling_min = np.fmin(self.rolling_min, np.nanmin(np.where(seen, roll, np.inf), axis=0))
+            self.rolling_min[np.isinf(self.rolling_min)] = np.nan
+        self.rolling_last = roll[-1]
+        self._tail = joined[-(self.window - 1):] if self.window > 1 else joined[:0]
+
+        if turnover is not None:
+            turnover = np.asarray(turnover, dtype=np.float64).reshape(returns.shape)
+            t_valid = ~np.isnan(turnover)
+            self.turnover_sum += np.where(t_valid, turnover, 0.0).sum(axis=0)
+            self.turnover_n += t_valid.sum(axis=0)
+        return self
+
+    def result(self) -> dict:
+        """{指标名: (运行,) 数组}"""
+        total = self.nav - 1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ann = np.where(self.n > 0, (1 + total) ** (ANNUAL_DAYS / np.maximum(self.n, 1)) - 1, 0.0)
+            std = np.sqrt(self.m2 / (self.n - 1))
+            sharpe = np.where(std > 0, self.mean / std * np.sqrt(ANNUAL_DAYS), 0.0)
+            calmar = np.where(self.max_dd < 0, ann / -self.max_dd, np.nan)
+            turnover = np.where(self.turnover_n > 0, self.turnover_sum / self.turnover_n, np.nan)
+        return dict(zip(METRIC_COLUMNS, (total, ann, sharpe, self.max_dd, self.max_dd_days, calmar,
+                                         self.rolling_last, self.rolling_min, turnover)))
+
+
+def metric_arrays(returns, turnover=None, window: int = ROLLING_WINDOW) -> dict:
+    """(天, 运行) 收益矩阵一次算完, 返回 {指标名: (运行,) 数组}"""
+    returns = np.asarray(returns, dtype=np.float64)
+    if returns.ndim == 1:
+        returns = returns[:, None]
+    return MetricsAccumulator(returns.shape[1], window).update(returns, turnover).result()
+
+
+def evaluate(returns: pd.DataFrame, bench: pd.Series = None, turnover: pd.DataFrame = None,
+             sort_by: str = "sharpe", window: int = ROLLING_WINDOW) -> pd.DataFrame:
+    """
+    returns: index 为日期、每列一次运行的日收益. 返回每次运行一行的指标表, 按 sort_by 降序.
+    给出 bench 时另算超额收益的年化、信息比率和最大回撤 (与 param_sweep / overlays 原有列名一致)
+    """
+    values = returns.to_numpy(dtype=np.float64)
+    table = pd.DataFrame(metric_arrays(values, None if turnover is None else turnover.to_numpy(), window),
+                         index=returns.columns)
+    if bench is not None:
+        excess = metric_arrays(values - bench.reindex(returns.index).to_numpy(dtype=np.float64)[:, None],
+                               window=window)
+        table["excess_annual"] = excess["annual_return"]
+        table["information_ratio"] = excess["sharpe"]
+        table["excess_max_drawdown"] = excess["max_drawdown"]
+    if sort_by:
+        table = table.sort_values(sort_by, ascending=False)
+    return table
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+大盘择时 / 个股止损叠加层
+
+README 里规划的两道防线:
+  - 大盘择时: 沪深300 跌破 20 日均线或 MACD 死叉 (DIF < DEA) 时降仓或空仓;
+  - 个股止损: 持仓单日跌幅超过 5% 时卖出 (盘中触价卖出, 或收盘确认后次日开盘卖出).
+不写新的策略类、不重跑 Qlib 回测, 而是把规则变成布尔掩码和仓位乘数, 叠加到已有回测的每日持仓权重上:
+
+  组合日收益 = e[t] * (sum_i w[t-1, i] * r'[t, i] - 原交易成本 - 止损成本) - 调仓成本
+
+  w: 基础策略收盘后的持仓权重 (fast_backtest.simulate(return_weights=True));
+  r': 止损调整后的个股收益, 止损当天按止损价 (跳空低开按开盘价) 结算, 之后到基础策略卖出为止视为持有现金;
+  e: 大盘择时的仓位乘数, 用 T-1 收盘的信号决定 T 日的仓位, 仓位变动按 open_cost / close_cost 计费.
+
+这是一阶近似: 止损和降仓腾出的现金不再投资, 权重按基础策略的净值计算. deal_price="close" 时不加任何规则的
+"base" 与基础回测的 return - cost 完全一致. 多个规则组合一次批量评估, 几秒即可比较一组回撤控制方案.
+
+用法:
+    python backtest/overlays.py --pred models/walk_forward/pred.pkl
+    python backtest/overlays.py --pred pred.pkl --stop_loss 0.03 0.05 0.08 --exposure 0 0.5 --output overlays.csv
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backtest.fast_backtest import (BENCHMARK, CLOSE_COST, N_DROP, OPEN_COST, QLIB_DATA_DIR, TOPK, PricePanel,
+                                    load_price_panel, run_backtest)
+from backtest.metrics import evaluate
+
+# Config
+MA_WINDOW = 20
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+# 回测首日之前多读的基准收盘价: 均线要满窗口, MACD 的 EWM (adjust=False) 冷启动影响约 3 倍跨度后可忽略
+REGIME_WARMUP = max(MA_WINDOW, 3 * (MACD_SLOW + MACD_SIGNAL))
+STOP_LOSS = 0.05
+STOP_MODES = ("intraday", "next_open")
+
+# 每个方案: ma_window / macd 为择时条件 (任一成立即视为弱势), exposure 为弱势时的仓位乘数,
+# stop_loss 为止损跌幅 (None 表示不止损)
+DEFAULT_VARIANTS = [
+    {"name": "base"},
+    {"name": "ma20_cash", "ma_window": 20, "exposure": 0.0},
+    {"name": "macd_cash", "macd": True, "exposure": 0.0},
+    {"name": "ma20_or_macd_cash", "ma_window": 20, "macd": True, "exposure": 0.0},
+    {"name": "ma20_or_macd_half", "ma_window": 20, "macd": True, "exposure": 0.5},
+    {"name": "stop5_intraday", "stop_loss": 0.05, "stop_mode": "intraday"},
+    {"name": "stop5_next_open", "stop_loss": 0.05, "stop_mode": "next_open"},
+    {"name": "ma20_or_macd_cash+stop5", "ma_window": 20, "macd": True, "exposure": 0.0, "stop_loss": 0.05},
+]
+
+
+def regime_mask(bench_close: np.ndarray, ma_window=None, macd=False) -> np.ndarray:
+    """基准收盘价 -> 每日是否处于弱势 (True 表示降仓). 只用当天及以前的数据"""
+    close = pd.Series(bench_close, dtype=np.float64).ffill()
+    mask = np.zeros(len(close), dtype=bool)
+    if ma_window:
+        ma = close.rolling(ma_window, min_periods=ma_window).mean()
+        mask |= (close < ma).to_numpy()
+    if macd:
+        dif = close.ewm(span=MACD_FAST, adjust=False).mean() - close.ewm(span=MACD_SLOW, adjust=False).mean()
+        dea = dif.ewm(span=MACD_SIGNAL, adjust=False).mean()
+        mask |= (dif < dea).to_numpy()
+    return mask
+
+
+def exposure_series(mask: np.ndarray, exposure: float) -> np.ndarray:
+    """弱势掩码 -> 仓位乘数. T-1 收盘的信号决定 T 日的仓位, 首日满仓"""
+    e = np.where(mask, exposure, 1.0)
+    return np.concatenate([[1.0], e[:-1]])
+
+
+def stop_loss_returns(weights: np.ndarray, open_: np.ndarray, low: np.ndarray, close: np.ndarray,
+                      threshold=STOP_LOSS, mode="intraday", close_cost=CLOSE_COST):
+    """
+    weights: (n+1, stocks) 收盘后持仓权重, 第 0 行为回测首日的前一天; open_/low/close 同形状.
+    返回 (长度 n 的组合毛收益, 长度 n 的止损卖出成本), 第 k 个元素对应第 k+1 行的交易日.
+    threshold=None 时不止损, 等于 sum_i w[t-1, i] * r[t, i].
+    """
+    held = weights > 0
+    prev_w = weights[:-1]
+    px = pd.DataFrame(close).ffill().to_numpy()  # 停牌日价格不变, 与 Qlib 持仓估值一致
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ret = np.nan_to_num(px[1:] / px[:-1] - 1)
+    if threshold is None:
+        return np.einsum("ij,ij->i", prev_w, ret), np.zeros(len(ret))
+
+    prev_px = px[:-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if mode == "intraday":
+            trigger = low[1:] / prev_px - 1 <= -threshold
+        elif mode == "next_open":
+            trigger = ret <= -threshold
+        else:
+            raise ValueError(f"未知的止损方式: {mode}, 可选 {STOP_MODES}")
+    trigger &= held[:-1]
+
+    # 按持仓区间统计触发次数: h 为累计触发数, level 为当前持仓区间开始时的 h
+    h = np.vstack([np.zeros((1, held.shape[1]), dtype=np.int64), np.cumsum(trigger, axis=0)])
+    entry = held & ~np.vstack([np.zeros((1, held.shape[1]), dtype=bool), held[:-1]])
+    level = np.maximum.accumulate(np.where(entry, h, 0), axis=0)
+    # 第 t 天 (t >= 1) 之前, 在 t-1 所在的持仓区间里已经触发的次数
+    before = h[:-1] - level[:-1]
+
+    exit_ret = np.zeros_like(ret)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if mode == "intraday":
+            stop_px = prev_px * (1 - threshold)
+            fill = np.fmin(open_[1:], stop_px)  # 跳空低开时只能按开盘价成交
+            stop_today = trigger & (before == 0)
+            out = before >= 1
+            exit_ret = np.where(stop_today, fill / prev_px - 1, 0.0)
+        else:
+            # 收盘确认跌破, 次日开盘卖出
+            prev_trigger = np.vstack([np.zeros((1, ret.shape[1]), dtype=bool), trigger[:-1]])
+            stop_today = (before == 1) & prev_trigger
+            out = (before >= 1) & ~stop_today
+            fill = np.where(np.isnan(open_[1:]), px[1:], open_[1:])
+            exit_ret = np.where(stop_today, fill / prev_px - 1, 0.0)
+    adj = np.where(stop_today, exit_ret, np.where(out, 0.0, ret))
+    adj = np.nan_to_num(adj)
+    gross = np.einsum("ij,ij->i", prev_w, adj)
+    stop_cost = close_cost * np.einsum("ij,ij->i", prev_w, np.where(stop_today, 1 + np.nan_to_num(exit_ret), 0.0))
+    return gross, stop_cost
+
+
+def apply_overlays(report: pd.DataFrame, weights: np.ndarray, open_, low, close, bench_close,
+                   variants=DEFAULT_VARIANTS, open_cost=OPEN_COST, close_cost=CLOSE_COST) -> pd.DataFrame:
+    """
+    report / weights: 基础回测的结果 (simulate(return_weights=True));
+    open_/low/close: (n+1, stocks) 行情, 第 0 行为回测首日的前一天;
+    bench_close: 基准收盘价, 末尾 n+1 个与行情对齐, 之前可以带更早的历史 (load_ohlc 的 warmup) 用于均线和 MACD 预热.
+    返回每个方案的日收益 (已扣成本), 列为方案名.
+    """
+    weights = np.vstack([np.zeros((1, weights.shape[1])), weights])
+    base_cost = report["cost"].to_numpy()
+    invested = weights[:-1].sum(axis=1)
+
+    stock_part, regime = {}, {}
+    out = {}
+    for v in variants:
+        stop_key = (v.get("stop_loss"), v.get("stop_mode", "intraday"))
+        if stop_key not in stock_part:
+            stock_part[stop_key] = stop_loss_returns(weights, open_, low, close, stop_key[0], stop_key[1], close_cost)
+        gross, stop_cost = stock_part[stop_key]
+
+        regime_key = (v.get("ma_window"), bool(v.get("macd")))
+        if regime_key not in regime:
+            regime[regime_key] = regime_mask(bench_close, *regime_key)[-len(report):]
+        e = exposure_series(regime[regime_key], v.get("exposure", 1.0))
+        de = np.diff(np.concatenate([[1.0], e]))
+        switch_cost = invested * (np.clip(de, 0, None) * open_cost + np.clip(-de, 0, None) * close_cost)
+        out[v["name"]] = e * (gross - base_cost - stop_cost) - switch_cost
+
+    return pd.DataFrame(out, index=report.index)
+
+
+def build_variants(ma_windows=(MA_WINDOW,), exposures=(0.0,), stop_losses=(STOP_LOSS,), stop_modes=STOP_MODES) -> list:
+    """择时 (均线或 MACD 死叉) x 弱势仓位 x 止损的全部组合, 外加只择时、只止损和不加规则的对照"""
+    variants = [{"name": "base"}]
+    regimes = [{"ma_window": w, "macd": True} for w in ma_windows]
+    for r in regimes:
+        for e in exposures:
+            variants.append({"name": f"ma{r['ma_window']}_or_macd_x{e:g}", **r, "exposure": e})
+    for s in stop_losses:
+        for m in stop_modes:
+            variants.append({"name": f"stop{s:g}_{m}", "stop_loss": s, "stop_mode": m})
+            for r in regimes:
+                for e in exposures:
+                    variants.append({"name": f"ma{r['ma_window']}_or_macd_x{e:g}+stop{s:g}_{m}",
+                                     **r, "exposure": e, "stop_loss": s, "stop_mode": m})
+    return variants
+
+
+def summarize(returns: pd.DataFrame, bench: pd.Series) -> pd.DataFrame:
+    """各叠加方案的指标一次算完 (backtest/metrics.py), 每个方案一行"""
+    table = evaluate(returns, bench=bench, sort_by=None)
+    table.index.name = "variant"
+    return table
+
+
+def load_ohlc(panel: PricePanel, start: int, stop: int, benchmark=BENCHMARK, warmup=REGIME_WARMUP):
+    """
+    panel.dates[start-1:stop] 上的 $open/$low/$close 矩阵和基准收盘价. 调用前需要先 qlib.init
+    基准收盘价额外带上之前 warmup 个交易日, 回测开头几周的均线和 MACD 信号才与连续计算时一致
+    """
+    from qlib.data import D
+
+    dates = panel.dates[start - 1:stop]
+    df = D.features(list(panel.codes), ["$open", "$low"], start_time=dates[0], end_time=dates[-1])
+    d_idx = dates.get_indexer(df.index.get_level_values("datetime"))
+    s_idx = panel.codes.get_indexer(df.index.get_level_values("instrument"))
+    keep = d_idx >= 0
+    mats = []
+    for col in df.columns:
+        mat = np.full((len(dates), len(panel.codes)), np.nan)
+        mat[d_idx[keep], s_idx[keep]] = df[col].to_numpy(dtype=np.float64)[keep]
+        mats.append(mat)
+    calendar = pd.DatetimeIndex(D.calendar(end_time=dates[-1]))
+    bench_dates = calendar[max(int(calendar.searchsorted(dates[0])) - warmup, 0):]
+    bench = D.features([benchmark], ["$close"], start_time=bench_dates[0], end_time=bench_dates[-1])
+    bench_close = bench.droplevel("instrument").iloc[:, 0].reindex(bench_dates).to_numpy(dtype=np.float64)
+    return mats[0], mats[1], panel.close[start - 1:stop], bench_close
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="大盘择时 / 个股止损叠加层批量评估")
+    parser.add_argument("--pred", required=True, help="预测文件 (pred.pkl)")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--topk", type=int, default=TOPK)
+    parser.add_argument("--n_drop", type=int, default=N_DROP)
+    parser.add_argument("--ma_window", type=int, nargs="+", default=None, help="给出任一网格参数时按网格生成方案")
+    parser.add_argument("--exposure", type=float, nargs="+", default=None)
+    parser.add_argument("--stop_loss", type=float, nargs="+", default=None)
+    parser.add_argument("--output", default=None, help="保存各方案日收益 (csv)")
+    args = parser.parse_args()
+
+    import qlib
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+    pred = pd.read_pickle(args.pred)
+    pred_dates = pred.index.get_level_values("datetime")
+    start_time = args.start or str(pred_dates.min().date())
+    end_time = args.end or str(pred_dates.max().date())
+
+    t0 = time.time()
+    panel = load_price_panel(start_time, end_time)
+    panel = panel.extend(pred.index.get_level_values("instrument").unique())
+    report, weights = run_backtest(pred, panel, start_time, end_time, topk=args.topk, n_drop=args.n_drop,
+                                   return_weights=True)
+    start = int(panel.dates.get_indexer([report.index[0]])[0])
+    if args.ma_window or args.exposure or args.stop_loss:
+        variants = build_variants(args.ma_window or (MA_WINDOW,), args.exposure or (0.0,), args.stop_loss or (STOP_LOSS,))
+    else:
+        variants = DEFAULT_VARIANTS
+    warmup = max([REGIME_WARMUP] + [v.get("ma_window") or 0 for v in variants])
+    open_, low, close, bench_close = load_ohlc(panel, start, start + len(report), warmup=warmup)
+    t1 = time.time()
+    returns = apply_overlays(report, weights, open_, low, close, bench_close, variants)
+    t2 = time.time()
+    print(f"基础回测 + 行情 {t1 - t0:.2f}s, {len(variants)} 个方案叠加 {t2 - t1:.3f}s")
+
+    table = summarize(returns, report["bench"].astype(np.float64))
+    print(table.sort_values("max_drawdown", ascending=False).to_string(float_format=lambda v: f"{v:.4f}"))
+    if args.output:
+        returns.to_csv(args.output)
+        print(f"各方案日收益已保存: {args.output}")
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+策略 / 撮合参数网格回测
+
+对同一份预测 (pred.pkl) 扫描 topk、n_drop、hold_thresh、limit_threshold、deal_price 的全部组合,
+不重新训练模型. 行情面板和分数矩阵只加载一次, 放进共享内存, 各子进程只读挂载 (不复制),
+每个组合用 fast_backtest 的向量化回测跑一遍, 最后汇总成一张对比表.
+
+用法:
+    python backtest/param_sweep.py --pred models/walk_forward/pred.pkl --workers 8
+    python backtest/param_sweep.py --pred pred.pkl --topk 5 10 --n_drop 1 5 --deal_price close open
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backtest.fast_backtest import (BENCHMARK, MARKET, QLIB_DATA_DIR, PricePanel, limit_arg, load_price_panel,
+                                    score_matrix, simulate)
+from backtest.metrics import evaluate
+from data_processing.shared_arrays import attach, release, to_shared
+
+# Config: 默认网格 5 x 5 x 2 x 2 x 2 = 200 个组合
+TOPK_GRID = [5, 10, 20, 30, 50]
+N_DROP_GRID = [1, 2, 3, 5, 10]
+HOLD_THRESH_GRID = [1, 2]
+LIMIT_THRESHOLD_GRID = [0.095, "board"]  # "board": data_processing/tradability.py 的分板块涨跌停位图
+DEAL_PRICE_GRID = ["close", "open"]
+OUTPUT_PATH = Path("backtest/param_sweep.csv")
+
+PARAM_NAMES = ["topk", "n_drop", "hold_thresh", "limit_threshold", "deal_price"]
+
+_SHARED = {}
+
+
+def _init_worker(specs, dates, codes, round_lot, start_time, end_time):
+    # 子进程只按名字挂载共享内存, 面板和分数矩阵都不复制
+    arrays = {}
+    for name, spec in specs.items():
+        shm, arrays[name] = attach(spec)
+        _SHARED.setdefault("shm", []).append(shm)
+    _SHARED["scores"] = arrays.pop("scores")
+    _SHARED["panel"] = PricePanel.from_arrays(dates, codes, arrays, round_lot)
+    _SHARED["range"] = (start_time, end_time)
+
+
+def summarize(reports: list) -> pd.DataFrame:
+    """全部回测的汇总指标一次算完 (backtest/metrics.py), 收益扣除交易成本, 每次回测一行"""
+    net = pd.DataFrame({i: r["return"] - r["cost"] for i, r in enumerate(reports)})
+    turnover = pd.DataFrame({i: r["turnover"] for i, r in enumerate(reports)})
+    table = evaluate(net, bench=reports[0]["bench"], turnover=turnover, sort_by=None)
+    table["total_cost"] = [r["total_cost"].iloc[-1] for r in reports]
+    table["final_account"] = [r["account"].iloc[-1] for r in reports]
+    return table
+
+
+def _run_point(params: dict):
+    t0 = time.time()
+    start_time, end_time = _SHARED["range"]
+    report = simulate(_SHARED["scores"], _SHARED["panel"], start_time, end_time, **params)
+    return {**params, "seconds": time.time() - t0}, report
+
+
+def build_grid(**grid) -> list:
+    """{参数名: 取值列表} -> 全部组合的参数字典列表"""
+    return [dict(zip(PARAM_NAMES, values)) for values in itertools.product(*(grid[n] for n in PARAM_NAMES))]
+
+
+def run_sweep(pred, grid: list, start_time, end_time, workers=None, market=MARKET) -> pd.DataFrame:
+    t0 = time.time()
+    deal_prices = sorted({p["deal_price"] for p in grid})
+    bitmap = None
+    if any(p["limit_threshold"] == "board" for p in grid):
+        from data_processing.tradability import BITMAP_PATH, TradabilityBitmap
+
+        if not BITMAP_PATH.exists():
+            raise FileNotFoundError(f'limit_threshold="board" 需要涨跌停位图 {BITMAP_PATH}, '
+                                    f"请先运行 python data_processing/tradability.py")
+        bitmap = TradabilityBitmap.load()
+    panel = load_price_panel(start_time, end_time, market=market, deal_prices=deal_prices, bitmap=bitmap)
+    panel = panel.extend(pred.index.get_level_values("instrument").unique())
+    scores = score_matrix(pred, panel)
+    print(f"面板 {len(panel.dates)} 天 x {len(panel.codes)} 只, 加载耗时 {time.time() - t0:.1f}s")
+
+    arrays = {**panel.arrays(), "scores": scores}
+    shared = {name: to_shared(arr) for name, arr in arrays.items()}
+    specs = {name: spec for name, (_, spec) in shared.items()}
+    del arrays, scores
+
+    workers = workers or min(len(grid), os.cpu_count() or 1)
+    print(f"参数组合 {len(grid)} 个, {workers} 个进程")
+    rows, reports = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(specs, panel.dates, panel.codes, panel.round_lot,
+                                           start_time, end_time)) as executor:
+            futures = [executor.submit(_run_point, params) for params in grid]
+            for i, future in enumerate(as_completed(futures), 1):
+                row, report = future.result()
+                rows.append(row)
+                reports.append(report)
+                if i % 20 == 0 or i == len(grid):
+                    print(f" [{i}/{len(grid)}] 已完成, 累计 {time.time() - t0:.1f}s")
+    finally:
+        release(shm for shm, _ in shared.values())
+
+    table = pd.concat([pd.DataFrame(rows), summarize(reports).reset_index(drop=True)], axis=1)
+    table = table.sort_values("sharpe", ascending=False, ignore_index=True)
+    print(f"网格回测完成, 总耗时 {time.time() - t0:.1f}s")
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="策略参数网格回测")
+    parser.add_argument("--pred", required=True, help="预测文件 (pred.pkl)")
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--topk", type=int, nargs="+", default=TOPK_GRID)
+    parser.add_argument("--n_drop", type=int, nargs="+", default=N_DROP_GRID)
+    parser.add_argument("--hold_thresh", type=int, nargs="+", default=HOLD_THRESH_GRID)
+    parser.add_argument("--limit_threshold", type=limit_arg, nargs="+", default=LIMIT_THRESHOLD_GRID)
+    parser.add_argument("--deal_price", nargs="+", default=DEAL_PRICE_GRID, choices=["close", "open"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=str(OUTPUT_PATH))
+    args = parser.parse_args()
+
+    import qlib
+
+    from data_processing.tradability import BITMAP_PATH
+
+    limit_thresholds = args.limit_threshold
+    if args.limit_threshold is LIMIT_THRESHOLD_GRID and not BITMAP_PATH.exists():
+        # 默认网格: 没有位图时跳过 "board", 显式指定时仍在 run_sweep 中报错
+        limit_thresholds = [t for t in LIMIT_THRESHOLD_GRID if t != "board"]
+        print(f"提示: 未找到涨跌停位图 {BITMAP_PATH}, 跳过 limit_threshold=board "
+              f"(先运行 python data_processing/tradability.py)")
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+    pred = pd.read_pickle(args.pred)
+    if isinstance(pred, pd.DataFrame):
+        pred = pred.iloc[:, 0]
+    pred_dates = pred.index.get_level_values("datetime")
+    start = args.start or str(pred_dates.min().date())
+    end = args.end or str(pred_dates.max().date())
+
+    grid = build_grid(topk=args.topk, n_drop=args.n_drop, hold_thresh=args.hold_thresh,
+                      limit_threshold=limit_thresholds, deal_price=args.deal_price)
+    table = run_sweep(pred, grid, start, end, workers=args.workers)
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(args.output, index=False, float_format="%.6g")
+    print(f"基准: {BENCHMARK}, 对比表已保存: {args.output}")
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(table.head(10).to_string(index=False, float_format=lambda v: f"{v:.4f}"))
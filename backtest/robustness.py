@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+回测收益稳健性分析: 块自助法 / 随机区间 / Top-K 扰动
+
+README 中的年化收益和夏普只来自一条回测路径. 这里对同一份日收益做几千次重抽样, 给出
+calculate_metrics 四个指标 (累计收益、年化收益、夏普、最大回撤) 的置信区间:
+
+  - bootstrap: 循环块自助法, 每次按 BLOCK_SIZE 天的整块随机拼出与原序列等长的路径, 保留短期自相关;
+  - window:    随机起止日期的子区间 (至少 MIN_WINDOW 天), 检验结果是否依赖回测区间的选取;
+  - topk:      (需要 --pred) 改变 topk 并给预测分数加噪声, 用 fast_backtest 重新回测, 检验对选股边界的敏感度.
+
+所有样本排成 (样本数 x 天数) 的矩阵, 用 backtest/metrics.py 一次算完指标 (与 calculate_metrics 逐行一致),
+样本按块分给多个进程.
+
+用法:
+    python backtest/robustness.py                                  # 读 mlruns 中最新的 report_normal_1day.pkl
+    python backtest/robustness.py --report report.pkl --n_bootstrap 10000 --workers 8
+    python backtest/robustness.py --report report.pkl --pred pred.pkl   # 加上 Top-K 扰动
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backtest.metrics import metric_arrays
+from backtest.visualize_results import calculate_metrics, find_latest_report
+from data_processing.shared_arrays import attach, release, to_shared
+
+# Config
+N_BOOTSTRAP = 5000
+BLOCK_SIZE = 10  # 约两周, 保留收益的短期自相关
+N_WINDOWS = 2000
+MIN_WINDOW = 60
+TOPK_DELTAS = [-2, -1, 0, 1, 2]
+SCORE_NOISE = [0.0, 0.1, 0.3]  # 噪声标准差, 以当日分数的横截面标准差为单位
+N_NOISE_SEEDS = 10
+CONFIDENCE = 0.95
+CHUNK_SIZE = 500
+SEED = 42
+
+METRIC_NAMES = ["total_return", "annual_return", "sharpe", "max_drawdown"]
+
+
+def batch_metrics(returns: np.ndarray) -> dict:
+    """
+    returns: (样本, 天) 的日收益矩阵, 较短的样本在末尾用 NaN 补齐.
+    返回 {指标名: (样本,) 数组}, 口径与 visualize_results.calculate_metrics 相同
+    """
+    metrics = metric_arrays(returns.T)
+    return {name: metrics[name] for name in METRIC_NAMES}
+
+
+def block_bootstrap(returns: np.ndarray, n: int, block_size: int, rng: np.random.Generator) -> np.ndarray:
+    """循环块自助法: 返回 (n, T) 的重抽样路径"""
+    t = len(returns)
+    n_blocks = -(-t // block_size)
+    starts = rng.integers(0, t, size=(n, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block_size)).reshape(n, -1)[:, :t] % t
+    return returns[idx]
+
+
+def random_windows(returns: np.ndarray, n: int, min_len: int, rng: np.random.Generator) -> np.ndarray:
+    """随机起止日期的子区间: 返回 (n, T) 矩阵, 每行是一个区间, 末尾 NaN 补齐"""
+    t = len(returns)
+    min_len = min(min_len, t)
+    starts = rng.integers(0, t - min_len + 1, size=n)
+    lengths = rng.integers(min_len, t - starts + 1)
+    offset = np.arange(t)
+    idx = np.minimum(starts[:, None] + offset, t - 1)
+    return np.where(offset < lengths[:, None], returns[idx], np.nan)
+
+
+def _resample_chunk(method: str, returns: np.ndarray, n: int, param: int, seed) -> dict:
+    rng = np.random.default_rng(seed)
+    if method == "bootstrap":
+        paths = block_bootstrap(returns, n, param, rng)
+    else:
+        paths = random_windows(returns, n, param, rng)
+    return batch_metrics(paths)
+
+
+def resample_metrics(returns: np.ndarray, method: str, n: int, param: int, workers=None, seed=SEED) -> dict:
+    """把 n 个样本按 CHUNK_SIZE 分块交给多个进程, 合并各块的指标数组"""
+    sizes = [min(CHUNK_SIZE, n - i) for i in range(0, n, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = workers or min(len(sizes), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(_resample_chunk, [method] * len(sizes), [returns] * len(sizes), sizes,
+                                  [param] * len(sizes), seeds))
+    return {m: np.concatenate([p[m] for p in parts]) for m in METRIC_NAMES}
+
+
+# ---- Top-K 扰动: 行情面板和分数矩阵放进共享内存, 与 param_sweep.py 相同 ----
+_SHARED = {}
+
+
+def _init_worker(specs, dates, codes, round_lot, start_time, end_time, net):
+    from backtest.fast_backtest import PricePanel
+
+    arrays = {}
+    for name, spec in specs.items():
+        shm, arrays[name] = attach(spec)
+        _SHARED.setdefault("shm", []).append(shm)
+    scores = arrays.pop("scores")
+    with np.errstate(invalid="ignore"):
+        _SHARED["score_std"] = np.nan_to_num(np.nanstd(scores, axis=1))[:, None]
+    _SHARED["scores"] = scores
+    _SHARED["panel"] = PricePanel.from_arrays(dates, codes, arrays, round_lot)
+    _SHARED.update(range=(start_time, end_time), net=net)
+
+
+def _run_perturbed(topk: int, n_drop: int, noise: float, seed: int) -> np.ndarray:
+    from backtest.fast_backtest import simulate
+
+    scores = _SHARED["scores"]
+    if noise > 0:
+        rng = np.random.default_rng(seed)
+        scores = scores + rng.standard_normal(scores.shape) * _SHARED["score_std"] * noise
+    report = simulate(scores, _SHARED["panel"], *_SHARED["range"], topk=topk, n_drop=n_drop)
+    r = report["return"] - report["cost"] if _SHARED["net"] else report["return"]
+    return r.to_numpy()
+
+
+def topk_perturbation(pred, start_time, end_time, topk: int, n_drop: int, deltas=TOPK_DELTAS, noises=SCORE_NOISE,
+                      n_seeds=N_NOISE_SEEDS, net=False, workers=None) -> dict:
+    """topk ± delta 与分数噪声的全部组合各回测一次 (无噪声时只跑一次), 返回各指标数组"""
+    from backtest.fast_backtest import load_price_panel, score_matrix
+
+    panel = load_price_panel(start_time, end_time)
+    panel = panel.extend(pred.index.get_level_values("instrument").unique())
+    arrays = {**panel.arrays(), "scores": score_matrix(pred, panel)}
+    shared = {name: to_shared(arr) for name, arr in arrays.items()}
+    specs = {name: spec for name, (_, spec) in shared.items()}
+    del arrays
+
+    tasks = [(topk + d, n_drop, noise, seed)
+             for d in deltas if topk + d > 0
+             for noise in noises
+             for seed in (range(n_seeds) if noise > 0 else [0])]
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(specs, panel.dates, panel.codes, panel.round_lot,
+                                           start_time, end_time, net)) as executor:
+            paths = list(executor.map(_run_perturbed, *zip(*tasks)))
+    finally:
+        release(shm for shm, _ in shared.values())
+    return batch_metrics(np.vstack(paths))
+
+
+def confidence_table(results: dict, point: dict, confidence=CONFIDENCE) -> pd.DataFrame:
+    """{方法: {指标: 样本数组}} -> 每个 (方法, 指标) 的点估计、均值、分位数区间和小于 0 的概率"""
+    lo_q, hi_q = (1 - confidence) / 2, (1 + confidence) / 2
+    rows = []
+    for method, metrics in results.items():
+        for name in METRIC_NAMES:
+            values = metrics[name]
+            rows.append({
+                "method": method, "metric": name, "point": point[name], "mean": values.mean(),
+                "std": values.std(ddof=1), f"p{lo_q * 100:g}": np.quantile(values, lo_q),
+                "median": np.median(values), f"p{hi_q * 100:g}": np.quantile(values, hi_q),
+                "prob_below_zero": (values < 0).mean(), "n": len(values),
+            })
+    return pd.DataFrame(rows).set_index(["method", "metric"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回测收益稳健性分析 (块自助法 / 随机区间 / Top-K 扰动)")
+    parser.add_argument("--report", default=None, help="report_normal_1day.pkl, 默认取 mlruns 中最新的一份")
+    parser.add_argument("--pred", default=None, help="可选: 预测文件, 提供时加做 Top-K 扰动")
+    parser.add_argument("--net", action="store_true", help="使用扣除交易成本后的收益 (默认与 visualize_results 一致用 return)")
+    parser.add_argument("--n_bootstrap", type=int, default=N_BOOTSTRAP)
+    parser.add_argument("--block_size", type=int, default=BLOCK_SIZE)
+    parser.add_argument("--n_windows", type=int, default=N_WINDOWS)
+    parser.add_argument("--min_window", type=int, default=MIN_WINDOW)
+    parser.add_argument("--topk", type=int, default=None, help="Top-K 扰动的基准 topk, 默认同 fast_backtest")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="保存置信区间表 (csv)")
+    args = parser.parse_args()
+
+    report_path = args.report or find_latest_report()
+    if not report_path:
+        raise SystemExit("未找到回测报告文件！")
+    report = pd.read_pickle(report_path)
+    series = report["return"] - report["cost"] if args.net else report["return"]
+    returns = series.to_numpy(dtype=np.float64)
+    print(f"回测报告: {report_path} ({len(returns)} 个交易日)")
+
+    # 单条路径的点估计, 直接用 calculate_metrics
+    point = dict(zip(METRIC_NAMES, calculate_metrics(series, (series + 1).cumprod())))
+
+    t0 = time.time()
+    results = {
+        "bootstrap": resample_metrics(returns, "bootstrap", args.n_bootstrap, args.block_size, args.workers),
+        "window": resample_metrics(returns, "window", args.n_windows, args.min_window, args.workers),
+    }
+    print(f"重抽样 {args.n_bootstrap} + {args.n_windows} 条路径, 耗时 {time.time() - t0:.2f}s")
+
+    if args.pred:
+        import qlib
+        from backtest.fast_backtest import N_DROP, QLIB_DATA_DIR, TOPK
+
+        qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+        pred = pd.read_pickle(args.pred)
+        t0 = time.time()
+        results["topk"] = topk_perturbation(pred, str(report.index[0].date()), str(report.index[-1].date()),
+                                            args.topk or TOPK, N_DROP, net=args.net, workers=args.workers)
+        print(f"Top-K 扰动 {len(results['topk']['sharpe'])} 次回测, 耗时 {time.time() - t0:.2f}s")
+
+    table = confidence_table(results, point)
+    with pd.option_context("display.width", 200):
+        print(table.to_string(float_format=lambda v: f"{v:.4f}"))
+    if args.output:
+        table.to_csv(args.output)
+        print(f"置信区间表已保存: {args.output}")
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+回测实验目录 (SQLite)
+
+visualize_results.find_latest_report 原来要 os.walk 整个 mlruns 目录、逐个 stat 文件,
+实验越多越慢, 而且只能找到最新的一次. backtest_washout.py 回测结束后把这次运行登记到
+本地 SQLite: run_id、实验名、配置哈希、报告/预测路径和事先算好的主要指标;
+之后列出、筛选、对比几百次运行都是带索引的查询, 不再扫描目录.
+
+用法:
+    python backtest/run_catalog.py --list --limit 20
+    python backtest/run_catalog.py --list --experiment washout_strategy_rank --min_sharpe 1.0 --order annual_return
+    python backtest/run_catalog.py --compare <run_id> <run_id>
+    python backtest/run_catalog.py --rebuild   # 一次性扫描 mlruns, 登记目录建立之前的历史运行
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Config
+MLRUNS_DIR = Path("mlruns")
+CATALOG_PATH = MLRUNS_DIR / "run_catalog.db"
+REPORT_REL = Path("artifacts/portfolio_analysis/report_normal_1day.pkl")
+PRED_REL = Path("artifacts/pred.pkl")
+
+METRIC_COLUMNS = [
+    "total_return", "annual_return", "sharpe", "max_drawdown",
+    "net_annual_return", "bench_annual_return", "excess_annual_return", "turnover", "total_cost",
+]
+# 允许排序的列, 防止 --order 拼进 SQL 时注入
+ORDER_COLUMNS = set(METRIC_COLUMNS) | {"created_at", "start_date", "end_date"}
+
+
+def _read_meta(path: Path) -> dict:
+    """mlruns 的 meta.yaml 只有一层 key: value, 逐行解析即可, 不依赖 yaml"""
+    meta = {}
+    if path.exists():
+        for line in path.read_text(encoding="utf-8").splitlines():
+            key, sep, value = line.partition(":")
+            if sep and not line.startswith(" "):
+                meta[key.strip()] = value.strip().strip("'")
+    return meta
+
+
+def config_hash(config) -> str:
+    """回测/模型配置的哈希, 配置相同的运行哈希相同 (键顺序无关)"""
+    raw = json.dumps(config, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def headline_metrics(report: pd.DataFrame) -> dict:
+    """与 visualize_results 同口径的主要指标 (策略用 return, 另附扣费后年化和基准/超额年化)"""
+    from backtest.visualize_results import calculate_metrics
+
+    total, ann, sharpe, mdd = calculate_metrics(report["return"], (report["return"] + 1).cumprod())
+    net = report["return"] - report["cost"]
+    excess = report["return"] - report["bench"]
+    return {
+        "total_return": total, "annual_return": ann, "sharpe": sharpe, "max_drawdown": mdd,
+        "net_annual_return": calculate_metrics(net, (net + 1).cumprod())[1],
+        "bench_annual_return": calculate_metrics(report["bench"], (report["bench"] + 1).cumprod())[1],
+        "excess_annual_return": calculate_metrics(excess, (excess + 1).cumprod())[1],
+        "turnover": report["turnover"].mean(),
+        "total_cost": report["total_cost"].iloc[-1] if "total_cost" in report else report["cost"].sum(),
+    }
+
+
+class RunCatalog:
+    """SQLite 运行目录: 每次回测一行, 指标列单独存放以便筛选排序"""
+
+    def __init__(self, path: Path = CATALOG_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        metric_defs = ", ".join(f"{name} REAL" for name in METRIC_COLUMNS)
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY, experiment TEXT, created_at TEXT, config_hash TEXT, config TEXT,
+                report_path TEXT, pred_path TEXT, start_date TEXT, end_date TEXT, n_days INTEGER,
+                {metric_defs}
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (experiment, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_config ON runs (config_hash)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_sharpe ON runs (sharpe)")
+        self.conn.commit()
+
+    def add(self, run_id: str, experiment: str, report_path, config=None, pred_path=None,
+            report: pd.DataFrame = None, created_at: str = None) -> dict:
+        """登记一次运行; report 未传入时从 report_path 读取, 用来算指标和回测区间"""
+        report_path = Path(report_path).resolve()
+        if report is None:
+            report = pd.read_pickle(report_path)
+        record = {
+            "run_id": run_id, "experiment": experiment,
+            "created_at": created_at or time.strftime("%Y-%m-%d %H:%M:%S"),
+            "config_hash": config_hash(config) if config is not None else None,
+            "config": json.dumps(config, default=str, ensure_ascii=False) if config is not None else None,
+            "report_path": str(report_path),
+            "pred_path": str(Path(pred_path).resolve()) if pred_path else None,
+            "start_date": str(report.index[0].date()), "end_date": str(report.index[-1].date()),
+            "n_days": len(report),
+            **{k: float(v) for k, v in headline_metrics(report).items()},
+        }
+        columns = ", ".join(record)
+        placeholders = ", ".join("?" * len(record))
+        self.conn.execute(f"INSERT OR REPLACE INTO runs ({columns}) VALUES ({placeholders})", tuple(record.values()))
+        self.conn.commit()
+        return record
+
+    def latest(self, experiment: str = None):
+        """最新一次运行的报告路径, 没有记录时返回 None"""
+        sql = "SELECT report_path FROM runs"
+        params = ()
+        if experiment:
+            sql += " WHERE experiment = ?"
+            params = (experiment,)
+        row = self.conn.execute(sql + " ORDER BY created_at DESC, rowid DESC LIMIT 1", params).fetchone()
+        return row[0] if row else None
+
+    def query(self, experiment: str = None, config_hash: str = None, min_sharpe: float = None, since: str = None,
+              order: str = "created_at", limit: int = None) -> pd.DataFrame:
+        """按实验名 / 配置哈希 / 夏普下限 / 起始时间筛选, 按 order 列降序"""
+        if order not in ORDER_COLUMNS:
+            raise ValueError(f"不支持按 {order} 排序, 可选: {sorted(ORDER_COLUMNS)}")
+        conditions, params = [], []
+        for clause, value in (("experiment = ?", experiment), ("config_hash = ?", config_hash),
+                              ("sharpe >= ?", min_sharpe), ("created_at >= ?", since)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        sql = "SELECT * FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {order} DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def compare(self, run_ids: list) -> pd.DataFrame:
+        """几次运行的指标并排 (列为 run_id)"""
+        placeholders = ", ".join("?" * len(run_ids))
+        df = pd.read_sql_query(f"SELECT * FROM runs WHERE run_id IN ({placeholders})", self.conn, params=run_ids)
+        columns = ["experiment", "created_at", "config_hash", "start_date", "end_date"] + METRIC_COLUMNS
+        return df.set_index("run_id").reindex(run_ids)[columns].T
+
+    def rebuild(self, mlruns_dir: Path = MLRUNS_DIR) -> int:
+        """扫描 mlruns (<实验id>/<run_id>/artifacts/...), 登记目录中还没有的历史运行"""
+        known = {row[0] for row in self.conn.execute("SELECT run_id FROM runs")}
+        added = 0
+        for exp_dir in Path(mlruns_dir).iterdir():
+            if not exp_dir.is_dir():
+                continue
+            experiment = _read_meta(exp_dir / "meta.yaml").get("name", exp_dir.name)
+            for run_dir in exp_dir.iterdir():
+                if run_dir.name in known or not run_dir.is_dir():
+                    continue
+                # artifacts 可能不在 run 目录下 (实验的 artifact_location 指向别处), 以 meta.yaml 为准
+                artifact_uri = _read_meta(run_dir / "meta.yaml").get("artifact_uri", "")
+                artifact_dir = Path(artifact_uri[len("file://"):]) if artifact_uri.startswith("file://") else None
+                artifact_dir = artifact_dir or run_dir / "artifacts"
+                report_path = artifact_dir / REPORT_REL.relative_to("artifacts")
+                if not report_path.exists():
+                    continue
+                pred_path = artifact_dir / PRED_REL.relative_to("artifacts")
+                created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(report_path)))
+                self.add(run_dir.name, experiment, report_path, pred_path=pred_path if pred_path.exists() else None,
+                         created_at=created_at)
+                added += 1
+        return added
+
+    def close(self):
+        self.conn.close()
+
+
+def record_run(recorder, experiment: str, config: dict, catalog_path: Path = CATALOG_PATH) -> dict:
+    """backtest_washout.py 回测结束后调用: 按 Qlib recorder 的本地目录登记这次运行"""
+    run_dir = Path(recorder.get_local_dir())
+    pred_path = run_dir / PRED_REL
+    catalog = RunCatalog(catalog_path)
+    try:
+        return catalog.add(recorder.id, experiment, run_dir / REPORT_REL, config=config,
+                           pred_path=pred_path if pred_path.exists() else None)
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回测实验目录")
+    parser.add_argument("--catalog", default=str(CATALOG_PATH))
+    parser.add_argument("--list", action="store_true", help="列出运行 (可配合筛选条件)")
+    parser.add_argument("--experiment", default=None)
+    parser.add_argument("--config_hash", default=None)
+    parser.add_argument("--min_sharpe", type=float, default=None)
+    parser.add_argument("--since", default=None, help="只看该时间之后的运行, 如 2025-06-01")
+    parser.add_argument("--order", default="created_at", choices=sorted(ORDER_COLUMNS))
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--compare", nargs="+", default=None, metavar="RUN_ID")
+    parser.add_argument("--rebuild", action="store_true", help="扫描 mlruns 补登历史运行")
+    args = parser.parse_args()
+
+    catalog = RunCatalog(args.catalog)
+    if args.rebuild:
+        t0 = time.time()
+        print(f"补登 {catalog.rebuild()} 次运行, 耗时 {time.time() - t0:.1f}s")
+    with pd.option_context("display.width", 200, "display.max_columns", 30):
+        if args.compare:
+            print(catalog.compare(args.compare).to_string())
+        elif args.list or not args.rebuild:
+            runs = catalog.query(args.experiment, args.config_hash, args.min_sharpe, args.since, args.order, args.limit)
+            columns = ["run_id", "experiment", "created_at", "config_hash", "start_date", "end_date",
+                       "annual_return", "sharpe", "max_drawdown", "excess_annual_return"]
+            print(runs[columns].to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    catalog.close()
@@ -1,15 +1,31 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 import pickle
 import numpy as np
+import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
 # Config
 MLRUNS_DIR = Path("mlruns")
 
-def find_latest_report():
-    """自动查找 mlruns 中最新生成的资金曲线报告"""
+def find_latest_report(experiment=None):
+    """
+    自动查找最新生成的资金曲线报告: 优先查询运行目录 (backtest/run_catalog.py),
+    目录不存在或没有记录时退回到扫描 mlruns
+    """
+    from backtest.run_catalog import CATALOG_PATH, RunCatalog
+
+    if CATALOG_PATH.exists():
+        catalog = RunCatalog(CATALOG_PATH)
+        try:
+            path = catalog.latest(experiment)
+        finally:
+            catalog.close()
+        if path and os.path.exists(path):
+            return path
+
     latest_time = 0
     latest_file = None
     
@@ -52,6 +68,8 @@ def calculate_metrics(series_returns, series_cum):
     return total_ret, ann_ret, sharpe, max_dd
 
 def plot_performance(pkl_path):
+    import matplotlib.pyplot as plt  # 只在绘图时导入, 其他模块引用 calculate_metrics 不加载 matplotlib
+
     print(f"正在读取回测报告: {pkl_path}")
     
     with open(pkl_path, "rb") as f:
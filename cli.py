@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+统一命令行入口
+
+各脚本在导入时就加载 qlib / akshare / lightgbm / matplotlib, 有的还会初始化 Qlib 或连接 ClickHouse.
+这里只做分发: 本文件只用标准库, 某个命令运行时才执行对应脚本 (runpy, 与直接 python xxx.py 等价),
+其他子系统完全不导入. report / status 只读本地文件和 SQLite, 不碰 Qlib.
+
+用法:
+    python cli.py status
+    python cli.py report                      # 最近的回测记录 (backtest/run_catalog.py)
+    python cli.py report --plot               # 画最新一次回测的资金曲线
+    python cli.py ingest daily                # 子命令后的第一个参数选脚本, 其余参数原样传给脚本
+    python cli.py export
+    python cli.py dump minute --start 2025-12-01 --end 2025-12-31
+    python cli.py train walk_forward --help
+    python cli.py backtest fast --pred pred.pkl
+    python cli.py pipeline --targets backtest  # 见 pipeline.py
+    python cli.py panel serve                 # 共享内存行情面板, 见 data_processing/panel_server.py
+    python cli.py importtime                  # 各子系统的导入耗时 (每个模块单独起一个解释器)
+"""
+import os
+import runpy
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+# Config: 命令 -> (说明, {脚本名: 脚本路径}), 第一个脚本为默认
+COMMANDS = {
+    "ingest": ("抓取行情到 ClickHouse", {
+        "daily": "data_ingestion/fetch_akshare.py",
+        "benchmark": "data_ingestion/fetch_benchmark.py",
+        "minute": "data_ingestion/fetch_minute.py",
+        "st": "data_ingestion/fetch_st_list.py",
+        "sector": "data_ingestion/fetch_sector_map.py",
+        "backfill": "data_ingestion/backfill_history.py",
+        "adj_factor": "data_ingestion/fetch_adj_factor.py",
+        "quality": "data_ingestion/quality.py",
+        "calendar": "data_ingestion/trading_calendar.py",
+    }),
+    "export": ("ClickHouse 导出为 Qlib 数据", {
+        "day": "data_processing/export_to_qlib.py",
+    }),
+    "dump": ("生成 bin / 位图等派生数据", {
+        "day": "data_processing/dump_bin.py",
+        "minute": "data_processing/dump_minute.py",
+        "minute_factors": "data_processing/minute_factors.py",
+        "tradability": "data_processing/tradability.py",
+        "universe": "data_processing/universe.py",
+        "sector": "data_processing/sector_rotation.py",
+    }),
+    "train": ("训练 / 调参 / 推理", {
+        "washout": "research/train_washout_model.py",
+        "walk_forward": "research/walk_forward.py",
+        "tune": "research/tune_lgb.py",
+        "factors": "research/factor_mining.py",
+        "predict": "research/predict_daily.py",
+    }),
+    "backtest": ("回测", {
+        "qlib": "backtest/backtest_washout.py",
+        "fast": "backtest/fast_backtest.py",
+        "sweep": "backtest/param_sweep.py",
+        "overlays": "backtest/overlays.py",
+        "robustness": "backtest/robustness.py",
+    }),
+    "panel": ("共享内存行情面板服务 (serve / status / bench)", {
+        "server": "data_processing/panel_server.py",
+    }),
+    "pipeline": ("按依赖运行整条流水线, 跳过输入未变化的阶段", {
+        "run": "pipeline.py",
+    }),
+}
+
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+MINUTE_QLIB_DIR = Path("qlib_data/cn_data_1min")
+FEATURE_CACHE_DIR = Path("qlib_data/feature_cache")
+MODEL_PATH = Path("models/washout_lgb.txt")
+BITMAP_PATH = QLIB_DATA_DIR / "tradability" / "day.npz"
+ST_LIST_PATH = Path("data_ingestion/st_list.csv")
+CATALOG_PATH = Path("mlruns/run_catalog.db")
+PANEL_MANIFEST = Path("qlib_data/panel/current.json")
+
+# importtime 测量的模块 (按子系统)
+BENCH_MODULES = [
+    "backtest.metrics", "backtest.visualize_results", "backtest.run_catalog", "backtest.fast_backtest",
+    "backtest.backtest_washout", "data_processing.feature_cache", "data_processing.tradability",
+    "data_processing.export_to_qlib", "data_ingestion.fetch_akshare", "research.predict_daily",
+    "research.train_washout_model",
+]
+BENCH_COMMANDS = [["--help"], ["status"], ["report"]]
+BENCH_REPEAT = 3
+
+
+def run_script(rel_path: str, argv: list) -> None:
+    """以 __main__ 身份执行脚本, 等价于 python <script> <argv...>"""
+    path = ROOT / rel_path
+    sys.argv = [str(path)] + argv
+    runpy.run_path(str(path), run_name="__main__")
+
+
+def _mtime(path: Path) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(path.stat().st_mtime))
+
+
+def _dir_size(path: Path):
+    n, total = 0, 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            n += 1
+            total += os.path.getsize(os.path.join(root, f))
+    return n, total
+
+
+def status() -> None:
+    """数据 / 缓存 / 模型 / 回测记录的概况, 只用标准库读文件"""
+    calendar = QLIB_DATA_DIR / "calendars" / "day.txt"
+    if calendar.exists():
+        days = calendar.read_text().split()
+        print(f"Qlib 日线:   {days[0]} ~ {days[-1]} ({len(days)} 个交易日)")
+    else:
+        print(f"Qlib 日线:   未找到 {calendar}")
+    instruments = QLIB_DATA_DIR / "instruments" / "all.txt"
+    if instruments.exists():
+        with open(instruments) as f:
+            print(f"股票列表:    {sum(1 for _ in f)} 只")
+    minute_calendar = MINUTE_QLIB_DIR / "calendars" / "1min.txt"
+    if minute_calendar.exists():
+        # 分钟日历很长, 只读文件末尾取最后一行
+        with open(minute_calendar, "rb") as f:
+            f.seek(max(0, minute_calendar.stat().st_size - 64))
+            print(f"分钟线:      最新 {f.read().decode().strip().splitlines()[-1]}")
+    for label, path in (("涨跌停位图:  ", BITMAP_PATH), ("ST 区间表:   ", ST_LIST_PATH), ("模型:        ", MODEL_PATH)):
+        print(label + (f"{path} (更新于 {_mtime(path)})" if path.exists() else "未生成"))
+    if FEATURE_CACHE_DIR.exists():
+        n, total = _dir_size(FEATURE_CACHE_DIR)
+        print(f"特征缓存:    {n} 个文件, {total / 1024 ** 2:.1f} MB")
+    if PANEL_MANIFEST.exists():
+        import json
+
+        panel = json.loads(PANEL_MANIFEST.read_text(encoding="utf-8"))
+        print(f"共享面板:    {panel['name']} ({panel['bytes'] / 1024 ** 2:.1f} MB, 发布于 {panel['published_at']})")
+    if CATALOG_PATH.exists():
+        conn = sqlite3.connect(str(CATALOG_PATH))
+        count, latest = conn.execute("SELECT COUNT(*), MAX(created_at) FROM runs").fetchone()
+        conn.close()
+        print(f"回测记录:    {count} 次, 最近一次 {latest}")
+    else:
+        print("回测记录:    无 (backtest_washout.py 运行后自动登记)")
+
+
+def report(argv: list) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="cli.py report", description="查看回测记录 / 绘制资金曲线")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--experiment", default=None)
+    parser.add_argument("--order", default="created_at")
+    parser.add_argument("--plot", action="store_true", help="绘制最新一次回测的资金曲线 (需要 matplotlib)")
+    args = parser.parse_args(argv)
+
+    if args.plot:
+        run_script("backtest/visualize_results.py", [])
+        return
+    if not CATALOG_PATH.exists():
+        print(f"未找到回测记录 {CATALOG_PATH}, 可先运行 python backtest/run_catalog.py --rebuild")
+        return
+    run_script("backtest/run_catalog.py", ["--list", "--limit", str(args.limit), "--order", args.order]
+               + (["--experiment", args.experiment] if args.experiment else []))
+
+
+def importtime(repeat: int = BENCH_REPEAT) -> None:
+    """每个模块 / 命令单独起解释器测量, 取多次中的最小值, 避免彼此的导入缓存干扰"""
+    code = ("import sys, time; sys.path.insert(0, {root!r}); t = time.perf_counter(); "
+            "import importlib; importlib.import_module({mod!r}); print(time.perf_counter() - t)")
+    print(f"{'模块':<36}{'导入耗时':>10}")
+    for mod in BENCH_MODULES:
+        best, error = None, None
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", code.format(root=str(ROOT), mod=mod)],
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                error = proc.stderr.strip().splitlines()[-1]
+                break
+            best = min(best or float("inf"), float(proc.stdout.strip().splitlines()[-1]))
+        print(f"{mod:<36}{f'{best:.3f}s' if error is None else '导入失败: ' + error:>10}")
+
+    print(f"\n{'命令':<36}{'总耗时 (含解释器启动)':>10}")
+    for argv in BENCH_COMMANDS:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, str(ROOT / "cli.py")] + argv, capture_output=True)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{'cli.py ' + ' '.join(argv):<36}{best:>9.3f}s")
+
+
+def usage() -> None:
+    print(__doc__.strip())
+    print("\n命令:")
+    print(f"  {'status':<10}数据 / 缓存 / 模型 / 回测记录概况")
+    print(f"  {'report':<10}回测记录列表, --plot 绘制资金曲线")
+    for name, (desc, scripts) in COMMANDS.items():
+        print(f"  {name:<10}{desc}: {' | '.join(scripts)} (默认 {next(iter(scripts))})")
+    print(f"  {'importtime':<10}各子系统导入耗时")
+
+
+def main(argv: list) -> None:
+    if not argv or argv[0] in ("-h", "--help", "help"):
+        usage()
+        return
+    command, rest = argv[0], argv[1:]
+    if command == "status":
+        status()
+    elif command == "report":
+        report(rest)
+    elif command == "importtime":
+        importtime()
+    elif command in COMMANDS:
+        scripts = COMMANDS[command][1]
+        if rest and rest[0] in scripts:
+            target, rest = rest[0], rest[1:]
+        else:
+            target = next(iter(scripts))
+        run_script(scripts[target], rest)
+    else:
+        print(f"未知命令: {command}\n")
+        usage()
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
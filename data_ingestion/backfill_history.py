@@ -2,20 +2,28 @@ import akshare as ak
 import pandas as pd
 import time
 import random
+import sys
 from datetime import datetime
+from pathlib import Path
 from clickhouse_driver import Client
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_ingestion.fetch_adj_factor import update_factors
+from data_ingestion.quality import save_quarantine, validate
+from data_ingestion.trading_calendar import load_calendar
+from tracing import span, traced
+
 # Config
 START_DATE = "20200101"
 END_DATE = "20251231"
 DB_HOST = 'localhost'
 DB_DATABASE = 'stock_data'
 MAX_WORKERS = 4  # 并发数量
-
-# 连接 ClickHouse
-client = Client(host=DB_HOST, database=DB_DATABASE, settings={'use_numpy': True})
+BATCH_STOCKS = 1000  # 每攒够这么多只股票做一次质量检查并写入
+INSERT_CHUNK = 1_000_000
+FINAL_COLS = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
 
 def get_all_stock_codes():
     print("正在获取全市场股票列表...")
@@ -26,19 +34,18 @@ def get_all_stock_codes():
         print(f"获取列表失败: {e}")
         return []
 
+@traced("ingest.process_stock")
 def process_stock(code):
     """
-    单个股票的处理逻辑（下载 -> 清洗 -> 入库）
-    注意：每个线程需要独立的 ClickHouse 连接，或者短连接，但为了简单高效，我们在主线程统一写入。
+    单个股票的处理逻辑（下载 -> 清洗）, 返回 DataFrame, 失败返回 None
+    注意：入库在主线程按批统一进行 (先过质量检查), 工作线程不连接 ClickHouse。
     """
-    # 每个线程内部建立连接，防止连接冲突
-    local_client = Client(host=DB_HOST, database=DB_DATABASE, settings={'use_numpy': True})
-    
     try:
         # 1. 下载
-        df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=START_DATE, end_date=END_DATE, adjust="qfq")
+        with span("akshare.stock_zh_a_hist", code=code):
+            df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=START_DATE, end_date=END_DATE, adjust="")  # 不复权, 复权因子另存 stock_adj_factor
         if df is None or df.empty:
-            return False
+            return None
 
         # 2. 清洗
         rename_dict = {
@@ -51,28 +58,37 @@ def process_stock(code):
         df['pre_close'] = df['close'].shift(1).fillna(df['open'])
         df['trade_date'] = pd.to_datetime(df['trade_date']).dt.date
         
-        # 补全cols
+        # 补全cols (保留 NaN, 由质量检查决定是否入库, 不再把缺失价格填成 0)
         required_cols = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
         for col in required_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+            df[col] = pd.to_numeric(df[col], errors='coerce')
 
         # 3. 排序与筛选
-        final_cols = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
-        df_save = df[final_cols].copy()
-
-        # 4. Insert
-        local_client.insert_dataframe(
-            'INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, pre_close, change, pct_chg, vol, amount, turnover_rate) VALUES',
-            df_save
-        )
-        # 关闭连接
-        local_client.disconnect()
-        return True
+        return df[FINAL_COLS].copy()
 
     except Exception as e:
-        return False
+        return None
+
+def flush(client, frames, calendar):
+    """一批股票: 整批质量检查 -> 正常行入库, 问题行入隔离表; 返回入库行数"""
+    batch = pd.concat(frames, ignore_index=True)
+    with span("quality.validate", rows=len(batch)):
+        clean, bad, _, _ = validate(batch, calendar)
+    save_quarantine(client, "stock_daily", bad)
+    # 通过检查的行价格齐全, 其余派生列缺失时按 0 处理
+    clean = clean.fillna(0.0)
+    with span("clickhouse.insert", table="stock_daily", rows=len(clean)):
+        for i in range(0, len(clean), INSERT_CHUNK):
+            client.insert_dataframe(
+                'INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, pre_close, change, pct_chg, vol, amount, turnover_rate) VALUES',
+                clean.iloc[i:i + INSERT_CHUNK]
+            )
+    return len(clean)
 
 if __name__ == "__main__":
+    # 连接 ClickHouse (只在运行时连接, 导入本模块不产生连接)
+    client = Client(host=DB_HOST, database=DB_DATABASE, settings={'use_numpy': True})
+
     # 1. 清空旧表
     print("正在清空旧数据(Truncate)...")
     client.execute("TRUNCATE TABLE stock_daily")
@@ -80,10 +96,13 @@ if __name__ == "__main__":
 
     # 2. 获取列表
     all_codes = get_all_stock_codes()
+    calendar = load_calendar().days
     print(f"启动多线程下载, 线程数:{MAX_WORKERS}")
     
-    # 3. 多线程执行
+    # 3. 多线程下载, 主线程按批检查并写入
     success_count = 0
+    row_count = 0
+    frames = []
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         # 提交所有任务
         future_to_code = {executor.submit(process_stock, code): code for code in all_codes}
@@ -94,16 +113,27 @@ if __name__ == "__main__":
         for future in as_completed(future_to_code):
             code = future_to_code[future]
             try:
-                if future.result():
+                df = future.result()
+                if df is not None:
+                    frames.append(df)
                     success_count += 1
             except Exception as e:
                 pass
             
             pbar.update(1)
             pbar.set_description(f"Processing")
+
+            if len(frames) >= BATCH_STOCKS:
+                row_count += flush(client, frames, calendar)
+                frames = []
             
             # 随机休眠一点点
             if success_count % 10 == 0:
                 time.sleep(random.uniform(0.1, 0.5))
 
-    print(f"\n回填完成! 共入库 {success_count} 只股票.")
+    if frames:
+        row_count += flush(client, frames, calendar)
+    print(f"\n回填完成! 共 {success_count} 只股票, 入库 {row_count} 行.")
+
+    # 4. 复权因子 (只写入库里没有的变化点)
+    update_factors(client, all_codes, MAX_WORKERS)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+复权因子表 stock_adj_factor
+
+stock_daily 存不复权的原始价格, 复权由这张表完成: 每只股票只在除权除息日有一行后复权因子 (hfq_factor),
+某一天的因子 = 该日及之前最近一行的值. 后复权因子的历史值不会因为新的分红送转而改变, 所以:
+  - 每日更新只追加当天的行情, 不用再因为某只股票分红而清空重抓整段历史 (前复权价格每次除权都会整体改写);
+  - 发生除权的股票只需要在这张表里追加一行.
+
+export_to_qlib.py 读取该表, 按股票把因子归一到最新一天为 1 (即与前复权价同一尺度) 后写出 Qlib 的 $factor,
+并用它得到复权价 ($close = 原始价 x $factor, $volume = 原始成交量 / $factor).
+
+fetch_akshare.py 每天入库后用交易所的昨收价与库中上一交易日收盘价比对, 两者不一致即当天除权, 只为这些股票更新因子.
+
+用法:
+    python data_ingestion/fetch_adj_factor.py                  # 全市场 (首次建表或定期核对)
+    python data_ingestion/fetch_adj_factor.py --codes 600000 000001
+"""
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tracing import span
+
+# Config
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_DB = "stock_data"
+MAX_WORKERS = 4
+PRICE_TICK = 0.01
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stock_adj_factor (
+    ts_code    String,
+    trade_date Date,
+    hfq_factor Float64
+) ENGINE = ReplacingMergeTree
+ORDER BY (ts_code, trade_date)
+"""
+
+
+def _client():
+    from clickhouse_driver import Client
+
+    return Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB, settings={"use_numpy": True})
+
+
+def exchange_symbol(code: str) -> str:
+    """'600000' -> 'sh600000', 新浪接口需要交易所前缀"""
+    code = str(code)[-6:]
+    if code.startswith(("4", "8", "92")):
+        return "bj" + code
+    if code.startswith(("5", "6", "9")):
+        return "sh" + code
+    return "sz" + code
+
+
+def fetch_factor(code: str) -> pd.DataFrame:
+    """单只股票的后复权因子变化点: DataFrame[ts_code, trade_date, hfq_factor]"""
+    import akshare as ak
+
+    with span("akshare.stock_zh_a_daily_hfq_factor", code=code):
+        df = ak.stock_zh_a_daily(symbol=exchange_symbol(code), adjust="hfq-factor")
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["ts_code", "trade_date", "hfq_factor"])
+    df = df.rename(columns={"date": "trade_date"})
+    df["ts_code"] = str(code)
+    df["trade_date"] = pd.to_datetime(df["trade_date"]).dt.date
+    df["hfq_factor"] = pd.to_numeric(df["hfq_factor"], errors="coerce")
+    df = df.dropna(subset=["hfq_factor"])
+    return df[["ts_code", "trade_date", "hfq_factor"]].sort_values("trade_date")
+
+
+def save_factors(client, df: pd.DataFrame) -> int:
+    """只写入库里还没有的 (ts_code, trade_date, hfq_factor), 返回写入行数"""
+    if df.empty:
+        return 0
+    codes = ", ".join(f"'{c}'" for c in df["ts_code"].unique())
+    existing = client.query_dataframe(
+        f"SELECT ts_code, trade_date, hfq_factor FROM stock_adj_factor FINAL WHERE ts_code IN ({codes})"
+    )
+    if not existing.empty:
+        existing["trade_date"] = pd.to_datetime(existing["trade_date"]).dt.date
+        merged = df.merge(existing, on=["ts_code", "trade_date"], how="left", suffixes=("", "_old"))
+        df = df[(merged["hfq_factor"] != merged["hfq_factor_old"]).to_numpy()]
+    if df.empty:
+        return 0
+    client.insert_dataframe("INSERT INTO stock_adj_factor (ts_code, trade_date, hfq_factor) VALUES", df)
+    return len(df)
+
+
+def update_factors(client, codes, workers: int = MAX_WORKERS) -> int:
+    """多线程下载 codes 的因子, 主线程统一写入; 返回新增行数"""
+    client.execute(CREATE_TABLE_SQL)
+    frames = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_factor, code): code for code in codes}
+        for future in as_completed(futures):
+            try:
+                frames.append(future.result())
+            except Exception as e:
+                print(f"{futures[future]} 复权因子获取失败: {e}")
+    if not frames:
+        return 0
+    added = save_factors(client, pd.concat(frames, ignore_index=True))
+    print(f"复权因子: {len(codes)} 只股票, 新增 {added} 行")
+    return added
+
+
+def detect_corporate_actions(client, df: pd.DataFrame) -> list:
+    """
+    df 为当天行情 (含 ts_code, trade_date, pre_close). 交易所给出的昨收价是除权后的价格,
+    与库中该股票上一交易日的原始收盘价不一致, 说明当天发生了除权除息.
+    """
+    today = df["trade_date"].iloc[0]
+    prev = client.query_dataframe(f"""
+        SELECT ts_code, argMax(close, trade_date) AS prev_close
+        FROM stock_daily
+        WHERE trade_date < '{today}' AND close > 0
+        GROUP BY ts_code
+    """)
+    if prev.empty:
+        return []
+    merged = df[["ts_code", "pre_close"]].merge(prev, on="ts_code", how="inner")
+    changed = (merged["pre_close"] > 0) & ((merged["pre_close"] - merged["prev_close"]).abs() > PRICE_TICK / 2)
+    return merged.loc[changed, "ts_code"].tolist()
+
+
+def load_factors(client) -> pd.DataFrame:
+    """全部因子变化点, 供导出时按日期 asof 匹配; 表还没建时返回空表"""
+    client.execute(CREATE_TABLE_SQL)
+    df = client.query_dataframe("SELECT ts_code, trade_date, hfq_factor FROM stock_adj_factor FINAL")
+    if df.empty:
+        return pd.DataFrame(columns=["ts_code", "trade_date", "hfq_factor"])
+    df["trade_date"] = pd.to_datetime(df["trade_date"])
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="下载后复权因子到 stock_adj_factor")
+    parser.add_argument("--codes", nargs="*", default=None, help="只更新这些股票, 默认全市场")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    client = _client()
+    codes = args.codes
+    if not codes:
+        codes = client.query_dataframe("SELECT DISTINCT ts_code FROM stock_daily WHERE close > 0")["ts_code"].tolist()
+        codes = [c for c in codes if str(c).isdigit()]  # 排除基准指数 (SH000300)
+    update_factors(client, codes, args.workers)
@@ -1,23 +1,49 @@
+import sys
+import urllib.request
 import akshare as ak
 import pandas as pd
 from datetime import datetime
+from pathlib import Path
 from clickhouse_driver import Client
 
-# 连接 ClickHouse
-print("正在连接 ClickHouse...")
-client = Client(
-    host='localhost', 
-    user='default', 
-    password='', 
-    database='stock_data',
-    settings={'use_numpy': True} 
-)
-
-def get_realtime_daily_data():
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_ingestion.fetch_adj_factor import detect_corporate_actions, update_factors
+from data_ingestion.quality import save_quarantine, validate
+from data_ingestion.trading_calendar import load_calendar
+from tracing import span, traced
+
+# 常驻打分服务 (research/scoring_daemon.py), 入库后通知其增量刷新; 服务未启动时忽略
+SCORING_DAEMON_URL = "http://127.0.0.1:8765/refresh"
+
+_client = None
+
+def get_client():
+    """ClickHouse 连接在第一次用到时才建立, 导入本模块不连接数据库"""
+    global _client
+    if _client is None:
+        print("正在连接 ClickHouse...")
+        _client = Client(
+            host='localhost', 
+            user='default', 
+            password='', 
+            database='stock_data',
+            settings={'use_numpy': True} 
+        )
+    return _client
+
+def get_realtime_daily_data(calendar=None):
+    # 周末/节假日接口返回的是上一交易日的快照, 不抓也不入库
+    calendar = calendar or load_calendar()
+    today = datetime.now().date()
+    if not calendar.is_trading_day(today):
+        print(f"{today} 不是交易日 (上一交易日 {calendar.prev(today).date()}), 跳过")
+        return None
+
     print("正在通过 AKShare 从东方财富抓取全市场实时行情...")
     try:
         # 这个接口返回的列包含：代码,名称,最新价,涨跌幅,涨跌额,成交量,成交额,振幅,最高,最低,今开,昨收,量比,换手率,市盈率-动态,市净率...
-        df = ak.stock_zh_a_spot_em()
+        with span("akshare.stock_zh_a_spot_em"):
+            df = ak.stock_zh_a_spot_em()
     except Exception as e:
         print(f"网络请求失败: {e}")
         return None
@@ -26,13 +52,10 @@ def get_realtime_daily_data():
         print("未获取到数据")
         return None
 
-    # 时间处理
-    today = datetime.now().date()
-    
     # 检查重复
     check_sql = f"SELECT count() FROM stock_daily WHERE trade_date = '{today}'"
     try:
-        count = client.execute(check_sql)[0][0]
+        count = get_client().execute(check_sql)[0][0]
         if count > 0:
             print(f"今日 ({today}) 的行情数据已经存在 ({count} 条)! 跳过入库, 防止重复.")
             return None 
@@ -71,8 +94,8 @@ def get_realtime_daily_data():
     numeric_cols = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
     
     for col in numeric_cols:
-        # AKShare 的换手率是百分比(3.5代表3.5%)
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+        # AKShare 的换手率是百分比(3.5代表3.5%); 缺失值先保留, 交给质量检查
+        df[col] = pd.to_numeric(df[col], errors='coerce')
 
     # 写入数据库的列顺序
     columns_to_db = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
@@ -80,8 +103,17 @@ def get_realtime_daily_data():
     # 按照指定顺序排列
     df_final = df[columns_to_db].copy()
 
-    return df_final
+    # 质量检查: 停牌快照丢弃, 问题行 (缺价格 / 高低价倒挂 / 非交易日等) 入隔离表
+    with span("quality.validate", rows=len(df_final)):
+        df_final, bad, _, _ = validate(df_final, calendar.days)
+    try:
+        save_quarantine(get_client(), "stock_daily", bad)
+    except Exception as e:
+        print(f"写入隔离表失败: {e}")
 
+    return df_final.fillna(0.0)
+
+@traced("ingest.save_to_clickhouse")
 def save_to_clickhouse(df):
     if df is None or df.empty:
         return
@@ -89,22 +121,44 @@ def save_to_clickhouse(df):
     print(f"正在写入 {len(df)} 条数据到 ClickHouse...")
     try:
         # Insert
-        client.insert_dataframe(
+        get_client().insert_dataframe(
             'INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, pre_close, change, pct_chg, vol, amount, turnover_rate) VALUES',
             df
         )
         print("入库成功!")
+        return True
     except Exception as e:
         print(f"入库失败: {e}")
+        return False
+
+def update_adj_factors(df):
+    """stock_daily 只追加不复权的当天行情; 当天除权的股票只需在 stock_adj_factor 里追加因子"""
+    try:
+        codes = detect_corporate_actions(get_client(), df)
+        print(f"今日除权除息: {len(codes)} 只")
+        if codes:
+            update_factors(get_client(), codes)
+    except Exception as e:
+        print(f"更新复权因子失败: {e}")
+
+def notify_scoring_daemon():
+    try:
+        req = urllib.request.Request(SCORING_DAEMON_URL, method="POST")
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            print(f"打分服务已刷新: {resp.read().decode('utf-8')}")
+    except Exception:
+        pass
 
 if __name__ == "__main__":
     data = get_realtime_daily_data()
     if data is not None:
-        save_to_clickhouse(data)
+        if save_to_clickhouse(data):
+            update_adj_factors(data)
+            notify_scoring_daemon()
         
         # 验证
         try:
-            count = client.execute("SELECT count() FROM stock_daily")[0][0]
+            count = get_client().execute("SELECT count() FROM stock_daily")[0][0]
             print(f"数据库当前总行数: {count}")
 
         except Exception as e:
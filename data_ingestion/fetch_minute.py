@@ -0,0 +1,138 @@
+import akshare as ak
+import pandas as pd
+import time
+import random
+import sys
+from datetime import datetime
+from pathlib import Path
+from clickhouse_driver import Client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_ingestion.quality import save_quarantine, validate
+from data_ingestion.trading_calendar import load_calendar
+from tracing import span, traced
+
+# Config
+DB_HOST = 'localhost'
+DB_DATABASE = 'stock_data'
+MAX_WORKERS = 4  # 并发数量
+# 东方财富 1 分钟线只保留最近几个交易日, 需要每天收盘后抓取一次
+
+# 按月分区, (ts_code, datetime) 排序; ReplacingMergeTree 保证重复抓取同一天不会产生重复行
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stock_minute (
+    ts_code    String,
+    trade_date Date,
+    datetime   DateTime,
+    open       Float64,
+    high       Float64,
+    low        Float64,
+    close      Float64,
+    volume     Float64,
+    amount     Float64
+) ENGINE = ReplacingMergeTree
+PARTITION BY toYYYYMM(trade_date)
+ORDER BY (ts_code, datetime)
+"""
+
+def get_all_stock_codes():
+    print("正在获取全市场股票列表...")
+    try:
+        df = ak.stock_zh_a_spot_em()
+        return df['代码'].tolist()
+    except Exception as e:
+        print(f"获取列表失败: {e}")
+        return []
+
+@traced("ingest.process_stock_minute")
+def process_stock(code, trade_date):
+    """单只股票某一交易日的 1 分钟线 (下载 -> 清洗 -> 入库)"""
+    local_client = Client(host=DB_HOST, database=DB_DATABASE, settings={'use_numpy': True})
+
+    try:
+        # 1. 下载
+        with span("akshare.stock_zh_a_hist_min_em", code=code):
+            df = ak.stock_zh_a_hist_min_em(
+                symbol=code, period="1", adjust="",
+                start_date=f"{trade_date} 09:30:00", end_date=f"{trade_date} 15:00:00",
+            )
+        if df is None or df.empty:
+            return False
+
+        # 2. 清洗
+        rename_dict = {
+            '时间': 'datetime', '开盘': 'open', '最高': 'high', '最低': 'low',
+            '收盘': 'close', '成交量': 'volume', '成交额': 'amount'
+        }
+        df = df.rename(columns=rename_dict)
+        df['ts_code'] = str(code)
+        df['datetime'] = pd.to_datetime(df['datetime'])
+        df['trade_date'] = df['datetime'].dt.date
+        for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        # 分钟线成交量单位是手, 换成股, 这样 成交额 / 成交量 就是均价
+        df['volume'] = df['volume'] * 100
+
+        final_cols = ['ts_code', 'trade_date', 'datetime', 'open', 'high', 'low', 'close', 'volume', 'amount']
+        # 质量检查 (同一分钟重复、缺价格、高低价倒挂等), 问题行入隔离表
+        df_save, bad, _, _ = validate(df[final_cols], date_col='datetime', volume_col='volume', verbose=False)
+        save_quarantine(local_client, "stock_minute", bad)
+        if df_save.empty:
+            return False
+        df_save = df_save.fillna(0.0)
+
+        # 3. Insert
+        with span("clickhouse.insert", table="stock_minute", rows=len(df_save)):
+            local_client.insert_dataframe(
+                'INSERT INTO stock_minute (ts_code, trade_date, datetime, open, high, low, close, volume, amount) VALUES',
+                df_save
+            )
+        return True
+
+    except Exception as e:
+        print(f"{code} {trade_date} 处理失败: {e}")
+        return False
+    finally:
+        local_client.disconnect()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="抓取全市场 1 分钟线到 ClickHouse")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"), help="交易日, 默认今天")
+    args = parser.parse_args()
+
+    calendar = load_calendar()
+    if not calendar.is_trading_day(args.date):
+        print(f"{args.date} 不是交易日 (上一交易日 {calendar.prev(args.date).date()}), 跳过")
+        sys.exit(0)
+
+    client = Client(host=DB_HOST, database=DB_DATABASE, settings={'use_numpy': True})
+    client.execute(CREATE_TABLE_SQL)
+
+    all_codes = get_all_stock_codes()
+    print(f"启动多线程下载 {args.date} 分钟线, 线程数:{MAX_WORKERS}")
+
+    success_count = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        future_to_code = {executor.submit(process_stock, code, args.date): code for code in all_codes}
+
+        pbar = tqdm(total=len(all_codes))
+
+        for future in as_completed(future_to_code):
+            try:
+                if future.result():
+                    success_count += 1
+            except Exception as e:
+                pass
+
+            pbar.update(1)
+            pbar.set_description(f"Processing")
+
+            if success_count % 10 == 0:
+                time.sleep(random.uniform(0.1, 0.5))
+
+    print(f"\n分钟线入库完成! 共 {success_count} 只股票.")
+    print("下一步: python data_processing/dump_minute.py --start", args.date, "--end", args.date)
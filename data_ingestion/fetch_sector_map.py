@@ -0,0 +1,43 @@
+import akshare as ak
+import pandas as pd
+import time
+import random
+from pathlib import Path
+from tqdm import tqdm
+
+# Config
+SECTOR_MAP_PATH = Path("data_ingestion/sector_map.csv")  # 板块轮动因子使用的本地映射文件
+
+def get_industry_boards():
+    print("正在获取东方财富行业板块列表...")
+    try:
+        df = ak.stock_board_industry_name_em()
+        return df['板块名称'].tolist()
+    except Exception as e:
+        print(f"获取板块列表失败: {e}")
+        return []
+
+def fetch_sector_map():
+    """逐个行业板块拉取成分股, 返回 ts_code -> sector 映射 (一只股票只归属一个行业)"""
+    rows = []
+    for board in tqdm(get_industry_boards()):
+        try:
+            cons = ak.stock_board_industry_cons_em(symbol=board)
+        except Exception as e:
+            print(f"{board} 成分股获取失败: {e}")
+            continue
+        for code in cons['代码'].astype(str):
+            rows.append((code, board))
+        time.sleep(random.uniform(0.1, 0.3))
+
+    df = pd.DataFrame(rows, columns=['ts_code', 'sector'])
+    return df.drop_duplicates('ts_code').sort_values('ts_code')
+
+if __name__ == "__main__":
+    sector_map = fetch_sector_map()
+    if sector_map.empty:
+        print("未获取到任何映射, 保留原文件")
+    else:
+        SECTOR_MAP_PATH.parent.mkdir(parents=True, exist_ok=True)
+        sector_map.to_csv(SECTOR_MAP_PATH, index=False)
+        print(f"行业映射已写入 {SECTOR_MAP_PATH}: {len(sector_map)} 只股票, {sector_map['sector'].nunique()} 个行业")
@@ -0,0 +1,46 @@
+import akshare as ak
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+
+# Config
+ST_LIST_PATH = Path("data_ingestion/st_list.csv")  # 涨跌停位图 (data_processing/tradability.py) 使用的 ST 区间表
+
+def fetch_current_st():
+    """东方财富风险警示板: 当前所有 ST / *ST 股票代码"""
+    print("正在获取风险警示板 (ST) 股票列表...")
+    try:
+        df = ak.stock_zh_a_st_em()
+    except Exception as e:
+        print(f"获取 ST 列表失败: {e}")
+        return None
+    return set(df['代码'].astype(str))
+
+def update_st_intervals(current, today):
+    """
+    AkShare 只提供当前的 ST 名单, 每天收盘后运行一次, 把快照累积成区间表:
+    新进入的股票新增一行 (start_date=今天), 已摘帽的股票补上 end_date.
+    """
+    if ST_LIST_PATH.exists():
+        df = pd.read_csv(ST_LIST_PATH, dtype={'ts_code': str, 'start_date': str, 'end_date': str})
+    else:
+        df = pd.DataFrame(columns=['ts_code', 'start_date', 'end_date'])
+
+    open_rows = df['end_date'].isna()
+    active = set(df.loc[open_rows, 'ts_code'])
+    # 已不在名单中的区间: 摘帽日为今天
+    df.loc[open_rows & ~df['ts_code'].isin(current), 'end_date'] = today
+    new_rows = pd.DataFrame({'ts_code': sorted(current - active), 'start_date': today, 'end_date': None})
+    df = pd.concat([df, new_rows], ignore_index=True)
+    print(f"ST 名单 {len(current)} 只: 新增 {len(new_rows)} 只, 摘帽 {len(active - current)} 只")
+    return df.sort_values(['ts_code', 'start_date'])
+
+if __name__ == "__main__":
+    current = fetch_current_st()
+    if not current:
+        print("未获取到 ST 名单, 保留原文件")
+    else:
+        st_list = update_st_intervals(current, datetime.now().strftime('%Y-%m-%d'))
+        ST_LIST_PATH.parent.mkdir(parents=True, exist_ok=True)
+        st_list.to_csv(ST_LIST_PATH, index=False)
+        print(f"ST 区间表已写入 {ST_LIST_PATH}")
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+交易日历
+
+原先各处自己推断交易日: fetch_akshare.py 把 datetime.now().date() 直接当作交易日 (周末/节假日运行会白抓一次,
+还写进一个不存在的交易日), dump_bin.py 把所有 CSV 的日期取并集当作日历 (每次都要读全部文件).
+这里把 AkShare (新浪) 的交易日历持久化到 CALENDAR_PATH (每行一个日期, 与 Qlib 的 calendars/day.txt 同格式),
+并在排好序的数组上做查询:
+
+  - is_trading_day / next / prev / offset 都是 O(1): 预先按自然日建一张 "该日及之前最近交易日的下标" 表,
+    查询就是一次日期减法加一次数组下标;
+  - between / days 直接切片 / searchsorted.
+
+新浪的日历包含当年剩余的交易日, 文件中的最后一天早于今天时自动重新下载.
+
+用法:
+    from data_ingestion.trading_calendar import load_calendar
+    cal = load_calendar()
+    cal.is_trading_day("2025-10-01")    # False
+    cal.prev("2025-10-09")              # 2025-09-30
+    cal.offset("2025-06-30", -20)       # 20 个交易日前
+
+    python data_ingestion/trading_calendar.py --refresh          # 重新下载
+    python data_ingestion/trading_calendar.py --check 2025-10-01
+"""
+import argparse
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Config
+CALENDAR_PATH = Path("data_ingestion/trade_calendar.txt")
+QLIB_CALENDAR_PATH = Path("qlib_data/cn_data/calendars/day.txt")  # 下载失败且没有本地文件时的后备 (只有历史日期)
+
+
+def _day(d) -> np.datetime64:
+    try:
+        return np.datetime64(d, "D")
+    except (TypeError, ValueError):
+        return np.datetime64(pd.Timestamp(d).date(), "D")
+
+
+class TradingCalendar:
+    def __init__(self, days):
+        self.days = np.unique(np.asarray(days, dtype="datetime64[D]"))
+        if len(self.days) == 0:
+            raise ValueError("交易日历为空")
+        self.first, self.last = self.days[0], self.days[-1]
+        offsets = (self.days - self.first).astype(np.int64)
+        self._is_day = np.zeros(offsets[-1] + 1, dtype=bool)
+        self._is_day[offsets] = True
+        # 第 i 个自然日 (从首个交易日起) 及之前最近一个交易日在 days 中的下标
+        self._floor = np.cumsum(self._is_day) - 1
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __contains__(self, d) -> bool:
+        return self.is_trading_day(d)
+
+    def _floor_index(self, d) -> int:
+        off = int((_day(d) - self.first).astype(np.int64))
+        if off < 0:
+            raise ValueError(f"{d} 早于交易日历首日 {self.first}")
+        if off >= len(self._floor):
+            # 日历末日之后的自然日, 最近交易日就是末日; 但继续向后推算会超出日历
+            return len(self.days) - 1
+        return int(self._floor[off])
+
+    def _at(self, i: int, d) -> pd.Timestamp:
+        if i < 0 or i >= len(self.days):
+            raise ValueError(f"{d} 超出交易日历范围 ({self.first} ~ {self.last})")
+        return pd.Timestamp(self.days[i])
+
+    def is_trading_day(self, d) -> bool:
+        off = int((_day(d) - self.first).astype(np.int64))
+        return 0 <= off < len(self._is_day) and bool(self._is_day[off])
+
+    def index(self, d) -> int:
+        """d 及之前最近一个交易日的下标"""
+        return self._floor_index(d)
+
+    def latest(self, d=None) -> pd.Timestamp:
+        """d (默认今天) 及之前最近的交易日"""
+        d = date.today() if d is None else d
+        return self._at(self._floor_index(d), d)
+
+    def next(self, d, n: int = 1) -> pd.Timestamp:
+        """d 之后的第 n 个交易日 (不含 d)"""
+        if _day(d) > self.last:
+            raise ValueError(f"{d} 超出交易日历范围 ({self.first} ~ {self.last})")
+        if _day(d) < self.first:
+            return self._at(n - 1, d)
+        return self._at(self._floor_index(d) + n, d)
+
+    def prev(self, d, n: int = 1) -> pd.Timestamp:
+        """d 之前的第 n 个交易日 (不含 d)"""
+        i = self._floor_index(d)
+        if not self.is_trading_day(d):
+            i += 1  # 非交易日: floor 本身就是前一个交易日
+        return self._at(i - n, d)
+
+    def offset(self, d, n: int) -> pd.Timestamp:
+        """相对 d 偏移 n 个交易日; n = 0 时 d 必须是交易日"""
+        if n > 0:
+            return self.next(d, n)
+        if n < 0:
+            return self.prev(d, -n)
+        if not self.is_trading_day(d):
+            raise ValueError(f"{d} 不是交易日")
+        return pd.Timestamp(_day(d))
+
+    def between(self, start=None, end=None) -> pd.DatetimeIndex:
+        """[start, end] 内的交易日"""
+        lo = 0 if start is None else int(np.searchsorted(self.days, _day(start), "left"))
+        hi = len(self.days) if end is None else int(np.searchsorted(self.days, _day(end), "right"))
+        return pd.DatetimeIndex(self.days[lo:hi])
+
+    def save(self, path: Path = CALENDAR_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(str(d) for d in self.days) + "\n", encoding="utf-8")
+
+    @classmethod
+    def read(cls, path: Path) -> "TradingCalendar":
+        return cls(pd.to_datetime(Path(path).read_text(encoding="utf-8").split()).to_numpy())
+
+
+def fetch_calendar() -> TradingCalendar:
+    import akshare as ak
+
+    return TradingCalendar(pd.to_datetime(ak.tool_trade_date_hist_sina()["trade_date"]).to_numpy())
+
+
+def refresh_calendar(path: Path = CALENDAR_PATH) -> TradingCalendar:
+    """重新下载并与本地文件合并 (本地已有的历史日期保留)"""
+    cal = fetch_calendar()
+    if path.exists():
+        cal = TradingCalendar(np.concatenate([TradingCalendar.read(path).days, cal.days]))
+    cal.save(path)
+    print(f"交易日历已更新: {cal.first} ~ {cal.last}, 共 {len(cal)} 天 -> {path}")
+    return cal
+
+
+def load_calendar(path: Path = CALENDAR_PATH) -> TradingCalendar:
+    """读取本地日历; 文件不存在或已过期 (最后一天早于今天) 时重新下载, 下载失败时用现有文件或 Qlib 日历"""
+    path = Path(path)
+    cal = TradingCalendar.read(path) if path.exists() else None
+    if cal is None or cal.last < np.datetime64(date.today(), "D"):
+        try:
+            cal = refresh_calendar(path)
+        except Exception as e:
+            print(f"下载交易日历失败: {e}")
+    if cal is None and QLIB_CALENDAR_PATH.exists():
+        print(f"使用 Qlib 日历 {QLIB_CALENDAR_PATH} (只含已导出的历史交易日)")
+        cal = TradingCalendar.read(QLIB_CALENDAR_PATH)
+    if cal is None:
+        raise RuntimeError("没有可用的交易日历: 请先运行 python data_ingestion/trading_calendar.py --refresh")
+    return cal
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="交易日历")
+    parser.add_argument("--refresh", action="store_true", help="重新下载并保存")
+    parser.add_argument("--check", default=None, help="查询某一天: 是否交易日 / 前后交易日")
+    parser.add_argument("--path", default=str(CALENDAR_PATH))
+    args = parser.parse_args()
+
+    cal = refresh_calendar(Path(args.path)) if args.refresh else load_calendar(Path(args.path))
+    if args.check:
+        d = args.check
+        print(f"{d}: {'交易日' if cal.is_trading_day(d) else '非交易日'}, "
+              f"上一交易日 {cal.prev(d).date()}, 下一交易日 {cal.next(d).date()}")
+    elif not args.refresh:
+        print(f"交易日历: {cal.first} ~ {cal.last}, 共 {len(cal)} 天")
@@ -3,6 +3,7 @@
 
 import abc
 import shutil
+import sys
 import traceback
 from pathlib import Path
 from typing import Iterable, List, Union
@@ -16,6 +17,10 @@ from tqdm import tqdm
 from loguru import logger
 from qlib.utils import fname_to_code, code_to_fname
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_ingestion.trading_calendar import TradingCalendar
+from tracing import traced
+
 
 def read_as_df(file_path: Union[str, Path], **kwargs) -> pd.DataFrame:
     """
@@ -78,6 +83,7 @@ class DumpDataBase:
         exclude_fields: str = "",
         include_fields: str = "",
         limit_nums: int = None,
+        calendar_path: str = None,
     ):
         """
 
@@ -105,6 +111,9 @@ class DumpDataBase:
             fields not dumped
         limit_nums: int
             Use when debugging, default None
+        calendar_path: str, default None
+            trading calendar file (data_ingestion/trading_calendar.py); if set, the dumped calendar is
+            the trading days within the data range instead of the union of dates in all files
         """
         data_path = Path(data_path).expanduser()
         if isinstance(exclude_fields, str):
@@ -134,6 +143,7 @@ class DumpDataBase:
         self._instruments_dir = self.qlib_dir.joinpath(self.INSTRUMENTS_DIR_NAME)
 
         self._calendars_list = []
+        self._trading_calendar = None if calendar_path is None else TradingCalendar.read(calendar_path)
 
         self._mode = self.ALL_MODE
         self._kwargs = {}
@@ -268,6 +278,7 @@ class DumpDataBase:
                 # append; self._mode == self.ALL_MODE or not bin_path.exists()
                 np.hstack([date_index, _df[field]]).astype("<f").tofile(str(bin_path.resolve()))
 
+    @traced("dump._dump_bin")
     def _dump_bin(self, file_or_data: [Path, pd.DataFrame], calendar_list: List[pd.Timestamp]):
         if not calendar_list:
             logger.warning("calendar_list is empty")
@@ -307,13 +318,18 @@ class DumpDataAll(DumpDataBase):
         logger.info("start get all date......")
         all_datetime = set()
         date_range_list = []
-        _fun = partial(self._get_date, as_set=True, is_begin_end=True)
+        # with a trading calendar only each file's begin/end is needed, no need to union every date
+        use_calendar = self._trading_calendar is not None
+        _fun = partial(self._get_date, as_set=not use_calendar, is_begin_end=True)
         with tqdm(total=len(self.df_files)) as p_bar:
             with ProcessPoolExecutor(max_workers=self.works) as executor:
-                for file_path, ((_begin_time, _end_time), _set_calendars) in zip(
-                    self.df_files, executor.map(_fun, self.df_files)
-                ):
-                    all_datetime = all_datetime | _set_calendars
+                for file_path, _res in zip(self.df_files, executor.map(_fun, self.df_files)):
+                    (_begin_time, _end_time), _set_calendars = (_res, None) if use_calendar else _res
+                    if use_calendar:
+                        if isinstance(_begin_time, pd.Timestamp):
+                            all_datetime.update((_begin_time, _end_time))
+                    else:
+                        all_datetime = all_datetime | _set_calendars
                     if isinstance(_begin_time, pd.Timestamp) and isinstance(_end_time, pd.Timestamp):
                         _begin_time = self._format_datetime(_begin_time)
                         _end_time = self._format_datetime(_end_time)
@@ -327,7 +343,11 @@ class DumpDataAll(DumpDataBase):
 
     def _dump_calendars(self):
         logger.info("start dump calendars......")
-        self._calendars_list = sorted(map(pd.Timestamp, self._kwargs["all_datetime_set"]))
+        if self._trading_calendar is not None:
+            _all = self._kwargs["all_datetime_set"]
+            self._calendars_list = list(self._trading_calendar.between(min(_all), max(_all))) if _all else []
+        else:
+            self._calendars_list = sorted(map(pd.Timestamp, self._kwargs["all_datetime_set"]))
         self.save_calendars(self._calendars_list)
         logger.info("end of calendars dump.\n")
 
@@ -403,6 +423,7 @@ class DumpDataUpdate(DumpDataBase):
         exclude_fields: str = "",
         include_fields: str = "",
         limit_nums: int = None,
+        calendar_path: str = None,
     ):
         """
 
@@ -430,6 +451,9 @@ class DumpDataUpdate(DumpDataBase):
             fields not dumped
         limit_nums: int
             Use when debugging, default None
+        calendar_path: str, default None
+            trading calendar file (data_ingestion/trading_calendar.py); if set, the dumped calendar is
+            the trading days within the data range instead of the union of dates in all files
         """
         super().__init__(
             data_path,
@@ -442,6 +466,7 @@ class DumpDataUpdate(DumpDataBase):
             symbol_field_name,
             exclude_fields,
             include_fields,
+            calendar_path=calendar_path,
         )
         self._mode = self.UPDATE_MODE
         self._old_calendar_list = self._read_calendars(self._calendars_dir.joinpath(f"{self.freq}.txt"))
@@ -455,9 +480,15 @@ class DumpDataUpdate(DumpDataBase):
 
         # load all csv files
         self._all_data = self._load_all_source_data()  # type: pd.DataFrame
-        self._new_calendar_list = self._old_calendar_list + sorted(
-            filter(lambda x: x > self._old_calendar_list[-1], self._all_data[self.date_field_name].unique())
-        )
+        if self._trading_calendar is not None:
+            _data_end = self._all_data[self.date_field_name].max()
+            self._new_calendar_list = self._old_calendar_list + [
+                x for x in self._trading_calendar.between(None, _data_end) if x > self._old_calendar_list[-1]
+            ]
+        else:
+            self._new_calendar_list = self._old_calendar_list + sorted(
+                filter(lambda x: x > self._old_calendar_list[-1], self._all_data[self.date_field_name].unique())
+            )
 
     def _load_all_source_data(self):
         # NOTE: Need more memory
@@ -466,8 +497,8 @@ class DumpDataUpdate(DumpDataBase):
 
         def _read_df(file_path: Path):
             _df = read_as_df(file_path)
-            if self.date_field_name in _df.columns and not np.issubdtype(
-                _df[self.date_field_name].dtype, np.datetime64
+            if self.date_field_name in _df.columns and not pd.api.types.is_datetime64_any_dtype(
+                _df[self.date_field_name]
             ):
                 _df[self.date_field_name] = pd.to_datetime(_df[self.date_field_name])
             if self.symbol_field_name not in _df.columns:
@@ -500,7 +531,19 @@ class DumpDataUpdate(DumpDataBase):
                 _start, _end = self._get_date(_df, is_begin_end=True)
                 if not (isinstance(_start, pd.Timestamp) and isinstance(_end, pd.Timestamp)):
                     continue
-                if _code in self._update_instruments:
+                if _code in self._update_instruments and self._trading_calendar is not None:
+                    # exists stock: append every trading day after its last dumped day, so suspended days
+                    # stay NaN and the appended values line up with the calendar
+                    _old_end = pd.Timestamp(self._update_instruments[_code][self.INSTRUMENTS_END_FIELD])
+                    _update_calendars = [x for x in self._new_calendar_list if _old_end < x <= _end]
+                    _df = _df[_df[self.date_field_name] > _old_end]
+                    if _update_calendars:
+                        if _df[self.date_field_name].min() > _update_calendars[0]:
+                            _pad = {self.date_field_name: [_update_calendars[0]], self.symbol_field_name: [_code]}
+                            _df = pd.concat([pd.DataFrame(_pad), _df], ignore_index=True)
+                        self._update_instruments[_code][self.INSTRUMENTS_END_FIELD] = self._format_datetime(_end)
+                        futures[executor.submit(self._dump_bin, _df, _update_calendars)] = _code
+                elif _code in self._update_instruments:
                     # exists stock, will append data
                     _update_calendars = (
                         _df[_df[self.date_field_name] > self._update_instruments[_code][self.INSTRUMENTS_END_FIELD]][
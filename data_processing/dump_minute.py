@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+1 分钟线 -> Qlib 1min 数据 (流式写入)
+
+dump_bin.py 的 DumpDataUpdate 会把所有源数据一次性读进内存, 分钟线 (5000 只 x 240 根/天) 放不下.
+这里按股票分批从数据源读取 (每批不超过 BATCH_ROWS 行), 每只股票对齐到分钟日历后直接追加到
+features/<code>/<field>.1min.bin, 内存里始终只有当前这一批, 不会出现 日期 x 全市场 的大矩阵.
+
+bin 格式与 dump_bin.py 相同: 第一个 float32 是该股票在日历中的起始位置, 后面按日历顺序存值, 缺失为 NaN.
+追加时根据已有文件长度补齐 NaN, 已写过的分钟会被跳过, 所以同一天重复执行是幂等的.
+
+数据源:
+  - ClickHouse stock_minute 表 (data_ingestion/fetch_minute.py 写入);
+  - 合成数据 (--synthetic), 无需数据库即可端到端验证整条流水线.
+
+用法:
+    python data_processing/dump_minute.py --start 2025-12-30 --end 2025-12-30          # 增量追加
+    python data_processing/dump_minute.py --mode all --start 2025-12-01 --end 2025-12-31  # 重建
+    python data_processing/dump_minute.py --synthetic --qlib_dir /tmp/cn_data_1min --start 2024-01-02 --end 2024-01-31
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from qlib.utils import code_to_fname
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.dump_bin import DumpDataBase
+
+# Config
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_DB = "stock_data"
+MINUTE_QLIB_DIR = Path("qlib_data/cn_data_1min")  # instruments/all.txt 不区分频率, 分钟数据单独一个目录
+FREQ = "1min"
+FIELDS = ["open", "high", "low", "close", "volume", "amount"]
+BATCH_ROWS = 2_000_000  # 每批最多读取的行数 (约 100MB), 控制内存峰值
+
+
+class MinuteBinWriter:
+    """按股票流式追加 Qlib bin 文件, 最后统一写日历和股票列表"""
+
+    def __init__(self, qlib_dir: Path = MINUTE_QLIB_DIR, freq: str = FREQ, fields=FIELDS, mode: str = "update"):
+        self.qlib_dir = Path(qlib_dir)
+        self.freq = freq
+        self.fields = list(fields)
+        self.calendar_path = self.qlib_dir / DumpDataBase.CALENDARS_DIR_NAME / f"{freq}.txt"
+        self.instruments_path = self.qlib_dir / DumpDataBase.INSTRUMENTS_DIR_NAME / DumpDataBase.INSTRUMENTS_FILE_NAME
+        self.features_dir = self.qlib_dir / DumpDataBase.FEATURES_DIR_NAME
+
+        if mode == "all":
+            self._clear()
+        self.calendar = self._read_calendar()
+        self.instruments = self._read_instruments()
+
+    def _clear(self):
+        self.calendar_path.unlink(missing_ok=True)
+        self.instruments_path.unlink(missing_ok=True)
+        if self.features_dir.exists():
+            for p in self.features_dir.glob(f"*/*.{self.freq}{DumpDataBase.DUMP_FILE_SUFFIX}"):
+                p.unlink()
+
+    def _read_calendar(self) -> np.ndarray:
+        if not self.calendar_path.exists():
+            return np.array([], dtype="datetime64[s]")
+        return pd.to_datetime(pd.read_csv(self.calendar_path, header=None)[0]).to_numpy(dtype="datetime64[s]")
+
+    def _read_instruments(self) -> dict:
+        if not self.instruments_path.exists():
+            return {}
+        df = pd.read_csv(self.instruments_path, sep=DumpDataBase.INSTRUMENTS_SEP, header=None, dtype=str)
+        return {code: [pd.Timestamp(s), pd.Timestamp(e)] for code, s, e in df.itertuples(index=False)}
+
+    def extend_calendar(self, minutes) -> int:
+        """追加新的分钟. 只能往后追加; 早于日历末尾但不在日历中的分钟需要 --mode all 重建"""
+        minutes = np.unique(np.asarray(minutes, dtype="datetime64[s]"))
+        if len(self.calendar) > 0:
+            old = minutes[minutes <= self.calendar[-1]]
+            missing = old[~np.isin(old, self.calendar)]
+            if len(missing) > 0:
+                raise ValueError(f"{len(missing)} 个分钟早于现有日历末尾 ({self.calendar[-1]}), 请用 --mode all 重建")
+            minutes = minutes[minutes > self.calendar[-1]]
+        self.calendar = np.concatenate([self.calendar, minutes])
+        return len(minutes)
+
+    def append(self, code: str, dt: np.ndarray, values: dict) -> int:
+        """把一只股票按时间排序的分钟数据追加到 bin 文件, 返回实际写入的分钟数"""
+        pos = np.searchsorted(self.calendar, dt)
+        if np.any(pos >= len(self.calendar)) or np.any(self.calendar[np.minimum(pos, len(self.calendar) - 1)] != dt):
+            raise ValueError(f"{code}: 存在不在日历中的分钟, 请先 extend_calendar")
+
+        code = code.upper()
+        inst_dir = self.features_dir / code_to_fname(code).lower()
+        inst_dir.mkdir(parents=True, exist_ok=True)
+        written = 0
+        for field in self.fields:
+            bin_path = inst_dir / f"{field}.{self.freq}{DumpDataBase.DUMP_FILE_SUFFIX}"
+            if bin_path.exists():
+                # 已有文件: 起始位置 + 已存长度 = 下一个要写的日历位置
+                start = int(np.fromfile(bin_path, dtype="<f", count=1)[0])
+                next_pos = start + bin_path.stat().st_size // 4 - 1
+            else:
+                next_pos = None
+
+            keep = pos >= next_pos if next_pos is not None else np.ones(len(pos), dtype=bool)
+            if not keep.any():
+                continue
+            p = pos[keep]
+            first = p[0] if next_pos is None else next_pos
+            block = np.full(p[-1] - first + 1, np.nan, dtype="<f")
+            block[p - first] = values[field][keep]
+            if next_pos is None:
+                np.hstack([np.array([first], dtype="<f"), block]).tofile(bin_path)
+            else:
+                with bin_path.open("ab") as fp:
+                    block.tofile(fp)
+            written = len(p)
+
+        if written:
+            begin, end = pd.Timestamp(dt[0]), pd.Timestamp(dt[-1])
+            span = self.instruments.setdefault(code, [begin, end])
+            span[0], span[1] = min(span[0], begin), max(span[1], end)
+        return written
+
+    def close(self):
+        self.calendar_path.parent.mkdir(parents=True, exist_ok=True)
+        self.instruments_path.parent.mkdir(parents=True, exist_ok=True)
+        fmt = DumpDataBase.HIGH_FREQ_FORMAT
+        pd.Series(pd.DatetimeIndex(self.calendar).strftime(fmt)).to_csv(self.calendar_path, header=False, index=False)
+        rows = [(code, s.strftime(fmt), e.strftime(fmt)) for code, (s, e) in sorted(self.instruments.items())]
+        pd.DataFrame(rows).to_csv(self.instruments_path, sep=DumpDataBase.INSTRUMENTS_SEP, header=False, index=False)
+
+
+class ClickHouseMinuteSource:
+    """从 stock_minute 表按股票分批读取"""
+
+    def __init__(self, host: str = CLICKHOUSE_HOST, database: str = CLICKHOUSE_DB):
+        from clickhouse_driver import Client
+
+        self.client = Client(host=host, database=database, settings={"use_numpy": True})
+
+    def minutes(self, start, end) -> np.ndarray:
+        rows = self.client.execute(
+            "SELECT DISTINCT datetime FROM stock_minute WHERE trade_date BETWEEN %(s)s AND %(e)s ORDER BY datetime",
+            {"s": pd.Timestamp(start).date(), "e": pd.Timestamp(end).date()},
+        )
+        return np.array([r[0] for r in rows], dtype="datetime64[s]")
+
+    def iter_batches(self, start, end, batch_rows: int = BATCH_ROWS):
+        params = {"s": pd.Timestamp(start).date(), "e": pd.Timestamp(end).date()}
+        counts = self.client.execute(
+            "SELECT ts_code, count() FROM stock_minute WHERE trade_date BETWEEN %(s)s AND %(e)s "
+            "GROUP BY ts_code ORDER BY ts_code",
+            params,
+        )
+        batch, n_rows = [], 0
+        for code, n in list(counts) + [(None, 0)]:
+            if code is not None and (n_rows + n <= batch_rows or not batch):
+                batch.append(code)
+                n_rows += n
+                continue
+            if batch:
+                # FINAL: ReplacingMergeTree 合并前可能有重复行
+                yield self.client.query_dataframe(
+                    f"SELECT ts_code, datetime, {', '.join(FIELDS)} FROM stock_minute FINAL "
+                    "WHERE trade_date BETWEEN %(s)s AND %(e)s AND ts_code IN %(codes)s "
+                    "ORDER BY ts_code, datetime",
+                    {**params, "codes": tuple(batch)},
+                )
+            batch, n_rows = [code], n
+
+
+class SyntheticMinuteSource:
+    """合成分钟线: 日内随机游走价格, 随机停牌日和无成交分钟, 用于无数据库时验证流水线"""
+
+    def __init__(self, n_stocks: int = 50, seed: int = 0):
+        self.codes = [f"SH{600000 + i}" for i in range(n_stocks // 2)] + \
+                     [f"SZ{i:06d}" for i in range(1, n_stocks - n_stocks // 2 + 1)]
+        self.seed = seed
+
+    @staticmethod
+    def _day_minutes(day: pd.Timestamp) -> pd.DatetimeIndex:
+        # 与东方财富一致: 以 K 线结束时间标记, 上午 09:31~11:30, 下午 13:01~15:00, 共 240 根
+        am = pd.date_range(day + pd.Timedelta("09:31:00"), day + pd.Timedelta("11:30:00"), freq="1min")
+        pm = pd.date_range(day + pd.Timedelta("13:01:00"), day + pd.Timedelta("15:00:00"), freq="1min")
+        return am.append(pm)
+
+    def minutes(self, start, end) -> np.ndarray:
+        days = pd.bdate_range(start, end)
+        return np.concatenate([self._day_minutes(d).to_numpy(dtype="datetime64[s]") for d in days])
+
+    def iter_batches(self, start, end, batch_rows: int = BATCH_ROWS):
+        days = pd.bdate_range(start, end)
+        per_stock = len(days) * 240
+        step = max(1, batch_rows // max(per_stock, 1))
+        for i in range(0, len(self.codes), step):
+            frames = []
+            for j, code in enumerate(self.codes[i:i + step], start=i):
+                for d in days:
+                    # 每只股票每天独立的随机数, 任意切分日期区间生成的数据都相同, 便于验证增量写入
+                    rng = np.random.default_rng([self.seed, j, d.toordinal()])
+                    if rng.random() < 0.05:  # 停牌
+                        continue
+                    price = 10 * (1 + j % 7) * (1 + 0.2 * np.sin(d.toordinal() / 10 + j))
+                    dt = self._day_minutes(d)
+                    close = price * np.exp(np.cumsum(rng.normal(0, 0.002, len(dt))))
+                    open_ = np.r_[price, close[:-1]]
+                    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.001, len(dt)))
+                    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.001, len(dt)))
+                    volume = rng.integers(1, 500, len(dt)) * 100.0
+                    traded = rng.random(len(dt)) > 0.03  # 无成交的分钟没有 K 线
+                    frames.append(pd.DataFrame({
+                        "ts_code": code, "datetime": dt[traded], "open": open_[traded], "high": high[traded],
+                        "low": low[traded], "close": close[traded], "volume": volume[traded],
+                        "amount": (volume * (open_ + close) / 2)[traded],
+                    }))
+            if frames:
+                yield pd.concat(frames, ignore_index=True)
+
+
+def dump_minutes(source, start, end, qlib_dir: Path = MINUTE_QLIB_DIR, mode: str = "update",
+                 batch_rows: int = BATCH_ROWS) -> MinuteBinWriter:
+    """先扩展分钟日历, 再按股票分批追加 bin 文件"""
+    t0 = time.time()
+    writer = MinuteBinWriter(qlib_dir, mode=mode)
+    n_new = writer.extend_calendar(source.minutes(start, end))
+    print(f"分钟日历: 新增 {n_new} 个, 共 {len(writer.calendar)} 个")
+
+    n_stocks, n_rows = 0, 0
+    for batch in source.iter_batches(start, end, batch_rows):
+        codes = batch["ts_code"].to_numpy().astype(str)
+        dt = batch["datetime"].to_numpy(dtype="datetime64[s]")
+        values = {f: batch[f].to_numpy(dtype=np.float32) for f in FIELDS}
+        # 批内已按 (ts_code, datetime) 排序, 按股票切段, 不用 groupby
+        bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            n_rows += writer.append(codes[a], dt[a:b], {f: v[a:b] for f, v in values.items()})
+            n_stocks += 1
+        del batch, values
+        print(f" 已写入 {n_stocks} 只股票, {n_rows} 根 K 线")
+
+    writer.close()
+    print(f"1min 数据已写入 {Path(qlib_dir).resolve()}, 耗时 {time.time() - t0:.1f}s")
+    return writer
+
+
+if __name__ == "__main__":
+    today = pd.Timestamp.today().strftime("%Y-%m-%d")
+    parser = argparse.ArgumentParser(description="分钟线流式转换为 Qlib 1min 数据")
+    parser.add_argument("--start", default=today)
+    parser.add_argument("--end", default=today)
+    parser.add_argument("--mode", choices=["update", "all"], default="update")
+    parser.add_argument("--qlib_dir", default=str(MINUTE_QLIB_DIR))
+    parser.add_argument("--batch_rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--synthetic", action="store_true", help="使用合成数据 (不连接 ClickHouse)")
+    parser.add_argument("--n_stocks", type=int, default=50, help="合成数据的股票数")
+    args = parser.parse_args()
+
+    source = SyntheticMinuteSource(args.n_stocks) if args.synthetic else ClickHouseMinuteSource()
+    dump_minutes(source, args.start, args.end, Path(args.qlib_dir), args.mode, args.batch_rows)
@@ -1,12 +1,17 @@
 import pandas as pd
 from clickhouse_driver import Client
 from pathlib import Path
+import argparse
 import subprocess
-import requests
 import shutil
 import sys
 import time
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_ingestion.fetch_adj_factor import CREATE_TABLE_SQL as ADJ_FACTOR_TABLE_SQL, load_factors
+from data_ingestion.trading_calendar import CALENDAR_PATH, load_calendar
+from tracing import span
+
 # Config
 CLICKHOUSE_HOST = "localhost"
 CLICKHOUSE_DB = "stock_data"
@@ -14,35 +19,7 @@ CLICKHOUSE_DB = "stock_data"
 EXPORT_DIR = Path("qlib_data/cn_data") # Qlib 数据存储位置
 CSV_TEMP_DIR = Path("qlib_data/csv_temp") # 临时 CSV 存放目录
 
-DUMP_SCRIPT_URL = "https://raw.githubusercontent.com/microsoft/qlib/main/scripts/dump_bin.py"
-DUMP_SCRIPT_PATH = Path("dump_bin.py")
-
-
-def download_dump_script(force: bool = True) -> None:
-    """更新 dump_bin.py 并自动打补丁以适配 macOS"""
-    if not DUMP_SCRIPT_PATH.exists() or force:
-        print(f"正在下载/更新 Qlib 数据转换脚本: {DUMP_SCRIPT_URL}")
-        try:
-            resp = requests.get(DUMP_SCRIPT_URL, timeout=20)
-            resp.raise_for_status()
-            DUMP_SCRIPT_PATH.write_bytes(resp.content)
-            print("dump_bin.py 下载/更新成功")
-        except Exception as e:
-            if DUMP_SCRIPT_PATH.exists():
-                print(f"下载失败: {e}，使用本地缓存副本。")
-            else:
-                raise RuntimeError(f"dump_bin.py 下载失败: {e}") from e
-
-    try:
-        content = DUMP_SCRIPT_PATH.read_text(encoding='utf-8')
-        if ".iterdir()" in content:
-            print("检测到原始脚本, 正在应用 macOS 兼容性补丁...")
-            new_content = content.replace(".iterdir()", ".glob('*.csv')")
-            DUMP_SCRIPT_PATH.write_text(new_content, encoding='utf-8')
-        elif ".glob('*.csv')" in content:
-            print("脚本已包含 macOS 兼容性补丁.")
-    except Exception as e:
-        print(f"应用补丁失败 (非致命错误): {e}")
+DUMP_SCRIPT_PATH = Path(__file__).resolve().parent / "dump_bin.py"
 
 
 def hard_reset_dir(dir_path: Path) -> None:
@@ -74,16 +51,77 @@ def sanitize_csv_temp_dir(dir_path: Path) -> None:
         print(f"已清理 csv_temp 中 {removed} 个非 CSV 项")
 
 
-def export_clickhouse_to_qlib():
-    # 0) 更新 dump_bin.py
-    download_dump_script(force=False)
-
+def apply_adj_factor(df: pd.DataFrame, factors: pd.DataFrame) -> pd.DataFrame:
+    """
+    stock_daily 为不复权价格. 按 (股票, 日期) asof 匹配后复权因子, 再按股票归一到最新一天为 1,
+    得到 Qlib 的 $factor (= 复权价 / 原始价): 价格乘以因子, 成交量除以因子 (成交额不变).
+    归一后最新价格等于原始价, 与原先的前复权数据同一尺度. 没有因子记录的代码 (如基准指数) 因子为 1.
+    """
+    df = df.sort_values("date", kind="stable")
+    if factors.empty:
+        df["factor"] = 1.0
+    else:
+        factors = factors.rename(columns={"trade_date": "date"}).sort_values("date")
+        factors["ts_code"] = factors["ts_code"].astype(str)
+        df["ts_code"] = df["ts_code"].astype(str)
+        df = pd.merge_asof(df, factors, on="date", by="ts_code", direction="backward")
+        # 早于第一条因子记录的日期按上市时的 1.0 处理
+        hfq = df["hfq_factor"].fillna(1.0)
+        latest = hfq.groupby(df["ts_code"]).transform("last")
+        df["factor"] = hfq / latest
+        df = df.drop(columns="hfq_factor")
+    for col in ["open", "close", "high", "low"]:
+        df[col] = df[col] * df["factor"]
+    df["volume"] = df["volume"] / df["factor"]
+    return df
+
+
+def last_exported_day():
+    """已导出的 Qlib 日历的最后一天, 还没有导出过时返回 None"""
+    path = EXPORT_DIR / "calendars" / "day.txt"
+    if not path.exists():
+        return None
+    days = path.read_text(encoding="utf-8").split()
+    return pd.Timestamp(days[-1]) if days else None
+
+
+def incremental_start(client, calendar):
+    """
+    增量导出的起始交易日. 返回 None 表示需要全量导出, 返回 False 表示已是最新.
+    $factor 按最新一天归一, 导出后如果有新的除权记录, 历史上所有的 $factor 都会变, 只能全量重导.
+    """
+    last = last_exported_day()
+    if last is None:
+        print("还没有导出过 Qlib 数据, 执行全量导出")
+        return None
+    latest = calendar.latest()
+    if last >= latest:
+        print(f"Qlib 数据已更新到最近交易日 {latest.date()}, 无需导出")
+        return False
+    client.execute(ADJ_FACTOR_TABLE_SQL)
+    changed = client.execute(f"SELECT count() FROM stock_adj_factor WHERE trade_date > '{last.date()}'")[0][0]
+    if changed:
+        print(f"{last.date()} 之后有 {changed} 条新的复权因子, 历史 $factor 需要重算, 改为全量导出")
+        return None
+    return calendar.next(last)
+
+
+def export_clickhouse_to_qlib(incremental: bool = False):
     # 1) 读 ClickHouse
     client = Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB, settings={"use_numpy": True})
+    calendar = load_calendar()
 
-    print("正在从 ClickHouse 读取全量数据...")
-    
-    sql = """
+    start = incremental_start(client, calendar) if incremental else None
+    if start is False:
+        return
+    if start is None:
+        print("正在从 ClickHouse 读取全量数据...")
+        where = ""
+    else:
+        print(f"增量导出: 读取 {start.date()} 起的数据...")
+        where = f"WHERE t1.trade_date >= '{start.date()}'"
+
+    sql = f"""
     SELECT
         t1.ts_code    AS ts_code,
         t1.trade_date AS trade_date,
@@ -128,12 +166,17 @@ def export_clickhouse_to_qlib():
         FROM stock_daily_alpha
         WHERE strategy_name = 'multi_factor_v1'
     ) t_alpha ON t1.ts_code = t_alpha.ts_code AND t1.trade_date = t_alpha.trade_date
-    
+
+    {where}
     ORDER BY t1.trade_date ASC
     """
 
-    df = client.query_dataframe(sql)
+    with span("clickhouse.query_dataframe", table="stock_daily"):
+        df = client.query_dataframe(sql)
     print(f"读取完成！共 {len(df)} 行数据。")
+    if df.empty:
+        print("没有需要导出的数据")
+        return
     
     # 2) 规范字段
     try:
@@ -156,7 +199,12 @@ def export_clickhouse_to_qlib():
 
     df["symbol"] = df["ts_code"]
     df["volume"] = df["volume"].astype(float)
-    df["factor"] = 1.0
+
+    # 原始价格 -> 复权价格 + $factor
+    with span("export.adj_factor"):
+        factors = load_factors(client)
+        df = apply_adj_factor(df, factors)
+    print(f"复权因子: {factors['ts_code'].nunique() if not factors.empty else 0} 只股票")
     
     # 确保 turnover 是 float 类型
     if "turnover" in df.columns:
@@ -178,45 +226,48 @@ def export_clickhouse_to_qlib():
     total = grouped.ngroups
     count = 0
 
-    for symbol, g in grouped:
-        symbol = str(symbol)
-        safe_symbol = symbol.replace("/", "_").replace("\\", "_").strip()
-        file_path = CSV_TEMP_DIR / f"{safe_symbol}.csv"
+    with span("export.write_csv", stocks=total, rows=len(df)):
+        for symbol, g in grouped:
+            symbol = str(symbol)
+            safe_symbol = symbol.replace("/", "_").replace("\\", "_").strip()
+            file_path = CSV_TEMP_DIR / f"{safe_symbol}.csv"
 
-        g.to_csv(
-            file_path,
-            index=False,
-            columns=cols_to_write,
-            date_format="%Y-%m-%d",
-        )
+            g.to_csv(
+                file_path,
+                index=False,
+                columns=cols_to_write,
+                date_format="%Y-%m-%d",
+            )
 
-        count += 1
-        if count % 1000 == 0:
-            print(f" 已处理 {count}/{total} 只股票...")
+            count += 1
+            if count % 1000 == 0:
+                print(f" 已处理 {count}/{total} 只股票...")
 
     # 4) 二次清理
     sanitize_csv_temp_dir(CSV_TEMP_DIR)
 
     print("CSV 准备就绪，开始调用 Qlib 转换脚本...")
 
-    # 5) 调用 dump_bin.py
+    # 5) 调用 dump_bin.py: 日历取自交易日历, 增量时只追加新交易日
     EXPORT_DIR.parent.mkdir(parents=True, exist_ok=True)
 
     cmd = [
         sys.executable, str(DUMP_SCRIPT_PATH),
-        "dump_all",
+        "dump_all" if start is None else "dump_update",
         "--data_path", str(CSV_TEMP_DIR),
         "--qlib_dir", str(EXPORT_DIR),
         "--include_fields", "open,close,high,low,volume,amount,factor,turnover,sentiment,sector_score,total_score",
         "--date_field_name", "date",
         "--symbol_field_name", "symbol",
         "--file_suffix", ".csv",
+        "--calendar_path", str(CALENDAR_PATH),
     ]
 
     print(f"执行命令: {' '.join(cmd)}")
 
     try:
-        subprocess.run(cmd, check=True)
+        with span("export.dump_bin"):
+            subprocess.run(cmd, check=True)
         print(f"\n转换完成. Qlib 数据已更新至: {EXPORT_DIR.resolve()}")
     except subprocess.CalledProcessError as e:
         print(f"\n转换失败: {e}")
@@ -225,4 +276,9 @@ def export_clickhouse_to_qlib():
 
 
 if __name__ == "__main__":
-    export_clickhouse_to_qlib()
+    parser = argparse.ArgumentParser(description="ClickHouse -> Qlib bin")
+    parser.add_argument("--incremental", action="store_true",
+                        help="只导出上次导出之后的交易日 (有新的复权因子时自动改为全量)")
+    args = parser.parse_args()
+
+    export_clickhouse_to_qlib(incremental=args.incremental)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+特征/标签磁盘缓存
+
+DataHandlerLP 每次运行都要从 .bin 重新计算 2020~2025 的全部表达式.
+这里把 QlibDataLoader 的原始输出 (处理器之前) 按
+"表达式 + 股票池 + 时间段 + 数据版本" 做哈希, 存成 Parquet 文件;
+下次直接 memory-map 读取, 完全跳过特征计算.
+
+用法:
+    from data_processing.feature_cache import load_features, static_loader_config
+    df = load_features({"feature": (fields, names), "label": (label_expr, label_cols)},
+                       instruments="all", start_time="2020-01-01", end_time="2025-12-31")
+    # 再把 df 交给 StaticDataLoader, 处理器 (CSRankNorm/Fillna...) 照常执行
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tracing import span
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+CACHE_DIR = Path("qlib_data/feature_cache")
+MAX_CACHE_BYTES = 20 * 1024 ** 3  # 缓存目录上限 20GB, 超出后按最近使用时间淘汰
+COL_SEP = "::"  # Parquet 不支持多级列名, 存盘时把 (feature, amplitude) 拼成 "feature::amplitude"
+
+
+def data_version(qlib_dir: Path = QLIB_DATA_DIR, freq: str = "day") -> str:
+    """数据版本戳: 日历/股票列表内容 + 所有 bin 文件的数量、总大小、最新修改时间"""
+    qlib_dir = Path(qlib_dir)
+    h = hashlib.sha1()
+    for rel in (f"calendars/{freq}.txt", "instruments/all.txt"):
+        p = qlib_dir / rel
+        if p.exists():
+            h.update(p.read_bytes())
+
+    # 只 stat 不读内容, 5000 只股票 x 12 个字段也就几万次系统调用
+    n_files, total_size, latest_mtime = 0, 0, 0
+    features_dir = qlib_dir / "features"
+    if features_dir.exists():
+        suffix = f".{freq}.bin"
+        with os.scandir(features_dir) as inst_it:
+            for inst in inst_it:
+                if not inst.is_dir():
+                    continue
+                with os.scandir(inst.path) as file_it:
+                    for f in file_it:
+                        if f.name.endswith(suffix):
+                            st = f.stat()
+                            n_files += 1
+                            total_size += st.st_size
+                            latest_mtime = max(latest_mtime, st.st_mtime_ns)
+    h.update(f"{n_files}|{total_size}|{latest_mtime}".encode())
+    return h.hexdigest()[:16]
+
+
+def instruments_version(instruments, qlib_dir: Path = QLIB_DATA_DIR) -> str:
+    """股票池文件 (data_processing/universe.py 每天增量更新) 的内容哈希; "all" 已计入 data_version"""
+    path = Path(qlib_dir) / "instruments" / f"{instruments}.txt"
+    if not isinstance(instruments, str) or instruments == "all" or not path.exists():
+        return ""
+    return hashlib.sha1(path.read_bytes()).hexdigest()[:12]
+
+
+def cache_key(config: dict, instruments, start_time, end_time, freq: str = "day", version: str = "") -> str:
+    """对 表达式/列名 + 股票池 + 时间段 + 频率 + 数据版本 做哈希"""
+    payload = {
+        "config": {k: [list(v[0]), list(v[1])] for k, v in sorted(config.items())},
+        "instruments": instruments,
+        "start_time": str(start_time),
+        "end_time": str(end_time),
+        "freq": freq,
+        "version": version,
+    }
+    raw = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def _save_parquet(df: pd.DataFrame, path: Path) -> None:
+    flat = df.copy(deep=False)
+    flat.columns = [COL_SEP.join(map(str, c)) if isinstance(c, tuple) else str(c) for c in flat.columns]
+    flat = flat.reset_index()
+    # 先写临时文件再 rename, 防止中断留下半个文件被当成命中
+    tmp_path = path.with_suffix(".parquet.tmp")
+    flat.to_parquet(tmp_path, engine="pyarrow", index=False)
+    os.replace(tmp_path, path)
+
+
+def _load_parquet(path: Path) -> pd.DataFrame:
+    import pyarrow.parquet as pq
+
+    # memory_map + split_blocks + self_destruct: 每列单独成块, 尽量不做二次拷贝
+    table = pq.read_table(path, memory_map=True)
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    df = df.set_index(["datetime", "instrument"])
+    if any(COL_SEP in c for c in df.columns):
+        df.columns = pd.MultiIndex.from_tuples([tuple(c.split(COL_SEP, 1)) for c in df.columns])
+    return df
+
+
+def evict(cache_dir: Path = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES, pattern: str = "*.parquet") -> int:
+    """按最近使用时间 (mtime) 淘汰旧缓存, 直到目录总大小不超过 max_bytes. 返回删除的文件数"""
+    cache_dir = Path(cache_dir)
+    if not cache_dir.exists():
+        return 0
+    files = sorted(cache_dir.glob(pattern), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in files)
+    removed = 0
+    for p in files:
+        if total <= max_bytes:
+            break
+        total -= p.stat().st_size
+        p.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def load_features(
+    config: dict,
+    instruments="all",
+    start_time=None,
+    end_time=None,
+    freq: str = "day",
+    qlib_dir: Path = QLIB_DATA_DIR,
+    cache_dir: Path = CACHE_DIR,
+    max_bytes: int = MAX_CACHE_BYTES,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    读取 QlibDataLoader 格式的特征/标签表 (列为 (group, name) 两级), 命中缓存则跳过计算.
+    调用前需要先 qlib.init.
+    """
+    cache_dir = Path(cache_dir)
+    version = data_version(qlib_dir, freq) + instruments_version(instruments, qlib_dir)
+    key = cache_key(config, instruments, start_time, end_time, freq, version)
+    path = cache_dir / f"{key}.parquet"
+
+    if use_cache and path.exists():
+        t0 = time.time()
+        with span("feature_cache.read", key=key):
+            df = _load_parquet(path)
+        os.utime(path)  # 标记最近使用, 供 LRU 淘汰
+        print(f"特征缓存命中: {path.name} ({len(df)} 行, {time.time() - t0:.2f}s)")
+        return df
+
+    from qlib.data.dataset.loader import QlibDataLoader
+
+    t0 = time.time()
+    print("特征缓存未命中, 正在通过 Qlib 计算表达式...")
+    with span("qlib.load_features", instruments=str(instruments), start=str(start_time), end=str(end_time)):
+        df = QlibDataLoader(config=config, freq=freq).load(instruments, start_time, end_time)
+    print(f"特征计算完成: {len(df)} 行, {time.time() - t0:.2f}s")
+
+    if use_cache:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        _save_parquet(df, path)
+        removed = evict(cache_dir, max_bytes)
+        if removed > 0:
+            print(f"特征缓存超出上限, 已淘汰 {removed} 个旧文件")
+    return df
+
+
+def static_loader_config(df: pd.DataFrame) -> dict:
+    """把缓存好的 DataFrame 包装成 DataHandlerLP 可用的 data_loader 配置"""
+    return {
+        "class": "StaticDataLoader",
+        "module_path": "qlib.data.dataset.loader",
+        "kwargs": {"config": df},
+    }
+
+
+if __name__ == "__main__":
+    if not CACHE_DIR.exists():
+        print(f"缓存目录不存在: {CACHE_DIR}")
+    else:
+        files = sorted(CACHE_DIR.glob("*.parquet"), key=lambda p: p.stat().st_mtime, reverse=True)
+        total = sum(p.stat().st_size for p in files)
+        print(f"缓存目录: {CACHE_DIR.resolve()}  共 {len(files)} 个文件, {total / 1024 ** 2:.1f} MB")
+        for p in files:
+            st = p.stat()
+            print(f"  {p.name}  {st.st_size / 1024 ** 2:>8.1f} MB  {time.strftime('%Y-%m-%d %H:%M', time.localtime(st.st_mtime))}")
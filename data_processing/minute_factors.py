@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+分钟线日度聚合因子 -> 日线 Qlib 字段
+
+从 1min bin (dump_minute.py 生成) 按股票流式读取指定日期区间, 聚合成每日一个值,
+写入日线目录的 features/<code>/<field>.day.bin, 之后在表达式里直接用 $inflow_30m / $vwap_gap.
+
+  - inflow_30m: 开盘前 30 分钟的净流入占全天成交额的比例.
+                每根 K 线收盘 > 开盘记为流入, < 记为流出, 按成交额加权;
+                "前 30 分钟" 按市场分钟日历计算, 个股某分钟无成交不影响计数.
+  - vwap_gap:   收盘价相对当日 VWAP (成交额 / 成交量) 的偏离, close / vwap - 1.
+
+写日线字段时读出旧文件、合并新值后整体重写 (日线文件很小), 重复计算同一天是幂等的.
+
+用法:
+    python data_processing/minute_factors.py --start 2025-12-30 --end 2025-12-30
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from qlib.utils import code_to_fname
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.dump_bin import DumpDataBase
+from data_processing.dump_minute import FREQ, MINUTE_QLIB_DIR, MinuteBinWriter
+
+# Config
+DAY_QLIB_DIR = Path("qlib_data/cn_data")
+FIRST_MINUTES = 30
+FACTOR_FIELDS = ["inflow_30m", "vwap_gap"]
+
+
+def _read_range(path: Path, lo: int, hi: int) -> np.ndarray:
+    """读取 bin 文件中日历位置 [lo, hi) 的值, 不在文件范围内的位置为 NaN"""
+    out = np.full(hi - lo, np.nan, dtype=np.float32)
+    if not path.exists():
+        return out
+    start = int(np.fromfile(path, dtype="<f", count=1)[0])
+    length = path.stat().st_size // 4 - 1
+    a, b = max(lo, start), min(hi, start + length)
+    if a < b:
+        out[a - lo:b - lo] = np.fromfile(path, dtype="<f", count=b - a, offset=4 * (1 + a - start))
+    return out
+
+
+def daily_aggregates(bars: dict, day_id: np.ndarray, minute_of_day: np.ndarray, n_days: int,
+                     first_minutes: int = FIRST_MINUTES) -> dict:
+    """
+    bars: {字段: 一只股票在日历区间上的分钟序列}, day_id: 每个分钟属于第几天, minute_of_day: 当天第几分钟.
+    返回 {因子名: 长度 n_days 的数组}, 当天无成交为 NaN
+    """
+    o, c, v, amt = bars["open"], bars["close"], bars["volume"], bars["amount"]
+    traded = ~np.isnan(c) & ~np.isnan(amt)
+    amt0 = np.where(traded, amt, 0.0)
+    vol0 = np.where(traded & ~np.isnan(v), v, 0.0)
+    direction = np.sign(np.where(traded, c - o, 0.0))
+    early = minute_of_day < first_minutes
+
+    total_amt = np.bincount(day_id, weights=amt0, minlength=n_days)
+    total_vol = np.bincount(day_id, weights=vol0, minlength=n_days)
+    net_early = np.bincount(day_id, weights=np.where(early, amt0 * direction, 0.0), minlength=n_days)
+
+    # 每天最后一根有成交的 K 线的收盘价
+    last_close = np.full(n_days, np.nan)
+    idx = np.flatnonzero(traded)
+    last_close[day_id[idx]] = c[idx]  # 同一天后写的覆盖先写的, 即最后一根
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        inflow = np.where(total_amt > 0, net_early / total_amt, np.nan)
+        vwap = np.where(total_vol > 0, total_amt / total_vol, np.nan)
+        gap = last_close / vwap - 1
+    return {"inflow_30m": inflow, "vwap_gap": gap}
+
+
+def write_day_field(inst_dir: Path, field: str, day_pos: np.ndarray, values: np.ndarray) -> None:
+    """把 (日线日历位置, 值) 合并进 <field>.day.bin"""
+    bin_path = inst_dir / f"{field}.day{DumpDataBase.DUMP_FILE_SUFFIX}"
+    lo, hi = int(day_pos.min()), int(day_pos.max()) + 1
+    if bin_path.exists():
+        old = np.fromfile(bin_path, dtype="<f")
+        start, old = int(old[0]), old[1:]
+        lo, hi = min(lo, start), max(hi, start + len(old))
+        merged = np.full(hi - lo, np.nan, dtype="<f")
+        merged[start - lo:start - lo + len(old)] = old
+    else:
+        merged = np.full(hi - lo, np.nan, dtype="<f")
+    merged[day_pos - lo] = values
+    tmp_path = bin_path.with_suffix(".tmp")
+    np.hstack([np.array([lo], dtype="<f"), merged]).tofile(tmp_path)
+    tmp_path.replace(bin_path)
+
+
+def build_minute_factors(start, end, minute_dir: Path = MINUTE_QLIB_DIR, day_dir: Path = DAY_QLIB_DIR,
+                         first_minutes: int = FIRST_MINUTES) -> int:
+    """逐只股票读取 [start, end] 的分钟数据, 聚合后写入日线字段, 返回处理的股票数"""
+    t0 = time.time()
+    reader = MinuteBinWriter(minute_dir)  # 只用来读取日历和股票列表
+    calendar = reader.calendar
+    lo = int(np.searchsorted(calendar, np.datetime64(pd.Timestamp(start).normalize(), "s")))
+    hi = int(np.searchsorted(calendar, np.datetime64(pd.Timestamp(end).normalize() + pd.Timedelta(days=1), "s")))
+    if lo >= hi:
+        print(f"{start} ~ {end} 没有分钟数据")
+        return 0
+
+    minutes = calendar[lo:hi]
+    days, day_id = np.unique(minutes.astype("datetime64[D]"), return_inverse=True)
+    day_start = np.searchsorted(day_id, np.arange(len(days)))
+    minute_of_day = np.arange(len(minutes)) - day_start[day_id]
+
+    day_calendar = DumpDataBase._read_calendars(Path(day_dir) / DumpDataBase.CALENDARS_DIR_NAME / "day.txt")
+    day_calendar = pd.DatetimeIndex(day_calendar)
+    day_pos = day_calendar.get_indexer(pd.DatetimeIndex(days))
+    on_calendar = day_pos >= 0
+    if not on_calendar.all():
+        print(f"警告: {int((~on_calendar).sum())} 个交易日不在日线日历中, 已跳过")
+        if not on_calendar.any():
+            return 0
+
+    n_stocks = 0
+    features_dir = reader.features_dir
+    for code in sorted(reader.instruments):
+        inst_dir = features_dir / code_to_fname(code).lower()
+        bars = {
+            f: _read_range(inst_dir / f"{f}.{FREQ}{DumpDataBase.DUMP_FILE_SUFFIX}", lo, hi)
+            for f in ("open", "close", "volume", "amount")
+        }
+        if np.isnan(bars["close"]).all():
+            continue
+        factors = daily_aggregates(bars, day_id, minute_of_day, len(days), first_minutes)
+        out_dir = Path(day_dir) / DumpDataBase.FEATURES_DIR_NAME / code_to_fname(code).lower()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for field in FACTOR_FIELDS:
+            write_day_field(out_dir, field, day_pos[on_calendar], factors[field][on_calendar])
+        n_stocks += 1
+
+    print(f"分钟聚合因子 {FACTOR_FIELDS}: {len(days)} 天 x {n_stocks} 只, 耗时 {time.time() - t0:.1f}s")
+    return n_stocks
+
+
+if __name__ == "__main__":
+    today = pd.Timestamp.today().strftime("%Y-%m-%d")
+    parser = argparse.ArgumentParser(description="分钟线日度聚合因子")
+    parser.add_argument("--start", default=today)
+    parser.add_argument("--end", default=today)
+    parser.add_argument("--minute_dir", default=str(MINUTE_QLIB_DIR))
+    parser.add_argument("--day_dir", default=str(DAY_QLIB_DIR))
+    args = parser.parse_args()
+
+    build_minute_factors(args.start, args.end, Path(args.minute_dir), Path(args.day_dir))
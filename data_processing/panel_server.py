@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+共享内存行情面板 (日期 x 股票)
+
+训练、回测、调参进程池和研究 notebook 各自把同一份 Qlib 日线读成自己的 DataFrame, 内存成倍占用, 每次都要重新加载.
+这里由一个常驻进程把 OHLCV / turnover / factor / change 直接从 .bin 读进 POSIX 共享内存 (/dev/shm), 只读一次;
+其他进程按名字挂载, 拿到的是共享内存上的 numpy view, 不复制数据.
+
+版本: 每次发布都新建一块共享内存 (qlib_panel_<数据版本>_<序号>), 写完后才原子地替换清单文件
+(MANIFEST_PATH, os.replace), 已发布的块不再修改. 读者挂载时读清单拿到当前块名, 之后一直看到这个一致的快照;
+服务端只 unlink 旧块的名字, 已经映射的读者不受影响, 内存在最后一个读者关闭后才释放.
+服务端每 POLL_SECONDS 检查一次 bin 数据版本 (feature_cache.data_version), 导出新数据后自动发布新版本.
+
+用法:
+    python data_processing/panel_server.py serve            # 常驻, 数据变化时发布新版本
+    python data_processing/panel_server.py status           # 当前版本 / 大小
+    python data_processing/panel_server.py bench --procs 4  # 对比每个进程自己读 bin 与挂载共享内存
+
+    from data_processing.panel_server import attach
+    with attach() as panel:
+        close = panel["close"]          # (日期, 股票) float32, 只读 view
+        df = panel.frame("close")       # index=dates, columns=codes 的 DataFrame, 同样不复制
+
+    attach_current() 额外核对面板版本与磁盘上的 bin 一致, 不一致 (或服务未启动) 返回 None;
+    tradability.py 用它读取 OHLCV, fast_backtest.load_price_panel (param_sweep / robustness / overlays 的行情)
+    用它读取收盘价、涨跌幅和复权因子, 服务未启动时照常走 D.features.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.feature_cache import data_version
+from data_processing.shared_arrays import attach_untracked
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+MANIFEST_PATH = Path("qlib_data/panel/current.json")
+FIELDS = ["open", "high", "low", "close", "volume", "turnover", "factor", "change"]  # 没有 change.day.bin 时为 NaN
+DTYPE = np.float32  # 与 bin 文件一致
+SHM_PREFIX = "qlib_panel_"
+ALIGN = 64
+POLL_SECONDS = 60
+KEEP_VERSIONS = 2  # 除当前版本外保留名字的旧版本数, 给刚读到旧清单、还没挂载的读者留时间
+ATTACH_RETRIES = 3
+
+
+def _read_universe(qlib_dir: Path, freq: str = "day"):
+    dates = pd.DatetimeIndex(pd.to_datetime((qlib_dir / "calendars" / f"{freq}.txt").read_text().split()))
+    with open(qlib_dir / "instruments" / "all.txt") as f:
+        codes = pd.Index(sorted({line.split("\t")[0] for line in f if line.strip()}))
+    return dates, codes
+
+
+def _fill_from_bins(qlib_dir: Path, codes, fields, arrays: dict, freq: str = "day") -> None:
+    """bin 文件: 第一个 float32 是起始日在日历中的下标, 其后是逐日的值"""
+    features = qlib_dir / "features"
+    n_dates = next(iter(arrays.values())).shape[0]
+    for j, code in enumerate(codes):
+        inst_dir = features / code.lower()
+        for field in fields:
+            path = inst_dir / f"{field}.{freq}.bin"
+            if not path.exists():
+                continue
+            raw = np.fromfile(path, dtype="<f4")
+            if len(raw) < 2:
+                continue
+            start = int(raw[0])
+            values = raw[1:n_dates - start + 1]
+            arrays[field][start:start + len(values), j] = values
+
+
+def read_panel(qlib_dir: Path = QLIB_DATA_DIR, fields=FIELDS, freq: str = "day"):
+    """不经过面板服务, 本进程直接从 bin 读成 (日期, 股票) 矩阵: 返回 (dates, codes, {字段: 数组})"""
+    dates, codes = _read_universe(Path(qlib_dir), freq)
+    arrays = {f: np.full((len(dates), len(codes)), np.nan, dtype=DTYPE) for f in fields}
+    _fill_from_bins(Path(qlib_dir), codes, fields, arrays, freq)
+    return dates, codes, arrays
+
+
+def _layout(shape, fields):
+    """各字段在块内的偏移 (按 ALIGN 对齐), 返回 ({字段: 偏移}, 数据区总字节数)"""
+    nbytes = int(np.prod(shape)) * np.dtype(DTYPE).itemsize
+    step = -(-nbytes // ALIGN) * ALIGN
+    return {field: i * step for i, field in enumerate(fields)}, step * len(fields)
+
+
+class Panel:
+    """一个版本的只读快照; 用完 close() (或 with), 关闭前应先释放取出的 view"""
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self._shm = shm
+        header_len = int(np.frombuffer(shm.buf[:8], dtype="<u8")[0])
+        self.meta = json.loads(bytes(shm.buf[8:8 + header_len]).decode("utf-8"))
+        self.version = self.meta["version"]
+        self.dates = pd.DatetimeIndex(pd.to_datetime(self.meta["dates"]))
+        self.codes = pd.Index(self.meta["codes"])
+        shape = (len(self.dates), len(self.codes))
+        base = self.meta["data_offset"]
+        self._arrays = {}
+        for field, offset in self.meta["offsets"].items():
+            arr = np.ndarray(shape, dtype=DTYPE, buffer=shm.buf, offset=base + offset)
+            arr.flags.writeable = False
+            self._arrays[field] = arr
+
+    @property
+    def fields(self) -> list:
+        return list(self._arrays)
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self._arrays[field]
+
+    def frame(self, field: str) -> pd.DataFrame:
+        """宽表 (index=dates, columns=codes), 底层仍是共享内存, 不复制"""
+        return pd.DataFrame(self._arrays[field], index=self.dates, columns=self.codes, copy=False)
+
+    def close(self) -> None:
+        self._arrays = {}
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # 调用方还持有 view, 映射随进程退出释放
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def read_manifest(manifest: Path = MANIFEST_PATH) -> dict:
+    with open(manifest, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def attach(manifest: Path = MANIFEST_PATH) -> Panel:
+    """挂载当前版本. 读清单与挂载之间服务端可能刚好淘汰了该版本, 这时重读清单重试"""
+    for attempt in range(ATTACH_RETRIES):
+        name = read_manifest(manifest)["name"]
+        try:
+            return Panel(attach_untracked(name))
+        except FileNotFoundError:
+            if attempt == ATTACH_RETRIES - 1:
+                raise
+            time.sleep(0.1)
+
+
+def attach_current(qlib_dir: Path = QLIB_DATA_DIR, manifest: Path = MANIFEST_PATH):
+    """面板服务在运行, 且发布的版本与 qlib_dir 当前的 bin 数据一致时返回 Panel, 否则 None (调用方自己读取)"""
+    if not Path(manifest).exists():
+        return None
+    try:
+        panel = attach(manifest)
+    except (OSError, ValueError):
+        return None
+    if panel.version.split(":")[0] != data_version(qlib_dir):
+        panel.close()
+        return None
+    return panel
+
+
+def take(arr: np.ndarray, rows: np.ndarray, cols: np.ndarray, dtype=np.float64) -> np.ndarray:
+    """按下标取子矩阵 (会复制), 下标为 -1 的行/列填 NaN"""
+    out = arr[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))].astype(dtype)
+    out[rows < 0, :] = np.nan
+    out[:, cols < 0] = np.nan
+    return out
+
+
+class PanelServer:
+    """持有全部已发布的块; 发布顺序: 建块 -> 填数据 -> 替换清单 -> 淘汰旧块"""
+
+    def __init__(self, qlib_dir: Path = QLIB_DATA_DIR, fields=FIELDS, manifest: Path = MANIFEST_PATH):
+        self.qlib_dir = Path(qlib_dir)
+        self.fields = list(fields)
+        self.manifest = Path(manifest)
+        self.blocks = []  # [(名字, SharedMemory)], 最新的在最后
+        self.data_version = None
+        self.seq = 0
+
+    def publish(self) -> str:
+        t0 = time.time()
+        version = data_version(self.qlib_dir)
+        dates, codes = _read_universe(self.qlib_dir)
+        shape = (len(dates), len(codes))
+        offsets, data_bytes = _layout(shape, self.fields)
+        self.seq += 1
+        name = f"{SHM_PREFIX}{version[:12]}_{self.seq}"
+        meta = {"version": f"{version}:{self.seq}", "name": name, "fields": self.fields, "offsets": offsets,
+                "dates": [d.strftime("%Y-%m-%d") for d in dates], "codes": list(codes), "shape": list(shape)}
+        # 头部长度依赖 data_offset 本身, 预留足够的位数后再定
+        header = json.dumps({**meta, "data_offset": 0}).encode("utf-8")
+        data_offset = -(-(8 + len(header) + 32) // ALIGN) * ALIGN
+        header = json.dumps({**meta, "data_offset": data_offset}).encode("utf-8")
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=data_offset + data_bytes)
+        shm.buf[:8] = np.array([len(header)], dtype="<u8").tobytes()
+        shm.buf[8:8 + len(header)] = header
+        arrays = {f: np.ndarray(shape, dtype=DTYPE, buffer=shm.buf, offset=data_offset + offsets[f])
+                  for f in self.fields}
+        for arr in arrays.values():
+            arr.fill(np.nan)
+        _fill_from_bins(self.qlib_dir, codes, self.fields, arrays)
+        del arrays
+
+        # 块写完才切换清单, 读者只会看到完整的版本
+        self.manifest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"name": name, "version": meta["version"], "shape": list(shape),
+                                   "fields": self.fields, "bytes": shm.size, "pid": os.getpid(),
+                                   "published_at": time.strftime("%Y-%m-%d %H:%M:%S")}), encoding="utf-8")
+        os.replace(tmp, self.manifest)
+        self.blocks.append((name, shm))
+        self.data_version = version
+        self._retire(KEEP_VERSIONS)
+        print(f"已发布 {name}: {shape[0]} 天 x {shape[1]} 只 x {len(self.fields)} 个字段, "
+              f"{shm.size / 1024 ** 2:.1f} MB, 耗时 {time.time() - t0:.2f}s")
+        return name
+
+    def _retire(self, keep: int) -> None:
+        # unlink 只删除名字; 已经挂载的读者继续使用旧快照
+        while len(self.blocks) > keep + 1:
+            name, shm = self.blocks.pop(0)
+            shm.close()
+            shm.unlink()
+            print(f"已淘汰 {name}")
+
+    def serve(self, poll: float = POLL_SECONDS) -> None:
+        self.publish()
+        while True:
+            time.sleep(poll)
+            if data_version(self.qlib_dir) != self.data_version:
+                print("bin 数据有更新, 发布新版本")
+                self.publish()
+
+    def shutdown(self) -> None:
+        for _, shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+        if self.manifest.exists() and read_manifest(self.manifest).get("pid") == os.getpid():
+            self.manifest.unlink()
+
+
+def status(manifest: Path = MANIFEST_PATH) -> None:
+    if not manifest.exists():
+        print(f"未找到 {manifest}, 面板服务未启动 (python data_processing/panel_server.py serve)")
+        return
+    info = read_manifest(manifest)
+    print(f"当前版本: {info['name']} (发布于 {info['published_at']}, 服务进程 {info['pid']})")
+    print(f"形状: {info['shape'][0]} 天 x {info['shape'][1]} 只, 字段: {', '.join(info['fields'])}, "
+          f"{info['bytes'] / 1024 ** 2:.1f} MB")
+    try:
+        with attach(manifest) as panel:
+            close = panel["close"]
+            print(f"挂载成功: {panel.dates[0].date()} ~ {panel.dates[-1].date()}, "
+                  f"收盘价非空 {np.count_nonzero(~np.isnan(close))} 个")
+            del close
+    except FileNotFoundError:
+        print("挂载失败: 共享内存块不存在 (服务进程可能已退出)")
+
+
+def _bench_worker(args):
+    mode, qlib_dir = args
+    t0 = time.perf_counter()
+    if mode == "attach":
+        panel = attach()
+        close = panel["close"]
+    else:
+        close = read_panel(Path(qlib_dir))[2]["close"]
+    t1 = time.perf_counter()
+    total = float(np.nansum(close[-250:]))
+    return t1 - t0, total
+
+
+def bench(procs: int, qlib_dir: Path = QLIB_DATA_DIR) -> None:
+    """每个进程自己读 bin 与挂载共享内存的加载耗时, 以及两种方式读到的数据是否一致"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    server = PanelServer(qlib_dir, manifest=MANIFEST_PATH)
+    try:
+        server.publish()
+        with ProcessPoolExecutor(max_workers=procs) as executor:
+            for mode in ("bins", "attach"):
+                results = list(executor.map(_bench_worker, [(mode, str(qlib_dir))] * procs))
+                seconds = [r[0] for r in results]
+                print(f"{mode:<8}{procs} 个进程, 平均加载 {np.mean(seconds) * 1000:.1f}ms, "
+                      f"校验和 {sorted({round(r[1], 2) for r in results})}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="共享内存行情面板")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="常驻进程: 发布面板, 数据更新时发布新版本")
+    p_serve.add_argument("--qlib_dir", default=str(QLIB_DATA_DIR))
+    p_serve.add_argument("--poll", type=float, default=POLL_SECONDS)
+    sub.add_parser("status", help="当前版本信息")
+    p_bench = sub.add_parser("bench", help="对比各进程自己读 bin 与挂载共享内存")
+    p_bench.add_argument("--qlib_dir", default=str(QLIB_DATA_DIR))
+    p_bench.add_argument("--procs", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = PanelServer(Path(args.qlib_dir))
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # 转成 SystemExit, 走 finally 清理
+        try:
+            server.serve(args.poll)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+    elif args.command == "status":
+        status()
+    else:
+        bench(args.procs, Path(args.qlib_dir))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+高性能横截面处理器
+
+Qlib 自带的 CSRankNorm 对每个交易日做一次 pandas groupby-rank, 全市场 5000 只 x 1400 天 x 8 列时很慢.
+FastCSRankNorm 结果与其一致 (平均名次处理并列值, NaN 保持 NaN, pct = 名次 / 当日非空数量),
+但只按日期做一次排序, 把每个交易日映射成 (日期 x 当日最大股票数) 矩阵中的一行,
+然后沿行一次 argsort 完成所有交易日的排名.
+
+在 DataHandlerLP 配置中替换:
+    {"class": "FastCSRankNorm", "module_path": "data_processing.processors", "kwargs": {"fields_group": "feature"}}
+
+对比/压测:
+    python data_processing/processors.py --days 1400 --stocks 5000 --cols 8
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from qlib.data.dataset.processor import Processor, get_group_columns
+
+
+def rank_last_axis(x: np.ndarray) -> np.ndarray:
+    """沿最后一维计算平均名次 (从 1 开始), 并列值取平均名次, NaN 保持 NaN"""
+    shape = x.shape
+    x2 = x.reshape(-1, shape[-1])
+    n = x2.shape[1]
+    nan_mask = np.isnan(x2)
+    counts = n - nan_mask.sum(axis=1, keepdims=True)
+    # NaN 换成 +inf 再排序: 走 numpy 的 SIMD 快速路径, 比带 NaN 的 argsort 快数倍;
+    # 并列值由下面的分组处理, 不需要稳定排序
+    key = np.where(nan_mask, np.inf, x2)
+    order = np.argsort(key, axis=1)
+    s = np.take_along_axis(key, order, axis=1)
+
+    pos = np.broadcast_to(np.arange(n), s.shape)
+    starts = np.ones(s.shape, dtype=bool)
+    starts[:, 1:] = s[:, 1:] != s[:, :-1]
+    ends = np.ones(s.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    # 每个并列组的首/尾位置: 向右传播组首, 向左传播组尾
+    first = np.maximum.accumulate(np.where(starts, pos, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, pos, n)[:, ::-1], axis=1)[:, ::-1]
+    # 真实的 +inf 与 NaN 落在同一组, 组尾截断到最后一个非 NaN 位置
+    np.minimum(last, counts - 1, out=last)
+
+    ranks = np.empty(s.shape, dtype=np.float32)  # 名次都是整数或 .5, float32 可精确表示
+    np.put_along_axis(ranks, order, ((first + last) / 2 + 1).astype(np.float32), axis=1)
+    ranks[nan_mask] = np.nan
+    return ranks.reshape(shape)
+
+
+class _DaySegments:
+    """按日期把行号映射到 (日期, 当日序号), 只需计算一次, 所有列共用"""
+
+    def __init__(self, datetimes):
+        day_codes, _ = pd.factorize(datetimes, sort=True)
+        if len(day_codes) > 1 and np.any(np.diff(day_codes) < 0):
+            # 数据未按日期排序: 稳定排序后再分段
+            self.order = np.argsort(day_codes, kind="stable")
+            day_codes = day_codes[self.order]
+        else:
+            self.order = None
+        n_days = int(day_codes.max()) + 1 if len(day_codes) else 0
+        day_start = np.searchsorted(day_codes, np.arange(n_days + 1))
+        self.shape = (n_days, int(np.diff(day_start).max()) if n_days else 0)
+        # 每一行在稠密矩阵中的扁平位置
+        self.flat_pos = day_codes * self.shape[1] + (np.arange(len(day_codes)) - day_start[day_codes])
+
+    def rank_pct(self, values: np.ndarray) -> np.ndarray:
+        """values 按原 dtype 排名 (float64 中不同的值降成 float32 会变成并列), 返回 float64 的 pct"""
+        if self.order is not None:
+            values = values[self.order]
+        dense = np.full(self.shape[0] * self.shape[1], np.nan, dtype=values.dtype)
+        dense[self.flat_pos] = values
+        dense = dense.reshape(self.shape)
+        ranks = rank_last_axis(dense)
+        counts = np.sum(~np.isnan(dense), axis=1, keepdims=True).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct = (ranks / counts).ravel()[self.flat_pos]
+        if self.order is not None:
+            out = np.empty_like(pct)
+            out[self.order] = pct
+            return out
+        return pct
+
+
+def _float_values(col: pd.Series) -> np.ndarray:
+    """float32 / float64 列原样取出, 其余 (整数、可空类型) 转 float64"""
+    dtype = col.dtype if col.dtype in (np.float32, np.float64) else np.float64
+    return col.to_numpy(dtype=dtype, na_value=np.nan)
+
+
+def cs_rank_norm(df: pd.DataFrame) -> pd.DataFrame:
+    """对所有列做横截面排名标准化 (与 CSRankNorm 相同的 (pct - 0.5) * 3.46), 返回 float32 DataFrame"""
+    segments = _DaySegments(df.index.get_level_values("datetime"))
+    out = np.empty(df.shape, dtype=np.float32)
+    for j in range(df.shape[1]):
+        # NOTE: towards unit std; 排名和标准化按原精度计算, 只有结果转成 float32
+        out[:, j] = (segments.rank_pct(_float_values(df.iloc[:, j])) - 0.5) * 3.46
+    return pd.DataFrame(out, index=df.index, columns=df.columns)
+
+
+class FastCSRankNorm(Processor):
+    """CSRankNorm 的向量化实现, 可直接替换 qlib.data.dataset.processor.CSRankNorm"""
+
+    def __init__(self, fields_group=None):
+        self.fields_group = fields_group
+
+    def __call__(self, df):
+        cols = get_group_columns(df, self.fields_group)
+        segments = _DaySegments(df.index.get_level_values("datetime"))
+        for col in cols:
+            pct = segments.rank_pct(_float_values(df[col]))
+            df[col] = ((pct - 0.5) * 3.46).astype(np.float32)  # NOTE: towards unit std
+        return df
+
+
+def _make_panel(days: int, stocks: int, cols: int, seed: int = 0) -> pd.DataFrame:
+    """
+    合成面板: 每天随机缺一部分股票, 含 NaN 和大量并列值. 后一半列为 float64 (如 Mean/Std 算出的特征),
+    其中第 1 列的值只在 float64 精度下不同, 转成 float32 会变成并列
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2020-01-01", periods=days)
+    codes = np.array([f"SH{600000 + i}" for i in range(stocks)])
+    alive = rng.random((days, stocks)) > 0.1
+    d_idx, s_idx = np.nonzero(alive)
+    index = pd.MultiIndex.from_arrays([dates[d_idx], codes[s_idx]], names=["datetime", "instrument"])
+    data = rng.normal(size=(len(index), cols))
+    data[:, 0] = np.round(data[:, 0])  # 并列值
+    if cols > 1:
+        data[:, 1] = 1 + rng.integers(0, 5, len(index)) * 1e-9  # float64 下的近似并列
+    data[rng.random(data.shape) < 0.05] = np.nan
+    columns = pd.MultiIndex.from_product([["feature"], [f"f{j}" for j in range(cols)]])
+    df = pd.DataFrame(data, index=index, columns=columns)
+    return df.astype({c: np.float32 for j, c in enumerate(columns) if j != 1 and j < cols // 2})
+
+
+if __name__ == "__main__":
+    import tracemalloc
+
+    from qlib.data.dataset.processor import CSRankNorm
+
+    parser = argparse.ArgumentParser(description="FastCSRankNorm 与 Qlib CSRankNorm 对比")
+    parser.add_argument("--days", type=int, default=1400)
+    parser.add_argument("--stocks", type=int, default=5000)
+    parser.add_argument("--cols", type=int, default=8)
+    args = parser.parse_args()
+
+    panel = _make_panel(args.days, args.stocks, args.cols)
+    print(f"合成面板: {args.days} 天 x {args.stocks} 只 x {args.cols} 列 = {len(panel)} 行")
+
+    results = {}
+    for name, proc in (("CSRankNorm", CSRankNorm("feature")), ("FastCSRankNorm", FastCSRankNorm("feature"))):
+        df = panel.copy()
+        tracemalloc.start()
+        t0 = time.time()
+        results[name] = proc(df)
+        cost = time.time() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<16} 耗时 {cost:>7.2f}s  峰值内存 {peak / 1024 ** 2:>8.1f} MB")
+
+    expected = results["CSRankNorm"].to_numpy(dtype=np.float64)
+    actual = results["FastCSRankNorm"].to_numpy(dtype=np.float64)
+    same_nan = np.array_equal(np.isnan(expected), np.isnan(actual))
+    max_diff = np.nanmax(np.abs(expected - actual))
+    print(f"一致性: NaN 位置一致={same_nan}, 最大误差={max_diff:.2e}")
+    if not same_nan or max_diff > 1e-5:
+        raise SystemExit("FastCSRankNorm 与 CSRankNorm 结果不一致!")
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+板块轮动因子 (sector_rotation_v1) -> stock_daily_alpha
+
+export_to_qlib.py 把 stock_daily_alpha 中 strategy_name = 'sector_rotation_v1' 的 alpha_score 导出为 $sector_score.
+这里用本地行业映射文件 (data_ingestion/fetch_sector_map.py 生成) 把股票归入行业, 在 (日期 x 股票) 稠密矩阵上
+按行业分段一次 reduceat 得到所有行业、所有日期的:
+  - 动量 (momentum): 行业等权日收益的 MOMENTUM_DAYS 日累计对数收益;
+  - 广度 (breadth):  行业内上涨家数占比的 BREADTH_DAYS 日均值;
+  - 热度 (heat):     行业成交额 / 其 HEAT_DAYS 日均值.
+三项各自在当日所有行业之间做排名百分位, 取平均后减 0.5, 即 sector_score 属于 [-0.5, 0.5];
+0 表示中性, 与 export 中未映射股票的 ifNull(..., 0) 一致. 个股的 alpha_score = 所属行业的 sector_score.
+
+增量: 只读取 "已写入的最后一天 - LOOKBACK_DAYS 个交易日" 之后的行情, 只写入新日期.
+
+用法:
+    python data_processing/sector_rotation.py            # 增量
+    python data_processing/sector_rotation.py --full     # 重算全部历史
+    python data_processing/sector_rotation.py --bench    # 合成数据压测, 不连接数据库
+"""
+import argparse
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.processors import rank_last_axis
+
+# Config
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_DB = "stock_data"
+SECTOR_MAP_PATH = Path("data_ingestion/sector_map.csv")
+STRATEGY_NAME = "sector_rotation_v1"
+BENCHMARK = "SH000300"
+
+MOMENTUM_DAYS = 5
+BREADTH_DAYS = 5
+HEAT_DAYS = 20
+LOOKBACK_DAYS = HEAT_DAYS + 5  # 增量计算时向前多读的交易日数, 保证滚动窗口完整
+INSERT_CHUNK = 1_000_000
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS stock_daily_alpha (
+    ts_code       String,
+    trade_date    Date,
+    strategy_name String,
+    alpha_score   Float64
+) ENGINE = ReplacingMergeTree
+ORDER BY (strategy_name, ts_code, trade_date)
+"""
+
+
+def load_sector_map(path: Path = SECTOR_MAP_PATH) -> pd.Series:
+    """读取 ts_code,sector 映射文件, 返回 index=ts_code 的 Series"""
+    df = pd.read_csv(path, dtype=str)
+    return df.drop_duplicates("ts_code").set_index("ts_code")["sector"]
+
+
+def _rank_pct(x: np.ndarray) -> np.ndarray:
+    """沿最后一维的排名百分位, NaN 保持 NaN"""
+    counts = np.sum(~np.isnan(x), axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return rank_last_axis(x) / counts
+
+
+def sector_scores(ret: np.ndarray, amount: np.ndarray, sector_id: np.ndarray, n_sectors: int) -> dict:
+    """
+    ret / amount: (日期, 股票) 矩阵, NaN 表示当日无数据; sector_id: 每只股票的行业编号, -1 为未映射.
+    返回 {名字: (日期, 行业) 矩阵}, 包含 momentum / breadth / heat / score
+    """
+    mapped = np.flatnonzero(sector_id >= 0)
+    order = mapped[np.argsort(sector_id[mapped], kind="stable")]
+    present, starts = np.unique(sector_id[order], return_index=True)
+
+    # 按行业分段: 列已按行业排好序, 一次 reduceat 得到所有日期所有行业的和
+    r = ret[:, order]
+    valid = ~np.isnan(r)
+    n = np.add.reduceat(valid, starts, axis=1).astype(np.float64)
+    ret_sum = np.add.reduceat(np.where(valid, r, 0.0), starts, axis=1)
+    up = np.add.reduceat(valid & (r > 0), starts, axis=1)
+    amt = amount[:, order]
+    amt_sum = np.add.reduceat(np.where(np.isnan(amt), 0.0, amt), starts, axis=1)
+
+    # 映射文件中有但当前面板里没有成分股的行业保持 NaN
+    sector_ret = np.full((len(ret), n_sectors), np.nan)
+    breadth = np.full((len(ret), n_sectors), np.nan)
+    sector_amt = np.full((len(ret), n_sectors), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sector_ret[:, present] = np.where(n > 0, ret_sum / n, np.nan)
+        breadth[:, present] = np.where(n > 0, up / n, np.nan)
+        sector_amt[:, present] = np.where(n > 0, amt_sum, np.nan)
+
+    momentum = pd.DataFrame(np.log1p(sector_ret)).rolling(MOMENTUM_DAYS, min_periods=1).sum().to_numpy()
+    momentum = np.where(np.isnan(sector_ret), np.nan, momentum)  # 当日无成分股交易不给分
+    breadth_ma = pd.DataFrame(breadth).rolling(BREADTH_DAYS, min_periods=1).mean().to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        heat = sector_amt / pd.DataFrame(sector_amt).rolling(HEAT_DAYS, min_periods=1).mean().to_numpy()
+
+    ranks = np.stack([_rank_pct(momentum), _rank_pct(breadth_ma), _rank_pct(heat)])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 全 NaN 的行业/日期
+        score = np.nanmean(ranks, axis=0) - 0.5
+    return {"ret": sector_ret, "momentum": momentum, "breadth": breadth_ma, "heat": heat, "score": score}
+
+
+def stock_scores(dates, codes, ret, amount, sector_map: pd.Series) -> pd.DataFrame:
+    """每只已映射、当日有行情的股票一行: (ts_code, trade_date, alpha_score)"""
+    sectors = pd.Index(sorted(sector_map.unique()))
+    sector_id = sectors.get_indexer(sector_map.reindex(codes))
+    res = sector_scores(ret, amount, sector_id, len(sectors))
+
+    d_idx, s_idx = np.nonzero(~np.isnan(ret) & (sector_id >= 0)[None, :])
+    score = res["score"][d_idx, sector_id[s_idx]]
+    keep = ~np.isnan(score)
+    return pd.DataFrame({
+        "ts_code": np.asarray(codes)[s_idx[keep]],
+        "trade_date": pd.DatetimeIndex(dates)[d_idx[keep]].date,
+        "alpha_score": score[keep],
+    })
+
+
+# ---------------- ClickHouse 读写 ----------------
+
+def _client():
+    from clickhouse_driver import Client
+
+    return Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB, settings={"use_numpy": True})
+
+
+def load_panel(client, start_date=None):
+    """读取 stock_daily 的收益率和成交额, 返回 (dates, codes, ret, amount) 稠密矩阵"""
+    where = f"AND trade_date >= '{start_date}'" if start_date is not None else ""
+    df = client.query_dataframe(f"""
+        SELECT ts_code, trade_date, pct_chg, amount
+        FROM stock_daily
+        WHERE ts_code != '{BENCHMARK}' AND close > 0 {where}
+    """)
+    dates = pd.DatetimeIndex(np.sort(pd.to_datetime(df["trade_date"]).unique()))
+    codes = pd.Index(np.sort(df["ts_code"].astype(str).unique()))
+    d_idx = dates.get_indexer(pd.to_datetime(df["trade_date"]))
+    s_idx = codes.get_indexer(df["ts_code"].astype(str))
+    ret = np.full((len(dates), len(codes)), np.nan)
+    amount = np.full((len(dates), len(codes)), np.nan)
+    ret[d_idx, s_idx] = df["pct_chg"].to_numpy(dtype=np.float64) / 100  # pct_chg 为百分数
+    amount[d_idx, s_idx] = df["amount"].to_numpy(dtype=np.float64)
+    return dates, codes, ret, amount
+
+
+def run(full: bool = False, sector_map_path: Path = SECTOR_MAP_PATH) -> int:
+    t0 = time.time()
+    client = _client()
+    client.execute(CREATE_TABLE_SQL)
+    sector_map = load_sector_map(sector_map_path)
+
+    last_date = None
+    if full:
+        print(f"全量重算: 删除已有的 {STRATEGY_NAME} 记录...")
+        client.execute(
+            f"ALTER TABLE stock_daily_alpha DELETE WHERE strategy_name = '{STRATEGY_NAME}'",
+            settings={"mutations_sync": 1},
+        )
+        start_date = None
+    else:
+        last_date = client.execute(
+            f"SELECT max(trade_date), count() FROM stock_daily_alpha WHERE strategy_name = '{STRATEGY_NAME}'"
+        )[0]
+        last_date = last_date[0] if last_date[1] > 0 else None
+        start_date = None
+        if last_date is not None:
+            # 向前多读 LOOKBACK_DAYS 个交易日, 让滚动窗口在新日期上完整
+            rows = client.execute(
+                f"SELECT DISTINCT trade_date FROM stock_daily WHERE trade_date <= '{last_date}' "
+                f"ORDER BY trade_date DESC LIMIT {LOOKBACK_DAYS}"
+            )
+            start_date = rows[-1][0] if rows else None
+
+    dates, codes, ret, amount = load_panel(client, start_date)
+    t1 = time.time()
+    print(f"行情面板: {len(dates)} 天 x {len(codes)} 只, 读取耗时 {t1 - t0:.1f}s")
+
+    rows = stock_scores(dates, codes, ret, amount, sector_map)
+    if last_date is not None:
+        rows = rows[rows["trade_date"] > last_date]
+    t2 = time.time()
+    print(f"因子计算完成: {len(rows)} 行新记录, 耗时 {t2 - t1:.1f}s")
+
+    if rows.empty:
+        print("没有新日期需要写入")
+        return 0
+    rows = rows.assign(strategy_name=STRATEGY_NAME)[["ts_code", "trade_date", "strategy_name", "alpha_score"]]
+    for i in range(0, len(rows), INSERT_CHUNK):
+        client.insert_dataframe(
+            "INSERT INTO stock_daily_alpha (ts_code, trade_date, strategy_name, alpha_score) VALUES",
+            rows.iloc[i:i + INSERT_CHUNK],
+        )
+    print(f"已写入 {len(rows)} 行 ({rows['trade_date'].min()} ~ {rows['trade_date'].max()}), 写入耗时 {time.time() - t2:.1f}s")
+    return len(rows)
+
+
+def _bench(days: int = 1500, stocks: int = 5000, sectors: int = 90, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2020-01-01", periods=days)
+    codes = pd.Index([f"{600000 + i}" for i in range(stocks)])
+    sector_map = pd.Series([f"行业{i % sectors}" for i in range(stocks - 100)], index=codes[:stocks - 100])
+    ret = rng.normal(0, 0.02, (days, stocks))
+    ret[rng.random(ret.shape) < 0.05] = np.nan
+    amount = rng.lognormal(18, 1, (days, stocks))
+
+    t0 = time.time()
+    rows = stock_scores(dates, codes, ret, amount, sector_map)
+    print(f"合成面板 {days} 天 x {stocks} 只 x {sectors} 个行业: {len(rows)} 行, 耗时 {time.time() - t0:.2f}s")
+
+    # 抽查: 行业收益与 pandas groupby 一致
+    sectors = pd.Index(sorted(sector_map.unique()))
+    res = sector_scores(ret, amount, sectors.get_indexer(sector_map.reindex(codes)), len(sectors))
+    frame = pd.DataFrame(ret[-1], index=codes).join(sector_map.rename("sector"), how="inner")
+    expected = frame.groupby("sector")[0].mean().reindex(sectors).to_numpy()
+    print(f"行业收益与 pandas groupby 最大误差: {np.nanmax(np.abs(res['ret'][-1] - expected)):.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="板块轮动因子 sector_rotation_v1")
+    parser.add_argument("--full", action="store_true", help="删除已有记录并重算全部历史")
+    parser.add_argument("--sector_map", default=str(SECTOR_MAP_PATH))
+    parser.add_argument("--bench", action="store_true", help="合成数据压测, 不连接数据库")
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench()
+    else:
+        run(args.full, Path(args.sector_map))
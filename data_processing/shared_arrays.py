@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+进程间共享的 numpy 数组
+
+父进程用 to_shared 把数组复制进一块 POSIX 共享内存, 把 spec (名字, 形状, dtype) 传给进程池的 initializer;
+子进程用 attach 按名字挂载, 拿到只读 view, 不复制数据. 父进程用完后 release (close + unlink).
+param_sweep / robustness / walk_forward 的进程池和 panel_server 的读者都走这里.
+
+用法:
+    shm, spec = to_shared(X)                 # 父进程
+    _, X = attach(spec)                      # 子进程 (initializer 中), 只读
+    release([shm])                           # 父进程, 进程池结束后
+"""
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+_register_lock = threading.Lock()
+
+
+def attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """
+    挂载已有的块. Python 3.13 之前挂载方也会登记到 resource_tracker, 进程退出时把块 unlink 掉,
+    读者退出就会删掉创建方的数据. 挂载后再取消登记也不行: fork 出的进程与创建方共用同一个
+    tracker, 会把创建方自己的登记一起删掉. 所以挂载期间跳过登记.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    with _register_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def to_shared(arr: np.ndarray):
+    """复制到新建的共享内存, 返回 (SharedMemory, spec); 创建方负责 release"""
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def attach(spec, writeable: bool = False):
+    """按 spec 挂载, 返回 (SharedMemory, ndarray view); SharedMemory 需在 view 用完前保持引用"""
+    name, shape, dtype = spec
+    shm = attach_untracked(name)
+    arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    arr.flags.writeable = writeable
+    return shm, arr
+
+
+def release(shms) -> None:
+    for shm in shms:
+        shm.close()
+        shm.unlink()
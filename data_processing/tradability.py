@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+涨跌停 / 停牌可交易位图
+
+Qlib 的 exchange_kwargs 对所有股票用同一个 limit_threshold (0.095), 创业板/科创板 20%、北交所 30%、
+ST 5% 都会判错, 而且每次回测都在模拟器里重新计算. 这里从日线 OHLC 一次性算出每个 (交易日, 股票) 的状态,
+每种状态一个位平面, 沿股票方向 np.packbits 压缩存储 (5000 只 x 1500 天 x 5 个平面约 4.7MB):
+
+  - suspended:     停牌 (无收盘价、价格或成交量为 0)
+  - limit_up:      收盘涨停
+  - limit_down:    收盘跌停
+  - limit_up_open: 开盘即涨停 (README 中 "Exclude stocks with Limit-up at Open" 的过滤条件)
+  - st:            ST / *ST (来自 data_ingestion/st_list.csv)
+
+涨跌停价按交易所规则计算: 前收盘价 (除权后) x (1 ± 涨跌幅) 四舍五入到分, 收盘价与之相差不到半个价位即视为封板;
+新股上市首日 (注册制板块前 5 日) 不设涨跌幅. 查询都是下标运算, 策略 (BitmapExchange)、
+向量化回测 (fast_backtest, limit_threshold="board") 和每日选股 (predict_daily) 共用同一份位图.
+
+用法:
+    python data_processing/tradability.py            # 增量: 只计算位图之后的新交易日
+    python data_processing/tradability.py --full     # 全量重建
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from qlib.backtest.exchange import Exchange
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.panel_server import attach_current, take
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+BITMAP_PATH = QLIB_DATA_DIR / "tradability" / "day.npz"
+ST_LIST_PATH = Path("data_ingestion/st_list.csv")
+MARKET = "all"
+HISTORY_DAYS = 60  # 增量计算时向前多读的交易日, 用于取停牌股复牌前的收盘价
+PRICE_TICK = 0.01
+CHINEXT_REFORM_DATE = pd.Timestamp("2020-08-24")  # 创业板注册制, 涨跌幅由 10% 放宽到 20%
+
+# 位平面
+SUSPENDED, LIMIT_UP, LIMIT_DOWN, LIMIT_UP_OPEN, ST = range(5)
+FLAG_NAMES = ["suspended", "limit_up", "limit_down", "limit_up_open", "st"]
+
+# 板块
+MAIN, CHINEXT, STAR, BSE = range(4)
+
+
+def board_of(code: str) -> int:
+    """按代码前缀判断板块, 兼容 '600000' 和 'SH600000' 两种写法"""
+    digits = re.sub(r"\D", "", str(code))[-6:]
+    if digits.startswith(("688", "689")):
+        return STAR
+    if digits.startswith(("300", "301", "302")):
+        return CHINEXT
+    if digits.startswith(("4", "8", "92")):
+        return BSE
+    return MAIN
+
+
+def limit_ratio(board: np.ndarray, st: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """(日期, 股票) 的涨跌幅限制. board: (股票,), st: (日期, 股票)"""
+    reform = (dates >= CHINEXT_REFORM_DATE)[:, None]
+    main_ratio = np.where(st, 0.05, 0.10)
+    ratio = np.where(board == STAR, 0.20, np.where(board == BSE, 0.30, main_ratio))
+    return np.where((board == CHINEXT) & reform, 0.20, ratio)
+
+
+def free_days(board: np.ndarray, dates: pd.DatetimeIndex) -> np.ndarray:
+    """上市后不设涨跌幅的交易日数: 科创板和注册制后的创业板 5 天, 其他 1 天"""
+    reform = (dates >= CHINEXT_REFORM_DATE)[:, None]
+    return np.where((board == STAR) | ((board == CHINEXT) & reform), 5, 1)
+
+
+def load_st_mask(dates: pd.DatetimeIndex, codes: pd.Index, path: Path = ST_LIST_PATH) -> np.ndarray:
+    """st_list.csv 的区间 -> (日期, 股票) 布尔矩阵; end_date 为空表示至今仍是 ST"""
+    mask = np.zeros((len(dates), len(codes)), dtype=bool)
+    if not path.exists():
+        print(f"提示: 未找到 {path}, ST 股票按主板 10% 涨跌幅处理 (先运行 data_ingestion/fetch_st_list.py)")
+        return mask
+    st = pd.read_csv(path, dtype={"ts_code": str})
+    # 区间表里是纯数字代码, 位图里按 Qlib 的 instrument 名 (大写) 匹配, 两种写法都认
+    digits = pd.Index([re.sub(r"\D", "", c)[-6:] for c in codes])
+    for row in st.itertuples(index=False):
+        cols = np.flatnonzero(digits == re.sub(r"\D", "", row.ts_code)[-6:])
+        if len(cols) == 0:
+            continue
+        lo = dates.searchsorted(pd.Timestamp(row.start_date))
+        hi = len(dates) if pd.isna(row.end_date) else dates.searchsorted(pd.Timestamp(row.end_date))
+        mask[lo:hi, cols] = True
+    return mask
+
+
+def compute_flags(open_, close, volume, factor, dates: pd.DatetimeIndex, board: np.ndarray,
+                  days_listed: np.ndarray, st: np.ndarray) -> np.ndarray:
+    """
+    (日期, 股票) 的行情矩阵 -> (平面, 日期, 股票) 布尔数组.
+    days_listed: 每个位置距上市首日的交易日数 (首日为 0), st: ST 掩码
+    """
+    with np.errstate(invalid="ignore"):
+        suspended = ~(close > 0) | ~(volume > 0)
+    # 前收盘价取最近一个有成交日的收盘价 (复牌首日以停牌前收盘价为基准)
+    traded_close = pd.DataFrame(np.where(suspended, np.nan, close)).ffill().to_numpy()
+    prev_close = np.vstack([np.full((1, close.shape[1]), np.nan), traded_close[:-1]])
+
+    # Qlib 存的是复权价, 除以当天的复权因子得到实际价格, 前收盘价同样除以当天因子即为除权后的基准价
+    factor = np.where(np.isnan(factor) | (factor <= 0), 1.0, factor)
+    ratio = limit_ratio(board, st, dates)
+    with np.errstate(invalid="ignore"):
+        base = prev_close / factor
+        up_price = np.round(base * (1 + ratio) + 1e-9, 2)
+        down_price = np.round(base * (1 - ratio) + 1e-9, 2)
+        has_limit = ~suspended & ~np.isnan(prev_close) & (days_listed >= free_days(board, dates))
+        half_tick = PRICE_TICK / 2
+        flags = np.zeros((len(FLAG_NAMES),) + close.shape, dtype=bool)
+        flags[SUSPENDED] = suspended
+        flags[LIMIT_UP] = has_limit & (close / factor >= up_price - half_tick)
+        flags[LIMIT_DOWN] = has_limit & (close / factor <= down_price + half_tick)
+        flags[LIMIT_UP_OPEN] = has_limit & (open_ / factor >= up_price - half_tick)
+    flags[ST] = st
+    return flags
+
+
+class TradabilityBitmap:
+    """
+    按 (交易日, 股票) 存储的可交易状态. bits: (平面, 日期, ceil(股票数 / 8)) 的 uint8, 股票按 codes 顺序逐位排列.
+    位图范围之外的日期或股票, 所有状态都返回 False (不额外限制交易).
+    """
+
+    def __init__(self, bits: np.ndarray, dates, codes, board: np.ndarray, first_date: np.ndarray):
+        self.bits = bits
+        self.dates = pd.DatetimeIndex(dates)
+        self.codes = pd.Index(codes)
+        self.board = board
+        self.first_date = first_date
+
+    @classmethod
+    def from_flags(cls, flags: np.ndarray, dates, codes, board, first_date) -> "TradabilityBitmap":
+        return cls(np.packbits(flags, axis=2), dates, codes, board, first_date)
+
+    @classmethod
+    def load(cls, path: Path = BITMAP_PATH) -> "TradabilityBitmap":
+        if not Path(path).exists():
+            raise FileNotFoundError(f"未找到涨跌停位图 {path}, 请先运行 python data_processing/tradability.py")
+        data = np.load(path, allow_pickle=False)
+        return cls(data["bits"], data["dates"], data["codes"], data["board"], data["first_date"])
+
+    def save(self, path: Path = BITMAP_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(tmp_path, bits=self.bits, dates=self.dates.values.astype("datetime64[D]"),
+                 codes=np.asarray(self.codes, dtype=str), board=self.board, first_date=self.first_date)
+        tmp_path.replace(path)
+
+    def flags(self) -> np.ndarray:
+        """解压成 (平面, 日期, 股票) 布尔数组"""
+        return np.unpackbits(self.bits, axis=2, count=len(self.codes)).astype(bool)
+
+    def get(self, flag: int, code, date) -> bool:
+        """单个 (股票, 日期) 的状态"""
+        try:
+            row, col = self.dates.get_loc(pd.Timestamp(date)), self.codes.get_loc(code)
+        except KeyError:
+            return False
+        return bool((self.bits[flag, row, col >> 3] >> (7 - (col & 7))) & 1)
+
+    def lookup(self, flag: int, codes, dates) -> np.ndarray:
+        """逐元素查询: codes 与 dates 等长, 返回布尔数组"""
+        rows = self.dates.get_indexer(pd.DatetimeIndex(dates))
+        cols = self.codes.get_indexer(pd.Index(codes))
+        found = (rows >= 0) & (cols >= 0)
+        out = np.zeros(len(rows), dtype=bool)
+        r, c = rows[found], cols[found]
+        out[found] = (self.bits[flag, r, c >> 3] >> (7 - (c & 7))) & 1
+        return out
+
+    def matrix(self, flag: int, dates, codes) -> np.ndarray:
+        """对齐到给定日期 x 股票的稠密布尔矩阵, 供向量化回测使用"""
+        rows = self.dates.get_indexer(pd.DatetimeIndex(dates))
+        cols = self.codes.get_indexer(pd.Index(codes))
+        out = np.zeros((len(rows), len(cols)), dtype=bool)
+        r_ok, c_ok = rows >= 0, cols >= 0
+        if r_ok.any() and c_ok.any():
+            plane = np.unpackbits(self.bits[flag, rows[r_ok]], axis=1, count=len(self.codes)).astype(bool)
+            out[np.ix_(r_ok, c_ok)] = plane[:, cols[c_ok]]
+        return out
+
+    def is_tradable(self, code, date) -> bool:
+        return not (self.get(SUSPENDED, code, date) or self.get(LIMIT_UP, code, date)
+                    or self.get(LIMIT_DOWN, code, date))
+
+
+class BitmapExchange(Exchange):
+    """
+    Qlib Exchange, 涨跌停判断改用位图 (分板块、分 ST), 不再用统一的 limit_threshold.
+    limit_buy = 停牌 | 收盘涨停 (| 开盘涨停), limit_sell = 停牌 | 收盘跌停.
+    """
+
+    def __init__(self, bitmap_path=str(BITMAP_PATH), block_open_limit_up=True, **kwargs):
+        self.bitmap = TradabilityBitmap.load(Path(bitmap_path))
+        self.block_open_limit_up = block_open_limit_up
+        super().__init__(**kwargs)
+
+    def _update_limit(self, limit_threshold) -> None:
+        codes = self.quote_df.index.get_level_values("instrument")
+        dates = self.quote_df.index.get_level_values("datetime")
+        suspended = self.quote_df["$close"].isna().to_numpy() | self.bitmap.lookup(SUSPENDED, codes, dates)
+        limit_buy = suspended | self.bitmap.lookup(LIMIT_UP, codes, dates)
+        if self.block_open_limit_up:
+            limit_buy |= self.bitmap.lookup(LIMIT_UP_OPEN, codes, dates)
+        self.quote_df["limit_buy"] = limit_buy
+        self.quote_df["limit_sell"] = suspended | self.bitmap.lookup(LIMIT_DOWN, codes, dates)
+
+
+def exchange_config(start_time, end_time, codes=MARKET, deal_price="close", bitmap_path=BITMAP_PATH, **kwargs) -> dict:
+    """backtest 的 exchange_kwargs: 指定 exchange 后 Qlib 不再传入其他参数, 这里补全"""
+    return {
+        "exchange": {
+            "class": "BitmapExchange",
+            "module_path": "data_processing.tradability",
+            "kwargs": {"freq": "day", "start_time": start_time, "end_time": end_time, "codes": codes,
+                       "deal_price": deal_price, "bitmap_path": str(bitmap_path), **kwargs},
+        }
+    }
+
+
+def _dense(df: pd.DataFrame, dates: pd.DatetimeIndex, codes: pd.Index) -> list:
+    d_idx = dates.get_indexer(df.index.get_level_values("datetime"))
+    s_idx = codes.get_indexer(df.index.get_level_values("instrument"))
+    mats = []
+    for col in df.columns:
+        mat = np.full((len(dates), len(codes)), np.nan)
+        mat[d_idx, s_idx] = df[col].to_numpy(dtype=np.float64)
+        mats.append(mat)
+    return mats
+
+
+def build_bitmap(full=False, path: Path = BITMAP_PATH, market=MARKET, st_path: Path = ST_LIST_PATH) -> TradabilityBitmap:
+    """计算位图并保存. 默认增量: 只追加已有位图之后的交易日. 调用前需要先 qlib.init"""
+    from qlib.data import D
+
+    t0 = time.time()
+    calendar = pd.DatetimeIndex(D.calendar())
+    old = None if full or not path.exists() else TradabilityBitmap.load(path)
+    if old is not None and old.dates[-1] >= calendar[-1]:
+        print(f"位图已是最新 ({old.dates[-1].date()})")
+        return old
+
+    first_new = 0 if old is None else int(calendar.searchsorted(old.dates[-1], "right"))
+    read_from = max(first_new - HISTORY_DAYS, 0)
+    dates = calendar[read_from:]
+    fields = ["open", "close", "volume", "factor"]
+    # 面板服务 (panel_server.py) 在运行且版本一致时直接从共享内存取, 不再经过 D.features
+    panel = attach_current(QLIB_DATA_DIR) if market == MARKET else None
+    if panel is not None:
+        rows = panel.dates.get_indexer(dates)
+        with panel:
+            codes = panel.codes[~np.isnan(panel["close"][rows[rows >= 0]]).all(axis=0)]
+            if old is not None:
+                codes = old.codes.append(codes.difference(old.codes))
+            cols = panel.codes.get_indexer(codes)
+            open_, close, volume, factor = (take(panel[f], rows, cols) for f in fields)
+        print(f"行情取自共享内存面板 {panel.version}")
+    else:
+        df = D.features(D.instruments(market), [f"${f}" for f in fields], start_time=dates[0], end_time=dates[-1])
+        codes = pd.Index(sorted(df.index.get_level_values("instrument").unique()))
+        if old is not None:
+            codes = old.codes.append(codes.difference(old.codes))
+        open_, close, volume, factor = _dense(df, dates, codes)
+
+    board = np.array([board_of(c) for c in codes], dtype=np.uint8)
+    # 上市首日: 已有位图里记录的优先, 否则取本次读到的第一个有成交的交易日;
+    # 全量构建时数据首日就有成交的股票视为早已上市
+    with np.errstate(invalid="ignore"):
+        traded = (close > 0) & (volume > 0)
+    first_date = np.full(len(codes), np.datetime64("NaT"), dtype="datetime64[D]")
+    has_trade = traded.any(axis=0)
+    first_date[has_trade] = dates.values[traded.argmax(axis=0)[has_trade]].astype("datetime64[D]")
+    if old is not None:
+        known = ~np.isnat(old.first_date)
+        first_date[:len(old.codes)][known] = old.first_date[known]
+    listed_pos = calendar.get_indexer(pd.DatetimeIndex(first_date))
+    listed_pos = np.where(listed_pos > 0, listed_pos, -HISTORY_DAYS)
+    days_listed = np.arange(read_from, len(calendar))[:, None] - listed_pos[None, :]
+
+    st = load_st_mask(dates, codes, st_path)
+    flags = compute_flags(open_, close, volume, factor, dates, board, days_listed, st)[:, first_new - read_from:]
+    new_dates = calendar[first_new:]
+
+    all_flags, all_dates = flags, new_dates
+    if old is not None:
+        pad = np.zeros((len(FLAG_NAMES), len(old.dates), len(codes) - len(old.codes)), dtype=bool)
+        pad[SUSPENDED] = True  # 新股票在之前的交易日不可交易
+        all_flags = np.concatenate([np.concatenate([old.flags(), pad], axis=2), flags], axis=1)
+        all_dates = old.dates.append(new_dates)
+    bitmap = TradabilityBitmap.from_flags(all_flags, all_dates, codes, board, first_date)
+    bitmap.save(path)
+
+    counts = {name: int(flags[i].sum()) for i, name in enumerate(FLAG_NAMES)}
+    print(f"位图已更新: {len(bitmap.dates)} 天 x {len(codes)} 只 (本次 {len(new_dates)} 天), "
+          f"{path.stat().st_size / 1e6:.1f}MB, 耗时 {time.time() - t0:.1f}s")
+    print("本次新增: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+    return bitmap
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="涨跌停 / 停牌可交易位图")
+    parser.add_argument("--full", action="store_true", help="全量重建")
+    parser.add_argument("--market", default=MARKET)
+    args = parser.parse_args()
+
+    import qlib
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+    build_bitmap(full=args.full, market=args.market)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+预先过滤的股票池 (Qlib instruments/*.txt)
+
+训练和打分都用 instruments="all": 里面有基准指数 SH000300、已退市和 ST 股票、成交额极小的微盘股,
+它们都要先算完全部特征, 之后才被过滤掉. 这里从日线面板一次性算出每个 (交易日, 股票) 属于哪些股票池,
+写成 Qlib 的 instruments 文件 (同一只股票可以有多行 "代码\\t开始\\t结束"), D.instruments("liquid_top2000")
+在每个交易日只返回当天在池中的股票:
+
+  - liquid_top2000:               过去 LIQUIDITY_WINDOW 个交易日日均成交额排名前 TOP_N 的非 ST 股票
+  - ex_st:                        上市期间 (all.txt 的区间) 的非 ST 股票
+  - main / chinext / star / bse:  按板块 (tradability.board_of)
+
+以上都不含 INDEX_CODES 中的指数. 成交额用 收盘价 x 成交量: 两者都是复权值, 乘积即原始成交额.
+滚动均值用累积和相减, 每天的前 TOP_N 用一次 argpartition(axis=1), 全部是整块矩阵运算.
+行情优先取共享内存面板 (panel_server.py), 服务未启动时直接读 bin.
+
+增量: STATE_PATH 记录已写到的交易日, 每天只计算新交易日 (向前多读 LIQUIDITY_WINDOW - 1 天用于滚动),
+新区间如果从上次最后一天接续下来, 就延长原来的区间, 否则追加一行.
+
+用法:
+    python data_processing/universe.py            # 增量
+    python data_processing/universe.py --full     # 全量重建
+
+    from data_processing.universe import resolve
+    D.instruments(resolve("liquid_top2000"))      # 文件不存在时退回 "all"
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.panel_server import attach_current, read_panel
+from data_processing.tradability import BSE, CHINEXT, MAIN, ST_LIST_PATH, STAR, board_of, load_st_mask
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+STATE_PATH = QLIB_DATA_DIR / "universe" / "state.json"
+INDEX_CODES = ["SH000300"]  # 基准指数, 不属于任何股票池
+LIQUIDITY_WINDOW = 20
+MIN_TRADED_DAYS = 10  # 窗口内有成交的天数不足的 (新股、长期停牌) 不参与流动性排名
+TOP_N = 2000
+BOARDS = {"main": MAIN, "chinext": CHINEXT, "star": STAR, "bse": BSE}
+UNIVERSES = ["liquid_top2000", "ex_st"] + list(BOARDS)
+
+
+def resolve(name: str, qlib_dir: Path = QLIB_DATA_DIR) -> str:
+    """股票池文件存在时返回 name, 否则提示并退回 "all" """
+    if name == "all" or (Path(qlib_dir) / "instruments" / f"{name}.txt").exists():
+        return name
+    print(f"提示: 未找到股票池 {name}, 使用 all (先运行 python data_processing/universe.py)")
+    return "all"
+
+
+def listed_mask(dates: pd.DatetimeIndex, codes: pd.Index, qlib_dir: Path = QLIB_DATA_DIR) -> np.ndarray:
+    """(日期, 股票): 日期在 all.txt 中该股票的区间内. 退市股票区间已结束, 自然不在池中"""
+    inst = pd.read_csv(Path(qlib_dir) / "instruments" / "all.txt", sep="\t", header=None,
+                       names=["code", "start", "end"], dtype={"code": str})
+    inst = inst.drop_duplicates("code", keep="last").set_index("code").reindex(codes)
+    lo = dates.searchsorted(pd.to_datetime(inst["start"]).to_numpy(), "left")
+    hi = dates.searchsorted(pd.to_datetime(inst["end"]).to_numpy(), "right")
+    rows = np.arange(len(dates))[:, None]
+    return (rows >= lo[None, :]) & (rows < hi[None, :]) & inst["start"].notna().to_numpy()[None, :]
+
+
+def liquidity(close: np.ndarray, volume: np.ndarray, window: int = LIQUIDITY_WINDOW):
+    """滚动日均成交额与窗口内有成交的天数; 前 window - 1 行的窗口不完整"""
+    with np.errstate(invalid="ignore"):
+        amount = np.where((close > 0) & (volume > 0), close.astype(np.float64) * volume, 0.0)
+    traded = (amount > 0).astype(np.int32)
+    return _rolling_sum(amount, window) / window, _rolling_sum(traded, window)
+
+
+def _rolling_sum(x: np.ndarray, window: int) -> np.ndarray:
+    c = np.cumsum(x, axis=0)
+    c[window:] -= c[:-window].copy()
+    return c
+
+
+def top_n_mask(score: np.ndarray, eligible: np.ndarray, n: int = TOP_N) -> np.ndarray:
+    """每行 eligible 中 score 最大的 n 个"""
+    if score.shape[1] <= n:
+        return eligible.copy()
+    score = np.where(eligible, score, -np.inf)
+    top = np.argpartition(-score, n - 1, axis=1)[:, :n]
+    mask = np.zeros(score.shape, dtype=bool)
+    np.put_along_axis(mask, top, True, axis=1)
+    return mask & eligible
+
+
+def compute_masks(dates: pd.DatetimeIndex, codes: pd.Index, close: np.ndarray, volume: np.ndarray,
+                  qlib_dir: Path = QLIB_DATA_DIR, st_path: Path = ST_LIST_PATH) -> dict:
+    """{股票池名: (日期, 股票) 布尔矩阵}"""
+    listed = listed_mask(dates, codes, qlib_dir) & ~codes.isin(INDEX_CODES)[None, :]
+    st = load_st_mask(dates, codes, st_path)
+    amount, traded_days = liquidity(close, volume)
+    board = np.array([board_of(c) for c in codes], dtype=np.uint8)
+
+    masks = {
+        "liquid_top2000": top_n_mask(amount, listed & ~st & (traded_days >= MIN_TRADED_DAYS) & (amount > 0), TOP_N),
+        "ex_st": listed & ~st,
+    }
+    for name, b in BOARDS.items():
+        masks[name] = listed & (board == b)[None, :]
+    return masks
+
+
+def mask_to_intervals(mask: np.ndarray, dates: pd.DatetimeIndex, codes: pd.Index) -> pd.DataFrame:
+    """(日期, 股票) 布尔矩阵 -> 连续区间 DataFrame[code, start, end], 按代码、开始日排序"""
+    edges = np.diff(np.vstack([np.zeros((1, mask.shape[1]), dtype=np.int8), mask.astype(np.int8),
+                               np.zeros((1, mask.shape[1]), dtype=np.int8)]), axis=0).T
+    s_col, s_row = np.nonzero(edges == 1)
+    _, e_row = np.nonzero(edges == -1)  # 与开始一一对应 (同样按股票、日期排序)
+    return pd.DataFrame({"code": codes.values[s_col], "start": dates.values[s_row], "end": dates.values[e_row - 1]})
+
+
+def read_instruments(path: Path) -> pd.DataFrame:
+    if path.stat().st_size == 0:  # 空的股票池 (如没有北交所数据)
+        return pd.DataFrame({"code": pd.Series(dtype=str), "start": pd.Series(dtype="datetime64[ns]"),
+                             "end": pd.Series(dtype="datetime64[ns]")})
+    df = pd.read_csv(path, sep="\t", header=None, names=["code", "start", "end"], dtype={"code": str})
+    df["start"], df["end"] = pd.to_datetime(df["start"]), pd.to_datetime(df["end"])
+    return df
+
+
+def write_instruments(df: pd.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    df.sort_values(["code", "start"]).to_csv(tmp, sep="\t", header=False, index=False, date_format="%Y-%m-%d")
+    tmp.replace(path)
+
+
+def append_intervals(old: pd.DataFrame, new: pd.DataFrame, last_date: pd.Timestamp,
+                     first_new: pd.Timestamp) -> pd.DataFrame:
+    """新区间从 first_new 开始且该股票原有区间止于 last_date 时, 延长原区间; 其余新区间直接追加"""
+    continued = new[(new["start"] == first_new) & new["code"].isin(old.loc[old["end"] == last_date, "code"])]
+    ends = continued.set_index("code")["end"]
+    extend = (old["end"] == last_date) & old["code"].isin(ends.index)
+    old = old.copy()
+    old.loc[extend, "end"] = ends.reindex(old.loc[extend, "code"]).to_numpy()
+    return pd.concat([old, new.drop(continued.index)], ignore_index=True)
+
+
+def _params() -> dict:
+    return {"window": LIQUIDITY_WINDOW, "min_traded_days": MIN_TRADED_DAYS, "top_n": TOP_N,
+            "index_codes": INDEX_CODES, "universes": UNIVERSES}
+
+
+def build_universes(full=False, qlib_dir: Path = QLIB_DATA_DIR, state_path: Path = STATE_PATH,
+                    st_path: Path = ST_LIST_PATH) -> dict:
+    """计算并写出全部股票池, 返回 {股票池名: 本次写出的区间数}"""
+    t0 = time.time()
+    qlib_dir = Path(qlib_dir)
+    inst_dir = qlib_dir / "instruments"
+    params = _params()
+
+    panel = attach_current(qlib_dir)
+    if panel is not None:
+        dates, codes = panel.dates, panel.codes
+    else:
+        dates, codes, arrays = read_panel(qlib_dir, ["close", "volume"])
+
+    # 参数、日历或文件有变化时全量重建
+    old_state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() else None
+    last_date = pd.Timestamp(old_state["last_date"]) if old_state else None
+    if (full or old_state is None or old_state["params"] != params or last_date not in dates
+            or not all((inst_dir / f"{name}.txt").exists() for name in UNIVERSES)):
+        last_date = None
+    first_new = 0 if last_date is None else int(dates.searchsorted(last_date, "right"))
+    if first_new >= len(dates):
+        if panel is not None:
+            panel.close()
+        print(f"股票池已是最新 ({last_date.date()})")
+        return {}
+
+    read_from = max(first_new - LIQUIDITY_WINDOW + 1, 0)
+    if panel is not None:
+        with panel:
+            close = np.array(panel["close"][read_from:])
+            volume = np.array(panel["volume"][read_from:])
+        print(f"行情取自共享内存面板 {panel.version}")
+    else:
+        close, volume = arrays["close"][read_from:], arrays["volume"][read_from:]
+
+    chunk = dates[read_from:]
+    masks = compute_masks(chunk, codes, close, volume, qlib_dir, st_path)
+    new_dates = dates[first_new:]
+
+    counts = {}
+    for name, mask in masks.items():
+        new = mask_to_intervals(mask[first_new - read_from:], new_dates, codes)
+        path = inst_dir / f"{name}.txt"
+        if last_date is not None:
+            new = append_intervals(read_instruments(path), new, last_date, new_dates[0])
+        write_instruments(new, path)
+        counts[name] = len(new)
+        print(f"{name:<16}最新交易日 {int(mask[-1].sum())} 只, 共 {len(new)} 个区间 -> {path}")
+
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps({"params": params, "last_date": dates[-1].strftime("%Y-%m-%d")}), encoding="utf-8")
+    print(f"股票池已更新到 {dates[-1].date()} (本次 {len(new_dates)} 天), 耗时 {time.time() - t0:.2f}s")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成过滤后的 Qlib 股票池")
+    parser.add_argument("--full", action="store_true", help="全量重建")
+    parser.add_argument("--qlib_dir", default=str(QLIB_DATA_DIR))
+    args = parser.parse_args()
+
+    qlib_dir = Path(args.qlib_dir)
+    build_universes(full=args.full, qlib_dir=qlib_dir, state_path=qlib_dir / "universe" / "state.json")
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+流水线编排 (本地 DAG)
+
+每晚的流程 (抓取 -> 基准 -> 板块因子 -> 导出 -> 位图 -> 训练 -> 回测 -> 可视化) 原来要手工逐个运行,
+每个阶段都从头重跑. 这里按依赖关系调度各个脚本 (每个阶段一个子进程):
+  - 每个阶段运行前对它的输入做指纹: 脚本本身的内容 (配置常量都在脚本里)、ClickHouse 表的高水位
+    (max(trade_date) + 行数)、bin 数据清单 (feature_cache.data_version)、依赖的本地文件内容等;
+    指纹与上一次成功运行时相同则跳过;
+  - 没有依赖关系的阶段并发执行 (如抓取行情和抓取基准指数);
+  - 每个阶段的状态和耗时写入 SQLite, 运行结束后打印关键路径, --timings 查看历史耗时.
+
+用法:
+    python pipeline.py                          # 全部阶段
+    python pipeline.py --targets export         # 只跑 export 及其上游
+    python pipeline.py --force train --workers 4
+    python pipeline.py --dry_run                # 只显示哪些阶段会运行
+    python pipeline.py --timings 10             # 最近 10 次运行的各阶段耗时和关键路径
+    python pipeline.py --trace                  # 同时记录各阶段内部的 span (tracing.py), 结束后合并为 Chrome trace
+"""
+import argparse
+import hashlib
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+import tracing
+
+# Config
+STATE_DIR = Path("qlib_data/pipeline")
+STATE_PATH = STATE_DIR / "state.db"
+LOG_DIR = STATE_DIR / "logs"
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_DB = "stock_data"
+WORKERS = 3
+CATALOG_PATH = Path("mlruns/run_catalog.db")
+TRACE_DIR = STATE_DIR / "traces"
+
+# 阶段 -> 脚本 / 参数 / 上游 / 输入. 输入写法:
+#   today          当天日期 (外部数据源, 每天至少跑一次)
+#   db:<表名>      ClickHouse 表的 max(trade_date) 与行数
+#   bins           Qlib 日线 bin 清单 (日历、股票列表、bin 文件数量/大小/修改时间)
+#   file:<路径>    本地文件内容
+#   latest_report  运行目录中最新的回测报告
+STAGES = {
+    "ingest": {"script": "data_ingestion/fetch_akshare.py", "deps": [], "inputs": ["today"]},
+    "benchmark": {"script": "data_ingestion/fetch_benchmark.py", "deps": [], "inputs": ["today"]},
+    "st_list": {"script": "data_ingestion/fetch_st_list.py", "deps": [], "inputs": ["today"]},
+    "sector": {"script": "data_processing/sector_rotation.py", "deps": ["ingest"],
+               "inputs": ["db:stock_daily", "file:data_ingestion/sector_map.csv"]},
+    "export": {"script": "data_processing/export_to_qlib.py", "deps": ["ingest", "benchmark", "sector"],
+               "inputs": ["db:stock_daily", "db:stock_adj_factor", "db:stock_daily_alpha",
+                          "db:stock_news_sentiment"]},
+    "tradability": {"script": "data_processing/tradability.py", "deps": ["export", "st_list"],
+                    "inputs": ["bins", "file:data_ingestion/st_list.csv"]},
+    "universe": {"script": "data_processing/universe.py", "deps": ["export", "st_list"],
+                 "inputs": ["bins", "file:data_ingestion/st_list.csv"]},
+    "train": {"script": "research/train_washout_model.py", "deps": ["export", "universe"],
+              "inputs": ["bins", "file:research/washout_features.py", "file:data_processing/feature_cache.py",
+                         "file:qlib_data/cn_data/instruments/liquid_top2000.txt"]},
+    "backtest": {"script": "backtest/backtest_washout.py", "deps": ["export", "tradability"],
+                 "inputs": ["bins", "file:qlib_data/cn_data/tradability/day.npz", "file:data_processing/processors.py"]},
+    "visualize": {"script": "backtest/visualize_results.py", "deps": ["backtest"], "inputs": ["latest_report"]},
+}
+
+
+def topo_order(stages: dict) -> list:
+    order, seen = [], set()
+
+    def visit(name, path=()):
+        if name in path:
+            raise ValueError(f"阶段依赖有环: {' -> '.join(path + (name,))}")
+        if name in seen:
+            return
+        for dep in stages[name]["deps"]:
+            visit(dep, path + (name,))
+        seen.add(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+def with_ancestors(stages: dict, targets) -> dict:
+    """targets 及其全部上游, 保持 STAGES 中的顺序"""
+    keep = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in stages:
+            raise KeyError(f"未知阶段: {name}, 可选: {list(stages)}")
+        if name not in keep:
+            keep.add(name)
+            stack.extend(stages[name]["deps"])
+    return {name: spec for name, spec in stages.items() if name in keep}
+
+
+class InputProbe:
+    """计算各类输入的当前状态; ClickHouse 连接在第一次查询时才建立, 只在调度线程中使用"""
+
+    def __init__(self):
+        self._client = None
+        self._cache = {}
+
+    def _db(self, table: str) -> str:
+        try:
+            if self._client is None:
+                from clickhouse_driver import Client
+
+                self._client = Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB)
+            max_date, rows = self._client.execute(f"SELECT max(trade_date), count() FROM {table}")[0]
+            return f"{max_date}|{rows}"
+        except Exception as e:
+            # 查询失败 (库未启动 / 表不存在) 也给出固定的状态, 由阶段脚本自己报错
+            return f"unavailable:{type(e).__name__}"
+
+    @staticmethod
+    def _file(path: str) -> str:
+        p = Path(path)
+        return hashlib.sha1(p.read_bytes()).hexdigest() if p.exists() else "missing"
+
+    @staticmethod
+    def _latest_report() -> str:
+        if not CATALOG_PATH.exists():
+            return "none"
+        conn = sqlite3.connect(str(CATALOG_PATH))
+        try:
+            row = conn.execute("SELECT run_id, report_path FROM runs ORDER BY created_at DESC LIMIT 1").fetchone()
+        finally:
+            conn.close()
+        return "|".join(row) if row else "none"
+
+    def value(self, spec: str, fresh: bool = False) -> str:
+        """fresh=True 时忽略缓存 (上游刚运行过, 输入可能已变化)"""
+        if spec in self._cache and not fresh:
+            return self._cache[spec]
+        kind, _, arg = spec.partition(":")
+        if kind == "today":
+            value = date.today().isoformat()
+        elif kind == "db":
+            value = self._db(arg)
+        elif kind == "bins":
+            from data_processing.feature_cache import data_version
+
+            value = data_version()
+        elif kind == "file":
+            value = self._file(arg)
+        elif kind == "latest_report":
+            value = self._latest_report()
+        else:
+            raise ValueError(f"未知输入类型: {spec}")
+        self._cache[spec] = value
+        return value
+
+    def fingerprint(self, spec: dict, fresh: bool = False) -> str:
+        h = hashlib.sha1()
+        h.update(self._file(str(ROOT / spec["script"])).encode())
+        h.update(" ".join(spec.get("args", [])).encode())
+        for item in spec["inputs"]:
+            h.update(f"{item}={self.value(item, fresh)}".encode())
+        return h.hexdigest()[:16]
+
+
+class StateStore:
+    """SQLite: 每个阶段最近一次成功的指纹 + 每次运行的状态和耗时"""
+
+    def __init__(self, path: Path = STATE_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stage_state (stage TEXT PRIMARY KEY, fingerprint TEXT, finished_at TEXT)"
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stage_runs (
+                run_id TEXT, stage TEXT, status TEXT, fingerprint TEXT,
+                started_at TEXT, duration REAL, log_path TEXT,
+                PRIMARY KEY (run_id, stage)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def last_fingerprint(self, stage: str):
+        row = self.conn.execute("SELECT fingerprint FROM stage_state WHERE stage = ?", (stage,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, run_id: str, stage: str, status: str, fingerprint, started: float, duration: float,
+               log_path=None) -> None:
+        started_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))
+        self.conn.execute("INSERT OR REPLACE INTO stage_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (run_id, stage, status, fingerprint, started_at, duration,
+                           str(log_path) if log_path else None))
+        if status == "success":
+            self.conn.execute("INSERT OR REPLACE INTO stage_state VALUES (?, ?, ?)",
+                              (stage, fingerprint, time.strftime("%Y-%m-%d %H:%M:%S")))
+        self.conn.commit()
+
+    def timings(self, last_runs: int) -> dict:
+        """最近 last_runs 次运行中, 各阶段实际执行 (非跳过) 的平均/最近耗时"""
+        rows = self.conn.execute(
+            """
+            SELECT stage, AVG(duration), MAX(duration), COUNT(*),
+                   (SELECT duration FROM stage_runs r2 WHERE r2.stage = r.stage AND r2.status = 'success'
+                    ORDER BY run_id DESC LIMIT 1)
+            FROM stage_runs r
+            WHERE status = 'success' AND run_id IN (SELECT DISTINCT run_id FROM stage_runs ORDER BY run_id DESC LIMIT ?)
+            GROUP BY stage
+            """, (last_runs,)).fetchall()
+        return {stage: {"avg": avg, "max": mx, "n": n, "last": last} for stage, avg, mx, n, last in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+def critical_path(stages: dict, durations: dict):
+    """按耗时算 DAG 上最长的依赖链, 返回 (总耗时, 阶段列表)"""
+    finish, prev = {}, {}
+    for name in topo_order(stages):
+        deps = [d for d in stages[name]["deps"] if d in stages]
+        best = max(deps, key=lambda d: finish[d], default=None)
+        finish[name] = durations.get(name, 0.0) + (finish[best] if best else 0.0)
+        prev[name] = best
+    if not finish:
+        return 0.0, []
+    node = max(finish, key=finish.get)
+    total, path = finish[node], []
+    while node:
+        path.append(node)
+        node = prev[node]
+    return total, path[::-1]
+
+
+def run_stage(name: str, spec: dict, log_path: Path) -> tuple:
+    """子进程运行阶段脚本, 输出写入日志文件; 返回 (退出码, 耗时)"""
+    t0 = time.time()
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, "w", encoding="utf-8") as log, tracing.span(f"pipeline.{name}", script=spec["script"]):
+        proc = subprocess.run([sys.executable, str(ROOT / spec["script"])] + spec.get("args", []),
+                              stdout=log, stderr=subprocess.STDOUT)
+    return proc.returncode, time.time() - t0
+
+
+def run_pipeline(stages: dict = STAGES, force=(), force_all: bool = False, workers: int = WORKERS,
+                 dry_run: bool = False, state_path: Path = STATE_PATH, trace: bool = False) -> dict:
+    """按依赖调度全部阶段, 返回 {阶段: 状态}"""
+    topo_order(stages)  # 先检查有没有环
+    store = StateStore(state_path)
+    probe = InputProbe()
+    run_id = time.strftime("%Y%m%d_%H%M%S") + f"{time.time() % 1:.3f}"[1:]  # 带毫秒, 同一秒内的两次运行不冲突
+    trace_dir = TRACE_DIR / run_id
+    if trace and not dry_run:
+        tracing.enable(trace_dir)  # 通过环境变量传给各阶段子进程
+    status, durations, ran = {}, {}, set()
+    running = {}
+
+    def ready(name):
+        # 不在本次选择范围内的上游视为已满足
+        return (name not in status and name not in {r[0] for r in running.values()}
+                and all(d in status or d not in stages for d in stages[name]["deps"]))
+
+    t_start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(status) < len(stages):
+                # 调度所有依赖已结束的阶段 (指纹计算在本线程中完成)
+                for name in [n for n in stages if ready(n)]:
+                    spec = stages[name]
+                    deps = spec["deps"]
+                    if any(status.get(d) in ("failed", "blocked") for d in deps):
+                        status[name] = "blocked"
+                        print(f"[{name}] 上游失败, 不运行")
+                        store.record(run_id, name, "blocked", None, time.time(), 0.0)
+                        continue
+                    fingerprint = probe.fingerprint(spec, fresh=any(d in ran for d in deps))
+                    unchanged = fingerprint == store.last_fingerprint(name)
+                    if unchanged and not force_all and name not in force:
+                        status[name] = "skipped"
+                        durations[name] = 0.0
+                        print(f"[{name}] 输入未变化 ({fingerprint}), 跳过")
+                        store.record(run_id, name, "skipped", fingerprint, time.time(), 0.0)
+                        continue
+                    if dry_run:
+                        # 演练时假设该阶段会运行, 下游按 "上游已运行" 处理
+                        status[name] = "would_run"
+                        ran.add(name)
+                        print(f"[{name}] 将运行 (指纹 {fingerprint}, 上次 {store.last_fingerprint(name)})")
+                        continue
+                    print(f"[{name}] 开始: {spec['script']}")
+                    log_path = LOG_DIR / run_id / f"{name}.log"
+                    running[executor.submit(run_stage, name, spec, log_path)] = (name, fingerprint, time.time(), log_path)
+
+                if not running:
+                    continue  # 本轮有阶段被跳过, 其下游在下一轮调度
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint, started, log_path = running.pop(future)
+                    code, duration = future.result()
+                    ok = code == 0
+                    status[name] = "success" if ok else "failed"
+                    durations[name] = duration
+                    ran.add(name)
+                    store.record(run_id, name, status[name], fingerprint, started, duration, log_path)
+                    print(f"[{name}] {'完成' if ok else f'失败 (退出码 {code}), 日志: {log_path}'} ({duration:.1f}s)")
+    finally:
+        store.close()
+
+    if not dry_run:
+        total, path = critical_path(stages, durations)
+        print(f"\n流水线 {run_id} 结束, 总耗时 {time.time() - t_start:.1f}s")
+        print(f"关键路径 ({total:.1f}s): {' -> '.join(f'{n} {durations.get(n, 0):.1f}s' for n in path)}")
+        if trace:
+            print(f"追踪文件: {tracing.merge(trace_dir)} (chrome://tracing 或 ui.perfetto.dev 打开)")
+            tracing.print_summary(trace_dir / tracing.OUTPUT_NAME)
+    return status
+
+
+def show_timings(stages: dict = STAGES, last_runs: int = 10, state_path: Path = STATE_PATH) -> None:
+    store = StateStore(state_path)
+    try:
+        timings = store.timings(last_runs)
+    finally:
+        store.close()
+    if not timings:
+        print("还没有运行记录")
+        return
+    print(f"最近 {last_runs} 次运行中各阶段实际执行的耗时:")
+    print(f"{'阶段':<14}{'次数':>6}{'平均':>10}{'最长':>10}{'最近':>10}")
+    for name in topo_order(stages):
+        if name in timings:
+            t = timings[name]
+            print(f"{name:<14}{t['n']:>6}{t['avg']:>9.1f}s{t['max']:>9.1f}s{t['last'] or 0:>9.1f}s")
+    total, path = critical_path(stages, {n: t["avg"] for n, t in timings.items()})
+    print(f"\n按平均耗时的关键路径 ({total:.1f}s): {' -> '.join(path)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流水线编排: 按依赖运行各阶段, 跳过输入未变化的阶段")
+    parser.add_argument("--targets", nargs="+", default=None, help="只运行这些阶段及其上游")
+    parser.add_argument("--force", nargs="+", default=[], help="即使输入未变化也重新运行的阶段")
+    parser.add_argument("--force_all", action="store_true")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="同时运行的阶段数")
+    parser.add_argument("--dry_run", action="store_true", help="只显示哪些阶段会运行")
+    parser.add_argument("--trace", action="store_true", help="记录各阶段内部的 span 并合并为 Chrome trace")
+    parser.add_argument("--timings", type=int, nargs="?", const=10, default=None, metavar="N",
+                        help="查看最近 N 次运行的各阶段耗时和关键路径")
+    args = parser.parse_args()
+
+    if args.timings:
+        show_timings(last_runs=args.timings)
+    else:
+        selected = with_ancestors(STAGES, args.targets) if args.targets else STAGES
+        result = run_pipeline(selected, force=set(args.force), force_all=args.force_all,
+                              workers=args.workers, dry_run=args.dry_run, trace=args.trace)
+        if any(s in ("failed", "blocked") for s in result.values()):
+            sys.exit(1)
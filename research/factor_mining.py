@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+批量因子挖掘: 每日横截面 IC / RankIC 评估
+
+以前试一个新因子要改 fields/names 再重训整个模型. 这里直接对候选表达式计算
+与标签 Ref($high, -1) / $close - 1 的每日横截面 IC / RankIC, 输出 均值、ICIR 和衰减.
+
+  - 候选表达式分块 (CHUNK_SIZE 个一块) 交给多个进程并行计算, 每个进程只回传统计量;
+  - 因子和标签都对齐成 (日期 x 股票) 的稠密矩阵, 一块因子叠成 (因子 x 日期 x 股票) 三维数组,
+    沿最后一维一次 argsort 完成所有因子、所有日期的排名 (平均名次处理并列值);
+  - 衰减: 因子在 t 日与 t+k 日标签的 RankIC, k = 0..DECAY_LAGS-1.
+
+候选文件格式 (每行一个, # 开头为注释, 名字可省略):
+    amplitude_10d: Mean(($high - $low) / Ref($close, 1), 10)
+    $close / Ref($close, 5) - 1
+
+用法:
+    python research/factor_mining.py research/factor_candidates.txt --workers 8 --output factor_report.csv
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.processors import rank_last_axis
+from research.washout_features import fields, names, label_expr
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+START_TIME = "2020-01-01"
+END_TIME = "2025-12-31"
+MARKET = "all"
+BENCHMARK = "SH000300"
+CHUNK_SIZE = 8  # 每个进程一次计算的表达式数, 控制单进程内存
+DECAY_LAGS = 5
+MIN_STOCKS = 30  # 当日有效股票数不足时不计 IC
+
+
+def parse_candidates(path: Path):
+    """读取候选文件, 返回 [(name, expr), ...]"""
+    candidates = []
+    for i, line in enumerate(Path(path).read_text(encoding="utf-8").splitlines()):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        name, sep, expr = line.partition(":")
+        if not sep or "$" in name:
+            name, expr = f"factor_{i}", line
+        candidates.append((name.strip(), expr.strip()))
+    return candidates
+
+
+def row_corr(a: np.ndarray, b: np.ndarray, min_count: int = MIN_STOCKS) -> np.ndarray:
+    """沿最后一维的 Pearson 相关, 只用两边都非 NaN 的位置"""
+    mask = ~(np.isnan(a) | np.isnan(b))
+    n = mask.sum(axis=-1).astype(np.float64)
+    a0 = np.where(mask, a, 0).astype(np.float64)
+    b0 = np.where(mask, b, 0).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ma = a0.sum(axis=-1) / n
+        mb = b0.sum(axis=-1) / n
+        cov = (a0 * b0).sum(axis=-1) / n - ma * mb
+        va = (a0 * a0).sum(axis=-1) / n - ma * ma
+        vb = (b0 * b0).sum(axis=-1) / n - mb * mb
+        corr = cov / np.sqrt(va * vb)
+    corr[n < min_count] = np.nan
+    return corr
+
+
+def evaluate_block(factors: np.ndarray, label: np.ndarray, decay_lags: int = DECAY_LAGS) -> dict:
+    """
+    factors: (因子数, 日期, 股票), label: (日期, 股票)
+    返回每日 IC / RankIC (因子数 x 日期) 及各滞后期 RankIC 均值 (因子数 x 滞后期)
+    """
+    factors = np.where(np.isinf(factors), np.nan, factors)
+    ic = row_corr(factors, label[None])
+
+    decay = np.full((len(factors), decay_lags), np.nan)
+    rank_ic = None
+    for lag in range(decay_lags):
+        # t 日因子 vs t+lag 日标签
+        f = factors[:, : factors.shape[1] - lag] if lag else factors
+        lab = label[lag:]
+        # 只在两边都有值的股票上排名
+        both = ~(np.isnan(f) | np.isnan(lab[None]))
+        f_rank = rank_last_axis(np.where(both, f, np.nan))
+        l_rank = rank_last_axis(np.where(both, lab[None], np.nan))
+        daily = row_corr(f_rank, l_rank)
+        if lag == 0:
+            rank_ic = daily
+        decay[:, lag] = np.nanmean(daily, axis=1)
+    return {"ic": ic, "rank_ic": rank_ic, "decay": decay}
+
+
+def summarize(names_, ic: np.ndarray, rank_ic: np.ndarray, decay: np.ndarray) -> pd.DataFrame:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rows = {
+            "ic_mean": np.nanmean(ic, axis=1),
+            "icir": np.nanmean(ic, axis=1) / np.nanstd(ic, axis=1),
+            "rank_ic_mean": np.nanmean(rank_ic, axis=1),
+            "rank_icir": np.nanmean(rank_ic, axis=1) / np.nanstd(rank_ic, axis=1),
+            "rank_ic_win_rate": np.nanmean(np.where(np.isnan(rank_ic), np.nan, rank_ic > 0), axis=1),
+            "n_days": np.sum(~np.isnan(rank_ic), axis=1),
+        }
+    df = pd.DataFrame(rows, index=pd.Index(names_, name="factor"))
+    for lag in range(decay.shape[1]):
+        df[f"rank_ic_lag{lag}"] = decay[:, lag]
+    return df
+
+
+# ---------------- 并行计算 ----------------
+_WORKER = {}
+
+
+def _to_dense(series_df: pd.DataFrame, dates: pd.DatetimeIndex, codes: pd.Index) -> np.ndarray:
+    """(instrument, datetime) 索引的 DataFrame -> (列数, 日期, 股票) 稠密 float32 数组"""
+    d_idx = dates.get_indexer(series_df.index.get_level_values("datetime"))
+    i_idx = codes.get_indexer(series_df.index.get_level_values("instrument"))
+    keep = (d_idx >= 0) & (i_idx >= 0)
+    out = np.full((series_df.shape[1], len(dates), len(codes)), np.nan, dtype=np.float32)
+    values = series_df.to_numpy(dtype=np.float32)
+    out[:, d_idx[keep], i_idx[keep]] = values[keep].T
+    return out
+
+
+def _init_worker(provider_uri, dates, codes, start_time, end_time):
+    import qlib
+    from qlib.data import D
+
+    # 每个进程单核计算表达式, 并行度由进程数决定
+    qlib.init(provider_uri=provider_uri, region="cn", kernels=1)
+    _WORKER.update(dates=dates, codes=codes, start_time=start_time, end_time=end_time)
+    label = D.features(list(codes), label_expr, start_time=start_time, end_time=end_time)
+    _WORKER["label"] = _to_dense(label, dates, codes)[0]
+
+
+def _evaluate_chunk(chunk):
+    from qlib.data import D
+
+    t0 = time.time()
+    chunk_names = [n for n, _ in chunk]
+    exprs = [e for _, e in chunk]
+    df = D.features(list(_WORKER["codes"]), exprs, start_time=_WORKER["start_time"], end_time=_WORKER["end_time"])
+    factors = _to_dense(df, _WORKER["dates"], _WORKER["codes"])
+    del df
+    res = evaluate_block(factors, _WORKER["label"])
+    return summarize(chunk_names, res["ic"], res["rank_ic"], res["decay"]), time.time() - t0
+
+
+def run_mining(candidates, workers=None, start_time=START_TIME, end_time=END_TIME, market=MARKET) -> pd.DataFrame:
+    from qlib.data import D
+
+    dates = pd.DatetimeIndex(D.calendar(start_time=start_time, end_time=end_time))
+    codes = D.list_instruments(D.instruments(market), start_time=start_time, end_time=end_time, as_list=True)
+    codes = pd.Index(sorted(c for c in codes if c != BENCHMARK))
+
+    chunks = [candidates[i:i + CHUNK_SIZE] for i in range(0, len(candidates), CHUNK_SIZE)]
+    workers = workers or min(len(chunks), os.cpu_count() or 1)
+    print(f"候选因子 {len(candidates)} 个, 分 {len(chunks)} 块, {workers} 个进程; 面板 {len(dates)} 天 x {len(codes)} 只")
+
+    t0 = time.time()
+    reports = []
+    provider_uri = str(QLIB_DATA_DIR.resolve())
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(provider_uri, dates, codes, start_time, end_time)) as executor:
+        futures = [executor.submit(_evaluate_chunk, chunk) for chunk in chunks]
+        for i, future in enumerate(as_completed(futures), 1):
+            report, cost = future.result()
+            reports.append(report)
+            print(f" [{i}/{len(chunks)}] {len(report)} 个因子, {cost:.1f}s")
+
+    report = pd.concat(reports)
+    report = report.reindex(report["rank_icir"].abs().sort_values(ascending=False).index)
+    print(f"评估完成, 总耗时 {time.time() - t0:.1f}s")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量因子 IC / RankIC 评估")
+    parser.add_argument("candidates", help="候选表达式文件")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--baseline", action="store_true", help="同时评估现有的洗盘特征作为对照")
+    parser.add_argument("--start", default=START_TIME)
+    parser.add_argument("--end", default=END_TIME)
+    parser.add_argument("--output", default="factor_report.csv")
+    args = parser.parse_args()
+
+    import qlib
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+
+    candidates = parse_candidates(args.candidates)
+    if args.baseline:
+        candidates = list(zip(names, fields)) + candidates
+
+    result = run_mining(candidates, args.workers, args.start, args.end)
+    pd.set_option("display.width", 200)
+    print(result.head(30).to_string(float_format=lambda v: f"{v:.4f}"))
+    result.to_csv(args.output)
+    print(f"\n完整结果已写入: {args.output}")
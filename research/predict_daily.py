@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+每日收盘后快速推理
+
+train_washout_model.predict_next_day 需要先算完 2020~2025 全部特征再取最后一天,
+这里直接加载已保存的模型, 只对最新交易日取特征: Qlib 会按每个表达式自身的回看长度
+(最长 MAX_LOOKBACK=20 个交易日) 向前扩展读取窗口, 因此只读取最近约 20 天的 bin 数据.
+排序前按涨跌停位图 (data_processing/tradability.py) 剔除当天停牌和收盘涨停 (次日大概率买不进) 的股票.
+
+用法:
+    python research/predict_daily.py --topk 10
+    python research/predict_daily.py --date 2025-12-30 --output picks.csv
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import lightgbm as lgb
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.tradability import BITMAP_PATH, FLAG_NAMES, TradabilityBitmap
+from research.washout_features import fields, names
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+MODEL_PATH = Path("models/washout_lgb.txt")
+MARKET = "liquid_top2000"  # 与训练同一股票池 (data_processing/universe.py), 不存在时退回 all
+BENCHMARK = "SH000300"  # 指数不参与选股
+TOP_K = 10
+EXCLUDE_FLAGS = ["suspended", "limit_up"]  # 剔除当天停牌、收盘涨停的股票
+
+
+def load_latest_features(date=None, market: str = MARKET):
+    """只计算某一交易日 (默认最新) 的特征, 返回 (index=instrument 的 DataFrame, 交易日)"""
+    from qlib.data import D
+
+    from data_processing.universe import resolve
+
+    calendar = D.calendar(end_time=date)
+    if len(calendar) == 0:
+        raise ValueError(f"日历中没有 {date} 之前的交易日")
+    trade_date = calendar[-1]
+
+    # 只取当天仍在交易的股票, 退市股不参与计算
+    instruments = D.list_instruments(D.instruments(resolve(market, QLIB_DATA_DIR)), start_time=trade_date, end_time=trade_date, as_list=True)
+    instruments = [code for code in instruments if code != BENCHMARK]
+
+    df = D.features(instruments, fields, start_time=trade_date, end_time=trade_date)
+    df.columns = names
+    df = df.xs(trade_date, level="datetime")
+    # 与训练阶段一致: Fillna(0)
+    return df.fillna(0), trade_date
+
+
+def exclude_untradable(features: pd.DataFrame, trade_date, bitmap_path: Path = BITMAP_PATH) -> pd.DataFrame:
+    """按位图剔除当天不宜买入的股票; 位图不存在或未覆盖该交易日时原样返回"""
+    if not bitmap_path.exists():
+        print(f"提示: 未找到涨跌停位图 {bitmap_path}, 不做可交易过滤")
+        return features
+    bitmap = TradabilityBitmap.load(bitmap_path)
+    if pd.Timestamp(trade_date) not in bitmap.dates:
+        print(f"提示: 涨跌停位图未覆盖 {pd.Timestamp(trade_date).date()}, 不做可交易过滤")
+        return features
+    dates = [trade_date] * len(features)
+    drop = pd.Series(False, index=features.index)
+    for name in EXCLUDE_FLAGS:
+        hit = bitmap.lookup(FLAG_NAMES.index(name), features.index, dates)
+        print(f"剔除 {name}: {int(hit.sum())} 只")
+        drop |= hit
+    return features[~drop.to_numpy()]
+
+
+def rank_top_k(model: lgb.Booster, features: pd.DataFrame, topk: int = TOP_K) -> pd.DataFrame:
+    """按模型输出的爆发概率排序, 返回 Top K"""
+    # 按模型保存时的特征顺序取列, 防止表达式文件顺序调整后错位
+    X = features.loc[:, model.feature_name()].to_numpy(dtype="float32")
+    result = features.copy()
+    result["prob_burst"] = model.predict(X)
+    return result.nlargest(topk, "prob_burst")
+
+
+def print_picks(picks: pd.DataFrame, trade_date) -> None:
+    print(f"\n[模型预测] 基于 {pd.Timestamp(trade_date).date()} 收盘数据, 明日最可能拉升/爆发的 Top {len(picks)} 股票：")
+    print("-" * 80)
+    print(f"{'股票代码':<12} {'爆发概率':<10} {'换手率':<10} {'振幅':<10} {'20日涨幅':<10}")
+    print("-" * 80)
+    for code, row in zip(picks.index, picks.itertuples(index=False)):
+        print(f"{code:<12} {row.prob_burst:.2%}      {row.turnover:.4f}      {row.amplitude:.4f}      {row.return_20d:.4f}")
+    print("-" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="洗盘模型每日推理 (只计算最新交易日特征)")
+    parser.add_argument("--date", default=None, help="推理日期, 默认日历中最新交易日")
+    parser.add_argument("--topk", type=int, default=TOP_K)
+    parser.add_argument("--model", default=str(MODEL_PATH))
+    parser.add_argument("--output", default=None, help="可选: 把 Top K 写入 CSV")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    model_path = Path(args.model)
+    if not model_path.exists():
+        print(f"未找到模型文件: {model_path}, 请先运行 research/train_washout_model.py")
+        return
+    model = lgb.Booster(model_file=str(model_path))
+
+    import qlib
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+    t1 = time.time()
+
+    features, trade_date = load_latest_features(args.date)
+    t2 = time.time()
+
+    picks = rank_top_k(model, exclude_untradable(features, trade_date), args.topk)
+    t3 = time.time()
+
+    print_picks(picks, trade_date)
+    if args.output:
+        picks.to_csv(args.output, index_label="instrument")
+        print(f"已写入: {args.output}")
+
+    print(f"耗时: 初始化 {t1 - t0:.2f}s | 特征 {t2 - t1:.2f}s ({len(features)} 只) | 打分 {t3 - t2:.3f}s | 总计 {t3 - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+常驻打分服务
+
+每次选股都要 qlib.init -> 构建 handler -> 训练 -> 打印, 启动成本远大于打分本身.
+这里启动一个本地 HTTP 服务, 常驻内存的有:
+  - 已训练好的 LightGBM 模型 (models/washout_lgb.txt);
+  - 最近 WINDOW_DAYS 个交易日的 OHLCV/换手率 滚动窗口 (日期 x 股票 的 numpy 矩阵);
+  - 最近一次刷新后的全市场打分.
+fetch_akshare.py 入库新快照后会 POST /refresh 通知, 服务只从 ClickHouse 读取最新一天的数据:
+同一天 (盘中) 覆盖最后一行, 新的一天则窗口滚动一行, 然后用 numpy 重新计算 8 个特征并打分.
+stock_daily 存的是原始价格, 而窗口来自 Qlib bin (复权价, 按导出时最后一天的因子为 1 归一).
+追加前用 stock_adj_factor 把新的一天换算到同一尺度: 价格 x hfq(当天) / hfq(导出日), 成交量反之;
+否则除权当天 (如 10 送 10) 会在窗口里表现为 -50% 的 return_20d 和翻倍的成交量.
+GET /topk 只对缓存的打分做 argpartition, 毫秒级返回.
+
+接口:
+    GET  /topk?k=10      Top K 股票及得分
+    GET  /health         窗口日期、股票数、模型路径
+    POST /refresh        从 ClickHouse 拉取最新快照并重新打分
+    POST /reload_model   重新加载模型文件
+
+用法:
+    python research/scoring_daemon.py --port 8765
+    curl "http://127.0.0.1:8765/topk?k=10"
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_ingestion.fetch_adj_factor import CREATE_TABLE_SQL as ADJ_FACTOR_TABLE_SQL
+from research.washout_features import MAX_LOOKBACK, names
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+MODEL_PATH = Path("models/washout_lgb.txt")
+HOST = "127.0.0.1"
+PORT = 8765
+MARKET = "liquid_top2000"  # 与训练同一股票池 (data_processing/universe.py), 不存在时退回 all
+BENCHMARK = "SH000300"
+CLICKHOUSE_HOST = "localhost"
+CLICKHOUSE_DB = "stock_data"
+TOP_K = 10
+
+# Ref($close, 20) 需要 21 行
+WINDOW_DAYS = MAX_LOOKBACK + 1
+RAW_FIELDS = ["open", "high", "low", "close", "volume", "turnover"]
+PRICE_FIELDS = ["open", "high", "low", "close"]
+
+
+def _nanmean_tail(x: np.ndarray, n: int) -> np.ndarray:
+    # 等价于 Qlib Mean(x, n) 在最后一天的取值 (rolling(min_periods=1), 忽略 NaN)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(x[-n:], axis=0)
+
+
+def _nanstd_tail(x: np.ndarray, n: int) -> np.ndarray:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanstd(x[-n:], axis=0, ddof=1)
+
+
+def compute_features(window: dict) -> np.ndarray:
+    """
+    按 research/washout_features.py 的表达式, 只计算窗口最后一天的特征.
+    window: {字段: (日期, 股票) 矩阵}, 返回 (股票, 特征) 矩阵, 列顺序与 names 一致
+    """
+    o, h, l, c = (window[k] for k in ("open", "high", "low", "close"))
+    v, t = window["volume"], window["turnover"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        feats = {
+            "amplitude": (h[-1] - l[-1]) / c[-2],
+            "lower_shadow_ratio": (np.where(o[-1] < c[-1], o[-1], c[-1]) - l[-1]) / c[-1],
+            "turnover": t[-1],
+            "turnover_ratio_5d": t[-1] / _nanmean_tail(t, 5),
+            "vol_shrink_20d": v[-1] / _nanmean_tail(v, 20),
+            "return_20d": c[-1] / c[-21] - 1,
+            "volatility_20d": _nanstd_tail(c, 20) / _nanmean_tail(c, 20),
+            # NaN 比较结果为 False, 与 Qlib 一致
+            "rsi_sim_14": np.mean(c[-14:] > o[-14:], axis=0) / 14,
+        }
+    return np.column_stack([feats[n] for n in names]).astype(np.float32)
+
+
+def adjust_to_window(bars: pd.DataFrame, ratio: pd.Series) -> pd.DataFrame:
+    """
+    原始价格 -> 窗口的复权尺度. ratio: index=instrument, hfq(当天) / hfq(导出日);
+    没有因子记录的股票 (以及因子为 0 的默认值) 按 1 处理, 与 export_to_qlib.apply_adj_factor 一致
+    """
+    ratio = ratio.reindex(bars.index).replace(0, np.nan).fillna(1.0).to_numpy()
+    bars = bars.copy()
+    for f in PRICE_FIELDS:
+        bars[f] = bars[f].to_numpy(dtype=np.float64) * ratio
+    bars["volume"] = bars["volume"].to_numpy(dtype=np.float64) / ratio
+    return bars
+
+
+class ScoringState:
+    """模型 + 滚动窗口 + 最新打分, 刷新时整体替换, 读请求无锁"""
+
+    def __init__(self, model_path: Path = MODEL_PATH):
+        self.model_path = Path(model_path)
+        self.model = lgb.Booster(model_file=str(self.model_path))
+        self.lock = threading.Lock()
+        self.dates = []
+        self.codes = pd.Index([])
+        self.window = {}
+        self.base_date = None  # 窗口数据对应的导出日 (Qlib 日历最后一天), 复权因子在这一天为 1
+        self.snapshot = None  # (date, codes, features, scores)
+
+    # ---------- 初始化: 从 Qlib bin 读取最近 WINDOW_DAYS 天 ----------
+    def load_from_qlib(self, market: str = MARKET) -> None:
+        import qlib
+        from qlib.data import D
+
+        from data_processing.universe import resolve
+
+        qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+        calendar = D.calendar()
+        dates = list(calendar[-WINDOW_DAYS:])
+        codes = D.list_instruments(D.instruments(resolve(market, QLIB_DATA_DIR)), start_time=dates[-1], end_time=dates[-1], as_list=True)
+        codes = pd.Index(sorted(c for c in codes if c != BENCHMARK))
+        df = D.features(list(codes), [f"${f}" for f in RAW_FIELDS], start_time=dates[0], end_time=dates[-1])
+        df.columns = RAW_FIELDS
+
+        d_idx = pd.Index(dates).get_indexer(df.index.get_level_values("datetime"))
+        i_idx = codes.get_indexer(df.index.get_level_values("instrument"))
+        window = {}
+        for f in RAW_FIELDS:
+            mat = np.full((len(dates), len(codes)), np.nan, dtype=np.float32)
+            mat[d_idx, i_idx] = df[f].to_numpy(dtype=np.float32)
+            window[f] = mat
+        with self.lock:
+            self.dates, self.codes, self.window = dates, codes, window
+            self.base_date = pd.Timestamp(dates[-1])
+            self._rescore()
+
+    # ---------- 增量: 合并一天的快照 ----------
+    def apply_snapshot(self, trade_date, bars: pd.DataFrame) -> str:
+        """bars: index=instrument, 列为 RAW_FIELDS. 同一天覆盖最后一行, 新的一天窗口滚动一行"""
+        trade_date = pd.Timestamp(trade_date)
+        with self.lock:
+            codes, window, dates = self.codes, dict(self.window), list(self.dates)
+            new_codes = bars.index.difference(codes)
+            if len(new_codes) > 0:
+                # 新上市股票: 追加列, 历史为 NaN
+                codes = codes.append(new_codes)
+                for f in RAW_FIELDS:
+                    pad = np.full((len(dates), len(new_codes)), np.nan, dtype=np.float32)
+                    window[f] = np.hstack([window[f], pad])
+
+            if dates and trade_date == dates[-1]:
+                action = "intraday"
+            elif not dates or trade_date > dates[-1]:
+                action = "roll"
+                # 先滚动一行 (占位行随后被当日数据覆盖)
+                dates = (dates + [trade_date])[-WINDOW_DAYS:]
+                for f in RAW_FIELDS:
+                    window[f] = np.vstack([window[f], window[f][-1:]])[-WINDOW_DAYS:]
+            else:
+                return "stale"
+
+            pos = codes.get_indexer(bars.index)
+            for f in RAW_FIELDS:
+                row = np.full(len(codes), np.nan, dtype=np.float32)  # 当日无数据 = 停牌
+                row[pos] = bars[f].to_numpy(dtype=np.float32)
+                window[f] = np.vstack([window[f][:-1], row[None]])  # 新数组, 不改动正在被读取的旧窗口
+
+            self.dates, self.codes, self.window = dates, codes, window
+            self._rescore()
+            return action
+
+    def refresh_from_clickhouse(self) -> str:
+        from clickhouse_driver import Client
+
+        client = Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB, settings={"use_numpy": True})
+        sql = f"""
+        SELECT ts_code, trade_date, open, high, low, close, vol AS volume, turnover_rate AS turnover
+        FROM stock_daily
+        WHERE trade_date = (SELECT max(trade_date) FROM stock_daily) AND ts_code != '{BENCHMARK}'
+        """
+        df = client.query_dataframe(sql)
+        if df.empty:
+            client.disconnect()
+            return "empty"
+        trade_date = pd.Timestamp(df["trade_date"].iloc[0])
+        ratio = self.load_adj_ratio(client, trade_date)
+        client.disconnect()
+        # 与 export_to_qlib / dump_bin 相同的代码规则, 保证和 bin 数据对得上
+        bars = df.assign(instrument=df["ts_code"].astype(str).str.upper()).set_index("instrument")[RAW_FIELDS]
+        return self.apply_snapshot(trade_date, adjust_to_window(bars, ratio))
+
+    def load_adj_ratio(self, client, trade_date) -> pd.Series:
+        """每只股票 hfq(trade_date) / hfq(base_date), index 与 bars 相同 (大写代码)"""
+        client.execute(ADJ_FACTOR_TABLE_SQL)
+        df = client.query_dataframe(f"""
+            SELECT ts_code,
+                   argMaxIf(hfq_factor, trade_date, trade_date <= '{trade_date.date()}') AS hfq_new,
+                   argMaxIf(hfq_factor, trade_date, trade_date <= '{self.base_date.date()}') AS hfq_base
+            FROM stock_adj_factor FINAL
+            GROUP BY ts_code
+        """)
+        if df.empty:
+            return pd.Series(dtype=np.float64)
+        # 早于第一条因子记录时 argMaxIf 返回 0, 与导出时一样按 1.0 处理
+        hfq_new = df["hfq_new"].replace(0, 1.0).to_numpy()
+        hfq_base = df["hfq_base"].replace(0, 1.0).to_numpy()
+        return pd.Series(hfq_new / hfq_base, index=df["ts_code"].astype(str).str.upper())
+
+    def reload_model(self) -> None:
+        model = lgb.Booster(model_file=str(self.model_path))
+        with self.lock:
+            self.model = model
+            self._rescore()
+
+    def _rescore(self) -> None:
+        # 调用方已持锁
+        t0 = time.time()
+        feats = compute_features(self.window)
+        X = np.where(np.isnan(feats), 0, feats)  # 与 predict_daily 一致: fillna(0)
+        scores = self.model.predict(X)
+        self.snapshot = (self.dates[-1], self.codes, feats, scores, time.time() - t0)
+
+    def top_k(self, k: int = TOP_K) -> dict:
+        t0 = time.perf_counter()
+        trade_date, codes, feats, scores, score_cost = self.snapshot
+        k = min(k, len(scores))
+        idx = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.array([], dtype=int)
+        idx = idx[np.argsort(-scores[idx])]
+        col = {n: i for i, n in enumerate(names)}
+        picks = [
+            {
+                "instrument": codes[i],
+                "score": float(scores[i]),
+                "turnover": float(feats[i, col["turnover"]]),
+                "amplitude": float(feats[i, col["amplitude"]]),
+                "return_20d": float(feats[i, col["return_20d"]]),
+            }
+            for i in idx
+        ]
+        return {
+            "date": str(pd.Timestamp(trade_date).date()),
+            "picks": picks,
+            "score_ms": round(score_cost * 1000, 2),
+            "query_ms": round((time.perf_counter() - t0) * 1000, 3),
+        }
+
+
+def make_handler(state: ScoringState):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, payload: dict, code: int = 200):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/topk":
+                raw = parse_qs(url.query).get("k", [str(TOP_K)])[0]
+                try:
+                    k = int(raw)
+                except ValueError:
+                    k = 0
+                if k < 1:
+                    self._reply({"error": f"k 必须是正整数, 收到 {raw!r}"}, 400)
+                    return
+                self._reply(state.top_k(k))
+            elif url.path == "/health":
+                self._reply({
+                    "model": str(state.model_path),
+                    "window": [str(pd.Timestamp(d).date()) for d in (state.dates[0], state.dates[-1])],
+                    "n_days": len(state.dates),
+                    "n_stocks": len(state.codes),
+                })
+            else:
+                self._reply({"error": f"unknown path {url.path}"}, 404)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            try:
+                if url.path == "/refresh":
+                    t0 = time.time()
+                    action = state.refresh_from_clickhouse()
+                    self._reply({"action": action, "date": str(pd.Timestamp(state.dates[-1]).date()),
+                                 "cost_ms": round((time.time() - t0) * 1000, 1)})
+                elif url.path == "/reload_model":
+                    state.reload_model()
+                    self._reply({"model": str(state.model_path)})
+                else:
+                    self._reply({"error": f"unknown path {url.path}"}, 404)
+            except Exception as e:
+                self._reply({"error": str(e)}, 500)
+
+        def log_message(self, format, *args):
+            pass  # 不打印每个请求
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="洗盘模型常驻打分服务")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--model", default=str(MODEL_PATH))
+    args = parser.parse_args()
+
+    if not Path(args.model).exists():
+        print(f"未找到模型文件: {args.model}, 请先运行 research/train_washout_model.py")
+        sys.exit(1)
+
+    t0 = time.time()
+    state = ScoringState(Path(args.model))
+    state.load_from_qlib()
+    print(f"初始化完成: 窗口 {pd.Timestamp(state.dates[0]).date()} ~ {pd.Timestamp(state.dates[-1]).date()}, "
+          f"{len(state.codes)} 只股票, 耗时 {time.time() - t0:.2f}s")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"打分服务已启动: http://{args.host}:{args.port}/topk?k={TOP_K}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服务已停止")
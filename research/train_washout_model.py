@@ -5,145 +5,149 @@ from qlib.utils import init_instance_by_config
 import pandas as pd
 import numpy as np
 import sys
+import time
 from pathlib import Path
 import lightgbm as lgb
 from sklearn.metrics import roc_auc_score
 
-# Initialize Qlib
-QLIB_DATA_DIR = str(Path("qlib_data/cn_data").resolve())
-qlib.init(provider_uri=QLIB_DATA_DIR, region="cn")
-
-# 定义"强力洗盘+爆发", 我们需要过去一个月的表现来判断是否在"洗盘"
-fields = []
-names = []
-
-# A. 核心洗盘特征 (Price Action)
-# 1. 振幅 (Amplitude): 洗盘通常伴随剧烈震荡
-fields.append("($high - $low) / Ref($close, 1)")
-names.append("amplitude")
-
-# 2. 长下影线 (Lower Shadow): 主力试盘或支撑强度的标志
-# 下影线长度 / 收盘价
-fields.append("(If($open < $close, $open, $close) - $low) / $close")
-names.append("lower_shadow_ratio")
-
-# B. 量能与筹码 (Volume & Turnover)
-# 1. 换手率 (Turnover)
-fields.append("$turnover")
-names.append("turnover")
-
-# 2. 换手率变化: 今天换手率 / 过去5天均值
-fields.append("$turnover / Mean($turnover, 5)")
-names.append("turnover_ratio_5d")
-
-# 3. 量能萎缩: 判断是否缩量洗盘 (True=1, False=0)
-# 如果今天成交量小于过去20天均值, 可能是缩量洗盘
-fields.append("$volume / Mean($volume, 20)")
-names.append("vol_shrink_20d")
-
-# C. 趋势与历史表现 (Past Month Behavior)
-# 1. 过去20天涨跌幅: 也就是月度涨幅，判断股票是否处于活跃期
-fields.append("$close / Ref($close, 20) - 1")
-names.append("return_20d")
-
-# 2. 波动率 (Volatility): 过去20天的标准差，寻找活跃股
-fields.append("Std($close, 20) / Mean($close, 20)")
-names.append("volatility_20d")
-
-# 3. RSI (相对强弱指标): 简单的 RSI 近似，判断是否超卖
-# (涨幅和 / 绝对涨幅和)
-fields.append("Mean($close>$open, 14) / 14") 
-names.append("rsi_sim_14")
-
-# D. 目标 (Label)
-# 预测：明天最高价相对于今天收盘价的涨幅 (捕捉盘中拉升)
-label_expr = ["Ref($high, -1) / $close - 1"]
-label_cols = ["label_max_ret"]
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.feature_cache import (cache_key, data_version, evict, instruments_version, load_features,
+                                           static_loader_config)
+from data_processing.universe import resolve
+from research.washout_features import fields, names, label_expr, label_cols
+from tracing import span
 
-def get_data_handler():
+QLIB_DATA_DIR = str(Path("qlib_data/cn_data").resolve())
+MARKET = "liquid_top2000"  # data_processing/universe.py 生成的股票池, 不存在时退回 all
+
+START_TIME = "2020-01-01"
+END_TIME = "2025-12-31"
+USE_FEATURE_CACHE = True  # 表达式/数据未变化时直接读磁盘缓存, 跳过特征计算
+MODEL_PATH = Path("models/washout_lgb.txt")  # 供 predict_daily.py 每日推理直接加载
+
+# 训练集：2020 to 2024.06
+# 测试集：2024.07 to Today
+SPLIT_DATE = "2024-07-01"
+BURST_THRESHOLD = 0.04  # 明天最高涨幅 > 4% 视为"爆发"
+
+# LightGBM 分箱后的 Dataset 以二进制格式缓存, 数据与切分不变时跳过重新分箱
+DATASET_CACHE_DIR = Path("qlib_data/lgb_dataset_cache")
+DATASET_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+LOADER_CONFIG = {
+    "feature": (fields, names),
+    "label": (label_expr, label_cols),
+}
+
+LGB_PARAMS = {
+    "objective": "binary",
+    "metric": "auc",
+    "learning_rate": 0.05,
+    "num_leaves": 64,  # 增加复杂度
+    "max_depth": 7,
+    "seed": 42,
+    "num_threads": 0,  # 0 = 使用全部核心
+    "verbose": -1,
+}
+NUM_BOOST_ROUND = 500  # 树的数量
+
+def get_data_handler(market=MARKET):
+    # 原始特征/标签走磁盘缓存, 处理器仍由 DataHandlerLP 执行
+    raw_df = load_features(LOADER_CONFIG, instruments=market, start_time=START_TIME, end_time=END_TIME,
+                           use_cache=USE_FEATURE_CACHE)
 
     dh_config = {
         "class": "DataHandlerLP",
         "module_path": "qlib.data.dataset.handler",
         "kwargs": {
-            "start_time": "2020-01-01",
-            "end_time": "2025-12-31",
-            "instruments": "all",
+            "start_time": START_TIME,
+            "end_time": END_TIME,
+            # 缓存里已经按股票池过滤, StaticDataLoader 不再按股票过滤
+            "instruments": None,
             "infer_processors": [{"class": "Fillna", "kwargs": {"fields_group": "feature"}}],
             # 学习阶段丢弃 Label 为空的行
             "learn_processors": [{"class": "DropnaLabel"}],
-            "data_loader": {
-                "class": "QlibDataLoader",
-                "kwargs": {
-                    "config": {
-                        "feature": (fields, names),
-                        "label": (label_expr, label_cols),
-                    },
-                },
-            },
+            "data_loader": static_loader_config(raw_df),
         },
     }
     return init_instance_by_config(dh_config)
 
+def build_lgb_datasets(X_train, y_train, X_test, y_test, market=MARKET):
+    """构建 (或从二进制缓存加载) 训练/验证 Dataset"""
+    version = f"{data_version()}{instruments_version(market)}|split={SPLIT_DATE}|threshold={BURST_THRESHOLD}"
+    key = cache_key(LOADER_CONFIG, market, START_TIME, END_TIME, version=version)
+    train_path = DATASET_CACHE_DIR / f"{key}.train.bin"
+    valid_path = DATASET_CACHE_DIR / f"{key}.valid.bin"
+
+    if train_path.exists() and valid_path.exists():
+        print(f"LightGBM Dataset 缓存命中: {key}")
+        train_path.touch()
+        valid_path.touch()
+        dtrain = lgb.Dataset(str(train_path))
+        dvalid = lgb.Dataset(str(valid_path), reference=dtrain)
+        return dtrain, dvalid
+
+    dtrain = lgb.Dataset(X_train, label=y_train, feature_name=names, params={"verbose": -1})
+    dvalid = lgb.Dataset(X_test, label=y_test, reference=dtrain)
+    DATASET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # save_binary 会先完成分箱 (construct), 之后训练直接复用
+    dtrain.save_binary(str(train_path))
+    dvalid.save_binary(str(valid_path))
+    evict(DATASET_CACHE_DIR, DATASET_CACHE_MAX_BYTES, pattern="*.bin")
+    return dtrain, dvalid
+
 def train_and_predict():
     print("正在构建'游资洗盘'特征集")
-    dh = get_data_handler()
+    market = resolve(MARKET)
+    with span("train.data_handler", market=market):
+        dh = get_data_handler(market)
 
     print("提取数据中...")
-    df = dh.fetch(col_set=["feature", "label"])
+    with span("train.fetch"):
+        df = dh.fetch(col_set=["feature", "label"])
 
     # 将多级列索引 (feature, amplitude) 展平为 (amplitude)
     df.columns = df.columns.droplevel(0)
-    
-    # 数据清洗：去极值或填充0   
-    df = df.fillna(0)
 
-    # 生成二分类标签: 明天最高涨幅 > 4% 视为"爆发" (1)，否则为 (0)
-    # 对于游资票，我们想抓那个瞬间的冲高
-    df["label_class"] = (df["label_max_ret"] > 0.04).astype(int)
-
-    # 训练集：2020 to 2024.06
-    # 测试集：2024.07 to Today
-    split_date = pd.Timestamp("2024-07-01")
-    
-    # 这里的 reset_index 是为了方便后续根据日期筛选，但训练时我们需要纯数值
-    train_df = df[df.index.get_level_values("datetime") < split_date]
-    test_df = df[df.index.get_level_values("datetime") >= split_date]
+    # 特征直接取成连续的 float32 矩阵, 不再对整个 DataFrame 做 fillna (会生成 float64 副本)
+    X = np.ascontiguousarray(df[names].to_numpy(dtype=np.float32))
+    # 数据清洗：填充0
+    X[np.isnan(X)] = 0
 
-    X_train = train_df.iloc[:, :-2] # 特征
-    y_train = train_df["label_class"] # 标签
+    # 生成二分类标签: 明天最高涨幅 > 4% 视为"爆发" (1)，否则为 (0); 缺失标签视为 0
+    # 对于游资票，我们想抓那个瞬间的冲高
+    y = (df["label_max_ret"].to_numpy() > BURST_THRESHOLD).astype(np.float32)
+    df["label_class"] = y.astype(int)
 
-    X_test = test_df.iloc[:, :-2]
-    y_test = test_df["label_class"]
+    # 数据按 (datetime, instrument) 排序, 训练/测试集就是切分点前后两段连续行, 切片不拷贝
+    split = df.index.get_level_values("datetime").searchsorted(pd.Timestamp(SPLIT_DATE))
+    X_train, y_train = X[:split], y[:split]
+    X_test, y_test = X[split:], y[split:]
 
     print(f"训练样本: {len(X_train)}, 测试样本: {len(X_test)}")
     print(f"正样本(爆发)比例: {y_train.mean():.2%}")
 
+    t0 = time.time()
+    with span("train.build_dataset", rows=len(X_train)):
+        dtrain, dvalid = build_lgb_datasets(X_train, y_train, X_test, y_test, market)
+    print(f"Dataset 准备耗时: {time.time() - t0:.2f}s")
+
     # 训练 LightGBM (GBDT 比 简单的深度学习在表格数据上往往更有效且快)
     print("开始训练模型...")
-    clf = lgb.LGBMClassifier(
-        n_estimators=500,  # 树的数量
-        learning_rate=0.05,
-        num_leaves=64, # 增加复杂度
-        max_depth=7,
-        random_state=42,
-        n_jobs=-1,
-        verbose=-1
-    )
-    
-    clf.fit(X_train, y_train, eval_set=[(X_test, y_test)], eval_metric="auc")
+    with span("train.fit", num_boost_round=NUM_BOOST_ROUND):
+        model = lgb.train(LGB_PARAMS, dtrain, num_boost_round=NUM_BOOST_ROUND, valid_sets=[dvalid])
 
     # 评估
-    y_pred_prob = clf.predict_proba(X_test)[:, 1]
+    y_pred_prob = model.predict(X_test)
     auc = roc_auc_score(y_test, y_pred_prob)
     print(f"\n 测试集 AUC: {auc:.4f} (大于 0.6 说明有一定预测能力)")
 
     # 特征重要性分析
     print("\n 模型认为最重要的洗盘指标:")
-    imp_df = pd.DataFrame({"Feature": names, "Importance": clf.feature_importances_})
+    imp_df = pd.DataFrame({"Feature": model.feature_name(), "Importance": model.feature_importance()})
     print(imp_df.sort_values("Importance", ascending=False).head(10))
 
-    return clf, df
+    return model, df
 
 def predict_next_day(model, df_all):
     """
@@ -155,15 +159,15 @@ def predict_next_day(model, df_all):
     latest_date = df_all.index.get_level_values("datetime").max()
     print(f"基于历史数据日期: {latest_date.date()} (预测 T+1 日表现)")
     
-    # 2. 提取当天数据
-    latest_data = df_all[df_all.index.get_level_values("datetime") == latest_date].copy()
+    # 2. 提取当天数据 (按日期排序, 最后一天就是末尾一段连续行)
+    lo = df_all.index.get_level_values("datetime").searchsorted(latest_date)
+    latest_data = df_all.iloc[lo:].copy()
     
-    # 3. 准备特征 (确保去掉 label 列)
-    # df_all 最后两列是 label_max_ret 和 label_class，所以取 :-2
-    X_latest = latest_data.iloc[:, :-2]
+    # 3. 准备特征 (去掉 label 列), 填充方式与训练一致
+    X_latest = latest_data[names].fillna(0).to_numpy(dtype=np.float32)
     
     # 4. 预测概率
-    probs = model.predict_proba(X_latest)[:, 1]
+    probs = model.predict(X_latest)
     latest_data["prob_burst"] = probs
     
     # 5. 取概率最高的 Top 10
@@ -188,6 +192,13 @@ def predict_next_day(model, df_all):
 
 
 if __name__ == "__main__":
+    # Initialize Qlib (放在入口处, 导入本模块不触发初始化)
+    qlib.init(provider_uri=QLIB_DATA_DIR, region="cn")
+
     trained_model, full_data = train_and_predict()
 
+    MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
+    trained_model.save_model(str(MODEL_PATH))
+    print(f"模型已保存至: {MODEL_PATH.resolve()}")
+
     predict_next_day(trained_model, full_data)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+LightGBM 超参数搜索
+
+backtest_washout.py 里的 lambda_l1 / lambda_l2 / num_leaves 等参数是一次性调出来的魔法数字,
+数据增长后需要重新调参. 这里:
+  1. 用 walk_forward.build_panel 加载一次特征面板 (横截面排名, 与回测一致);
+  2. 训练/验证 Dataset 只分箱一次, 存成 LightGBM 二进制文件, 每个 trial 各自加载 (不重新分箱);
+  3. 多个 trial 在线程中并发 (LightGBM 训练时释放 GIL), 保证 并发数 x num_threads <= 核数;
+  4. 每个 trial 带早停, 另外按中位数规则提前终止明显偏差的 trial;
+  5. 结果写入本地 SQLite, 可随时查询/续跑.
+
+用法:
+    python research/tune_lgb.py --trials 60 --concurrency 4
+    python research/tune_lgb.py --show  # 查看已有结果
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from research.walk_forward import build_panel, label_and_weight
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+STORE_PATH = Path("models/hpo/trials.db")
+STUDY_NAME = "washout_lgb"
+
+# 验证集取训练区间最后半年, 不碰回测区间 (2024-07-01 之后)
+TRAIN_START = "2021-01-01"
+VALID_START = "2024-01-01"
+VALID_END = "2024-06-30"
+
+N_TRIALS = 60
+NUM_BOOST_ROUND = 1000
+EARLY_STOPPING_ROUNDS = 50
+PRUNE_EVERY = 50  # 每 50 轮检查一次是否劣于同轮次的中位数
+PRUNE_WARMUP_TRIALS = 5  # 至少 5 个 trial 报告过该轮次才开始剪枝
+SEED = 42
+
+BASE_PARAMS = {
+    "objective": "mse",
+    "learning_rate": 0.05,
+    "verbosity": -1,
+    "feature_pre_filter": False,  # 允许各 trial 使用不同 min_data_in_leaf 而不重新分箱
+}
+
+# (下界, 上界, 类型): log = 对数均匀, int = 整数均匀, float = 均匀
+SEARCH_SPACE = {
+    "num_leaves": (16, 512, "int"),
+    "max_depth": (4, 12, "int"),
+    "min_data_in_leaf": (20, 2000, "log_int"),
+    "lambda_l1": (1e-2, 1e3, "log"),
+    "lambda_l2": (1e-2, 1e3, "log"),
+    "colsample_bytree": (0.5, 1.0, "float"),
+    "subsample": (0.5, 1.0, "float"),
+}
+
+
+def sample_params(rng: np.random.Generator) -> dict:
+    params = {}
+    for name, (low, high, kind) in SEARCH_SPACE.items():
+        if kind == "int":
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == "log_int":
+            params[name] = int(round(np.exp(rng.uniform(np.log(low), np.log(high)))))
+        elif kind == "log":
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    # subsample 只有在 bagging_freq > 0 时才生效
+    params["subsample_freq"] = 1
+    return params
+
+
+def daily_ic(pred: np.ndarray, label: np.ndarray, day_start: np.ndarray) -> float:
+    """按日分段的 Pearson IC 均值 (label 已做横截面排名, 近似 RankIC), 用 reduceat 一次算完"""
+    valid = ~np.isnan(label)
+    pred = np.where(valid, pred, 0.0)
+    label = np.where(valid, label, 0.0)
+    starts = day_start[:-1]
+    n = np.add.reduceat(valid.astype(np.float64), starts)
+    sx, sy = np.add.reduceat(pred, starts), np.add.reduceat(label, starts)
+    sxx, syy = np.add.reduceat(pred * pred, starts), np.add.reduceat(label * label, starts)
+    sxy = np.add.reduceat(pred * label, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy - sx * sy / n
+        var = (sxx - sx * sx / n) * (syy - sy * sy / n)
+        ic = cov / np.sqrt(var)
+    return float(np.nanmean(ic))
+
+
+class TrialStore:
+    """SQLite 结果库: 每个 trial 一行"""
+
+    def __init__(self, path: Path = STORE_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trials (
+                study TEXT, trial_id INTEGER, params TEXT, state TEXT,
+                best_iteration INTEGER, valid_l2 REAL, valid_ic REAL,
+                num_threads INTEGER, duration REAL, created_at TEXT,
+                PRIMARY KEY (study, trial_id)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def next_trial_id(self, study: str) -> int:
+        row = self.conn.execute("SELECT MAX(trial_id) FROM trials WHERE study = ?", (study,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def add(self, study: str, record: dict) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    study, record["trial_id"], json.dumps(record["params"]), record["state"],
+                    record["best_iteration"], record["valid_l2"], record["valid_ic"],
+                    record["num_threads"], record["duration"], time.strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            )
+            self.conn.commit()
+
+    def results(self, study: str) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT * FROM trials WHERE study = ? ORDER BY valid_ic DESC", self.conn, params=(study,)
+        )
+
+
+class MedianPruner:
+    """同一轮次下验证集 l2 劣于已报告 trial 的中位数时, 终止该 trial"""
+
+    def __init__(self, every: int = PRUNE_EVERY, warmup: int = PRUNE_WARMUP_TRIALS):
+        self.every = every
+        self.warmup = warmup
+        self._history = {}  # iteration -> [l2, ...]
+        self._lock = threading.Lock()
+
+    def callback(self, state: dict):
+        def _callback(env):
+            score = next(s for _, name, s, _ in env.evaluation_result_list if name == "l2")
+            # 记录至今 l2 最低的轮次: 终止时 best_iteration 取它, 验证集 IC 与 valid_l2 出自同一轮
+            if score < state.setdefault("best", (np.inf, 0, None))[0]:
+                state["best"] = (score, env.iteration, env.evaluation_result_list)
+            it = env.iteration + 1
+            if it % self.every != 0:
+                return
+            with self._lock:
+                history = self._history.setdefault(it, [])
+                prune = len(history) >= self.warmup and score > np.median(history)
+                history.append(score)
+            if prune:
+                state["pruned"] = True
+                _, best_iteration, best_score = state["best"]
+                raise lgb.callback.EarlyStopException(best_iteration, best_score)
+
+        _callback.order = 40  # 在 early_stopping (order=30) 之后执行
+        return _callback
+
+
+def run_search(n_trials=N_TRIALS, concurrency=None, study=STUDY_NAME, store_path=STORE_PATH, seed=SEED):
+    cores = os.cpu_count() or 1
+    concurrency = concurrency or max(1, cores // 4)
+    num_threads = max(1, cores // concurrency)  # 并发数 x 线程数 <= 核数
+    print(f"{cores} 核: {concurrency} 个 trial 并发 x {num_threads} 线程")
+
+    X, y, index, dates, day_start = build_panel(start_time=TRAIN_START, end_time=VALID_END)
+    split = int(day_start[dates.searchsorted(pd.Timestamp(VALID_START))])
+    valid_day_start = day_start[day_start >= split] - split
+
+    # 分箱只做一次, 结果存成二进制文件. 不能让并发的 trial 共用同一个 Dataset 对象:
+    # lgb.train 每次都会用本 trial 的参数更新 Dataset.params, 参数不同时可能在别的线程训练中途重建它
+    t0 = time.time()
+    cache_dir = tempfile.TemporaryDirectory(prefix="tune_lgb_")
+    train_bin, valid_bin = (str(Path(cache_dir.name) / f"{name}.bin") for name in ("train", "valid"))
+    dataset_params = {"feature_pre_filter": False, "verbosity": -1}
+    dtrain = lgb.Dataset(X[:split], params=dataset_params, **label_and_weight(y[:split]))
+    dtrain.save_binary(train_bin)
+    lgb.Dataset(X[split:], reference=dtrain, **label_and_weight(y[split:])).save_binary(valid_bin)
+    del dtrain
+    X_valid, y_valid = X[split:], y[split:]
+    print(f"Dataset 构建完成: 训练 {split} 行, 验证 {len(y_valid)} 行, 耗时 {time.time() - t0:.1f}s")
+
+    store = TrialStore(store_path)
+    pruner = MedianPruner()
+    first_id = store.next_trial_id(study)
+    rng = np.random.default_rng(seed + first_id)
+    trials = [(first_id + i, sample_params(rng)) for i in range(n_trials)]
+
+    def _run(trial_id, params):
+        t_start = time.time()
+        full_params = {**BASE_PARAMS, **params, "num_threads": num_threads, "seed": seed}
+        evals, state = {}, {"pruned": False}
+        dtrain = lgb.Dataset(train_bin, params=dataset_params)
+        dvalid = lgb.Dataset(valid_bin, reference=dtrain)
+        booster = lgb.train(
+            full_params,
+            dtrain,
+            num_boost_round=NUM_BOOST_ROUND,
+            valid_sets=[dvalid],
+            valid_names=["valid"],
+            callbacks=[
+                lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False),
+                lgb.record_evaluation(evals),
+                pruner.callback(state),
+            ],
+        )
+        l2_curve = evals["valid"]["l2"]
+        pred = booster.predict(X_valid, num_iteration=booster.best_iteration or None)
+        return {
+            "trial_id": trial_id,
+            "params": params,
+            "state": "pruned" if state["pruned"] else "complete",
+            "best_iteration": booster.best_iteration or booster.current_iteration(),
+            "valid_l2": float(min(l2_curve)),
+            "valid_ic": daily_ic(pred, y_valid, valid_day_start),
+            "num_threads": num_threads,
+            "duration": time.time() - t_start,
+        }
+
+    t0 = time.time()
+    with cache_dir, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_run, trial_id, params) for trial_id, params in trials]
+        for future in as_completed(futures):
+            record = future.result()
+            store.add(study, record)
+            print(f" trial {record['trial_id']:>3} [{record['state']:<8}] IC={record['valid_ic']:.4f} "
+                  f"l2={record['valid_l2']:.4f} iter={record['best_iteration']} {record['duration']:.1f}s")
+    print(f"搜索完成: {n_trials} 个 trial, 总耗时 {time.time() - t0:.1f}s")
+    return show_results(study, store_path)
+
+
+def show_results(study=STUDY_NAME, store_path=STORE_PATH, top=10) -> pd.DataFrame:
+    df = TrialStore(store_path).results(study)
+    if df.empty:
+        print(f"{study} 尚无结果")
+        return df
+    print(f"\n====== {study}: Top {top} (按验证集 IC) ======")
+    print(df[["trial_id", "state", "valid_ic", "valid_l2", "best_iteration", "duration"]].head(top).to_string(index=False))
+    best = json.loads(df.iloc[0]["params"])
+    print("\n最优参数 (可直接替换 backtest_washout.py 中 LGBModel 的 kwargs):")
+    print(json.dumps(best, indent=4))
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LightGBM 超参数并发搜索")
+    parser.add_argument("--trials", type=int, default=N_TRIALS)
+    parser.add_argument("--concurrency", type=int, default=None, help="同时运行的 trial 数, 默认 核数 // 4")
+    parser.add_argument("--study", default=STUDY_NAME)
+    parser.add_argument("--show", action="store_true", help="只打印已有结果")
+    args = parser.parse_args()
+
+    if args.show:
+        show_results(args.study)
+    else:
+        import qlib
+
+        qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+        run_search(args.trials, args.concurrency, args.study)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+滚动 Walk-forward 训练 (训练 3 年 -> 预测 6 个月)
+
+特征面板只加载一次 (走 feature_cache), 转成按日期排序的连续 float32 矩阵放进共享内存;
+每个窗口在独立进程中按行号切片 (numpy view, 不拷贝) 训练 LightGBM,
+最后把各窗口的样本外预测拼成一条连续的 score 序列, 格式与 SignalRecord 的 pred.pkl 相同,
+可直接交给 backtest_washout.py --pred 回测.
+
+用法:
+    python research/walk_forward.py --train_years 3 --predict_months 6 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from data_processing.feature_cache import load_features
+from data_processing.processors import cs_rank_norm
+from data_processing.shared_arrays import attach, release, to_shared
+from research.washout_features import fields, names
+from tracing import span
+
+# Config
+QLIB_DATA_DIR = Path("qlib_data/cn_data")
+OUTPUT_DIR = Path("models/walk_forward")
+START_TIME = "2020-01-01"
+END_TIME = "2025-12-31"
+MARKET = "all"
+
+# 与 backtest_washout.py 相同: T+1 收盘涨幅, 横截面排名后作为回归目标
+LABEL_FIELDS = ["Ref($close, -1) / $close - 1"]
+LABEL_NAMES = ["label"]
+
+TRAIN_YEARS = 3
+PREDICT_MONTHS = 6
+VALID_MONTHS = 3  # 训练窗口最后 3 个月用作早停验证集
+LABEL_GAP = 1  # 标签用到 T+1 收盘价, 训练集末尾留 1 个交易日避免偷看预测期
+
+# 与 backtest_washout.py 中 LGBModel 的参数一致
+LGB_PARAMS = {
+    "objective": "mse",
+    "colsample_bytree": 0.8879,
+    "learning_rate": 0.05,
+    "subsample": 0.8789,
+    "lambda_l1": 205.6999,
+    "lambda_l2": 580.9768,
+    "max_depth": 8,
+    "num_leaves": 210,
+    "verbosity": -1,
+}
+NUM_BOOST_ROUND = 1000
+EARLY_STOPPING_ROUNDS = 50
+
+
+def build_panel(instruments=MARKET, start_time=START_TIME, end_time=END_TIME):
+    """
+    返回 (X, y, index, dates, day_start):
+    X/y 为按 (datetime, instrument) 排序的连续 float32 数组,
+    dates[i] 对应的行号区间为 [day_start[i], day_start[i + 1]).
+    """
+    config = {"feature": (fields, names), "label": (LABEL_FIELDS, LABEL_NAMES)}
+    raw = load_features(config, instruments=instruments, start_time=start_time, end_time=end_time)
+    raw = raw.sort_index()
+
+    feature = cs_rank_norm(raw["feature"]).fillna(0)
+    label = cs_rank_norm(raw["label"])["label"]
+
+    X = np.ascontiguousarray(feature.to_numpy(dtype=np.float32))
+    y = np.ascontiguousarray(label.to_numpy(dtype=np.float32))
+
+    day_codes, dates = pd.factorize(raw.index.get_level_values("datetime"), sort=True)
+    day_start = np.searchsorted(day_codes, np.arange(len(dates) + 1))
+    return X, y, raw.index, dates, day_start
+
+
+def make_windows(dates: pd.DatetimeIndex, train_years=TRAIN_YEARS, predict_months=PREDICT_MONTHS,
+                 valid_months=VALID_MONTHS, label_gap=LABEL_GAP):
+    """按日历生成窗口, 每个窗口是 (train_lo, valid_lo, train_hi, test_lo, test_hi) 的日期位置"""
+    windows = []
+    test_start = dates[0] + pd.DateOffset(years=train_years)
+    while test_start <= dates[-1]:
+        test_end = test_start + pd.DateOffset(months=predict_months)
+        test_lo = int(np.searchsorted(dates, test_start))
+        test_hi = int(np.searchsorted(dates, test_end))
+        train_lo = int(np.searchsorted(dates, test_start - pd.DateOffset(years=train_years)))
+        train_hi = max(test_lo - label_gap, train_lo)
+        valid_lo = int(np.searchsorted(dates, dates[test_lo] - pd.DateOffset(months=valid_months)))
+        valid_lo = min(max(valid_lo, train_lo + 1), train_hi)
+        if test_hi > test_lo and train_hi > train_lo:
+            windows.append((train_lo, valid_lo, train_hi, test_lo, test_hi))
+        test_start = test_end
+    return windows
+
+
+# ---------------- 共享内存 ----------------
+_SHARED = {}
+
+
+def _init_worker(x_spec, y_spec, day_start):
+    # 子进程只按名字挂载共享内存, 不复制面板
+    _SHARED["x_shm"], _SHARED["X"] = attach(x_spec)
+    _SHARED["y_shm"], _SHARED["y"] = attach(y_spec)
+    _SHARED["day_start"] = day_start
+
+
+def label_and_weight(label: np.ndarray) -> dict:
+    # 相当于 DropnaLabel: 标签为空的行权重置 0, 而不是用布尔掩码复制特征矩阵
+    missing = np.isnan(label)
+    return {"label": np.where(missing, 0.0, label), "weight": (~missing).astype(np.float32)}
+
+
+def _train_window(window_id, window, params, num_threads, model_dir):
+    train_lo, valid_lo, train_hi, test_lo, test_hi = window
+    X, y, day_start = _SHARED["X"], _SHARED["y"], _SHARED["day_start"]
+
+    # 面板按日期排序, 窗口就是一段连续的行号区间: 切片是 view, 不拷贝
+    r_train = slice(day_start[train_lo], day_start[valid_lo])
+    r_valid = slice(day_start[valid_lo], day_start[train_hi])
+    r_test = slice(day_start[test_lo], day_start[test_hi])
+
+    t0 = time.time()
+    dtrain = lgb.Dataset(X[r_train], **label_and_weight(y[r_train]))
+
+    valid_sets, callbacks = [dtrain], []
+    if r_valid.stop > r_valid.start:
+        valid_sets.append(lgb.Dataset(X[r_valid], reference=dtrain, **label_and_weight(y[r_valid])))
+        callbacks.append(lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False))
+
+    with span("walk_forward.fit", window=window_id, rows=r_train.stop - r_train.start):
+        booster = lgb.train(
+            {**params, "num_threads": num_threads},
+            dtrain,
+            num_boost_round=NUM_BOOST_ROUND,
+            valid_sets=valid_sets,
+            callbacks=callbacks,
+        )
+    pred = booster.predict(X[r_test], num_iteration=booster.best_iteration or None)
+    if model_dir is not None:
+        booster.save_model(str(Path(model_dir) / f"window_{window_id:02d}.txt"))
+    return window_id, r_test.start, pred.astype(np.float32), time.time() - t0
+
+
+def run_walk_forward(train_years=TRAIN_YEARS, predict_months=PREDICT_MONTHS, workers=None,
+                     params=None, output_dir=OUTPUT_DIR) -> pd.DataFrame:
+    """训练所有窗口并拼接样本外预测, 返回 index=(datetime, instrument), 列为 score 的 DataFrame"""
+    params = params or LGB_PARAMS
+    X, y, index, dates, day_start = build_panel()
+    windows = make_windows(dates, train_years, predict_months)
+    if not windows:
+        raise ValueError(f"数据区间 {dates[0].date()} ~ {dates[-1].date()} 不足 {train_years} 年, 无法生成窗口")
+
+    workers = workers or min(len(windows), os.cpu_count() or 1)
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"共 {len(windows)} 个窗口, {workers} 个进程 x {num_threads} 线程")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    score = np.full(len(y), np.nan, dtype=np.float32)
+    x_shm, x_spec = to_shared(X)
+    y_shm, y_spec = to_shared(y)
+    del X, y  # 之后只保留共享内存中的一份
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(x_spec, y_spec, day_start)) as executor:
+            futures = [
+                executor.submit(_train_window, i, w, params, num_threads, str(output_dir))
+                for i, w in enumerate(windows)
+            ]
+            for future in as_completed(futures):
+                i, start, pred, cost = future.result()
+                score[start:start + len(pred)] = pred
+                _, _, _, test_lo, test_hi = windows[i]
+                print(f" 窗口 {i:02d}: 预测 {dates[test_lo].date()} ~ {dates[test_hi - 1].date()} "
+                      f"({len(pred)} 条), 耗时 {cost:.1f}s")
+    finally:
+        release([x_shm, y_shm])
+
+    pred_df = pd.DataFrame({"score": score}, index=index).dropna()
+    pred_path = output_dir / "pred.pkl"
+    pred_df.to_pickle(pred_path)
+    print(f"样本外预测已拼接: {pred_df.index.get_level_values('datetime').min().date()} ~ "
+          f"{pred_df.index.get_level_values('datetime').max().date()}, 共 {len(pred_df)} 条 -> {pred_path}")
+    return pred_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="滚动 Walk-forward 训练")
+    parser.add_argument("--train_years", type=int, default=TRAIN_YEARS)
+    parser.add_argument("--predict_months", type=int, default=PREDICT_MONTHS)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    import qlib
+
+    qlib.init(provider_uri=str(QLIB_DATA_DIR.resolve()), region="cn")
+    run_walk_forward(args.train_years, args.predict_months, args.workers)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+洗盘特征/标签表达式定义
+
+训练 (train_washout_model.py) 和每日推理 (predict_daily.py) 共用同一份表达式,
+保证模型看到的特征列顺序一致.
+"""
+
+# 定义"强力洗盘+爆发", 我们需要过去一个月的表现来判断是否在"洗盘"
+fields = []
+names = []
+
+# A. 核心洗盘特征 (Price Action)
+# 1. 振幅 (Amplitude): 洗盘通常伴随剧烈震荡
+fields.append("($high - $low) / Ref($close, 1)")
+names.append("amplitude")
+
+# 2. 长下影线 (Lower Shadow): 主力试盘或支撑强度的标志
+# 下影线长度 / 收盘价
+fields.append("(If($open < $close, $open, $close) - $low) / $close")
+names.append("lower_shadow_ratio")
+
+# B. 量能与筹码 (Volume & Turnover)
+# 1. 换手率 (Turnover)
+fields.append("$turnover")
+names.append("turnover")
+
+# 2. 换手率变化: 今天换手率 / 过去5天均值
+fields.append("$turnover / Mean($turnover, 5)")
+names.append("turnover_ratio_5d")
+
+# 3. 量能萎缩: 判断是否缩量洗盘 (True=1, False=0)
+# 如果今天成交量小于过去20天均值, 可能是缩量洗盘
+fields.append("$volume / Mean($volume, 20)")
+names.append("vol_shrink_20d")
+
+# C. 趋势与历史表现 (Past Month Behavior)
+# 1. 过去20天涨跌幅: 也就是月度涨幅，判断股票是否处于活跃期
+fields.append("$close / Ref($close, 20) - 1")
+names.append("return_20d")
+
+# 2. 波动率 (Volatility): 过去20天的标准差，寻找活跃股
+fields.append("Std($close, 20) / Mean($close, 20)")
+names.append("volatility_20d")
+
+# 3. RSI (相对强弱指标): 简单的 RSI 近似，判断是否超卖
+# (涨幅和 / 绝对涨幅和)
+fields.append("Mean($close>$open, 14) / 14") 
+names.append("rsi_sim_14")
+
+# D. 目标 (Label)
+# 预测：明天最高价相对于今天收盘价的涨幅 (捕捉盘中拉升)
+label_expr = ["Ref($high, -1) / $close - 1"]
+label_cols = ["label_max_ret"]
+
+# 所有表达式里最长的回看窗口 (Ref($close, 20) / Mean(.., 20) / Std(.., 20)), 单位: 交易日
+MAX_LOOKBACK = 20
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+跨阶段耗时追踪 (Chrome / Perfetto trace 格式)
+
+夜间任务变慢时, 需要知道时间花在 AkShare 下载、ClickHouse 写入、CSV 生成、dump_bin 进程池、
+Qlib 特征加载还是 LightGBM 训练上. 各脚本在这些位置用 span / traced 打点:
+
+    from tracing import span, traced
+
+    @traced("ingest.process_stock")
+    def process_stock(code): ...
+
+    with span("export.write_csv", stocks=total):
+        ...
+
+启用: 设置环境变量 TRACE_DIR=<目录> (pipeline.py --trace 会自动设置), 子进程、进程池都继承该变量.
+每个进程把事件逐行追加到 TRACE_DIR/<pid>.jsonl (行缓冲, 进程被 os._exit 结束也不丢), 结束后合并成一个文件:
+
+    python tracing.py merge qlib_data/trace             # 生成 qlib_data/trace/trace.json 并打印各 span 的耗时汇总
+    # 用 chrome://tracing 或 https://ui.perfetto.dev 打开
+
+未启用时 span() 返回同一个空上下文, traced 在装饰时直接返回原函数, 几乎没有开销.
+"""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Config
+TRACE_ENV = "TRACE_DIR"
+OUTPUT_NAME = "trace.json"
+
+_dir = os.environ.get(TRACE_ENV) or None
+_NULL = contextlib.nullcontext()
+_lock = threading.Lock()
+_file = None
+_file_pid = None
+_seen_threads = set()
+
+
+def enabled() -> bool:
+    return _dir is not None
+
+
+def enable(trace_dir) -> None:
+    """在当前进程开启追踪, 并通过环境变量传给之后启动的子进程; traced 装饰器只对此后导入的模块生效"""
+    global _dir
+    _dir = str(trace_dir)
+    os.environ[TRACE_ENV] = _dir
+
+
+def _reset_after_fork():
+    # fork 出的子进程 (进程池) 不能沿用父进程的文件句柄和锁
+    global _lock, _file, _file_pid
+    _lock = threading.Lock()
+    _file, _file_pid = None, None
+    _seen_threads.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _write(event: dict) -> None:
+    global _file, _file_pid
+    pid, tid = event["pid"], event["tid"]
+    with _lock:
+        if _file is None or _file_pid != pid:
+            os.makedirs(_dir, exist_ok=True)
+            _file = open(os.path.join(_dir, f"{pid}.jsonl"), "a", buffering=1, encoding="utf-8")
+            _file_pid = pid
+            name = f"{Path(sys.argv[0]).name or 'python'} ({pid})"
+            _file.write(json.dumps({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                                    "args": {"name": name}}, ensure_ascii=False) + "\n")
+        if tid not in _seen_threads:
+            _seen_threads.add(tid)
+            _file.write(json.dumps({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                    "args": {"name": threading.current_thread().name}}, ensure_ascii=False) + "\n")
+        _file.write(json.dumps(event, default=str, ensure_ascii=False) + "\n")
+
+
+class _Span:
+    __slots__ = ("name", "args", "t0")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.time_ns()  # 墙钟时间, 不同进程之间可以对齐
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.time_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        _write({"name": self.name, "cat": self.name.split(".", 1)[0], "ph": "X",
+                "ts": self.t0 / 1000, "dur": (t1 - self.t0) / 1000,
+                "pid": os.getpid(), "tid": threading.get_native_id(), "args": self.args})
+        return False
+
+
+def span(name: str, **args):
+    """with span("stage.step", key=value): ...  未启用时返回空上下文"""
+    if _dir is None:
+        return _NULL
+    return _Span(name, args)
+
+
+def traced(name: str = None):
+    """函数级 span; 未启用时原样返回函数 (装饰时判断)"""
+    def decorator(func):
+        if _dir is None:
+            return func
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(label, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def merge(trace_dir, output=None) -> Path:
+    """把各进程的 .jsonl 合并成 Chrome trace JSON, 返回输出路径"""
+    trace_dir = Path(trace_dir)
+    events = []
+    for path in sorted(trace_dir.glob("*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    output = Path(output) if output else trace_dir / OUTPUT_NAME
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return output
+
+
+def summarize(trace_path) -> list:
+    """[(span 名, 次数, 总耗时秒, 平均毫秒, 最长毫秒)], 按总耗时降序"""
+    with open(trace_path, encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    stats = {}
+    for e in events:
+        if e.get("ph") == "X":
+            s = stats.setdefault(e["name"], [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += e["dur"]
+            s[2] = max(s[2], e["dur"])
+    rows = [(name, n, total / 1e6, total / n / 1e3, mx / 1e3) for name, (n, total, mx) in stats.items()]
+    return sorted(rows, key=lambda r: r[2], reverse=True)
+
+
+def print_summary(trace_path) -> None:
+    print(f"{'span':<32}{'次数':>8}{'总耗时':>12}{'平均':>12}{'最长':>12}")
+    for name, n, total, mean, mx in summarize(trace_path):
+        print(f"{name:<32}{n:>8}{total:>11.2f}s{mean:>10.1f}ms{mx:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合并 / 汇总追踪文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_merge = sub.add_parser("merge", help="合并各进程的 .jsonl 为 Chrome trace JSON")
+    p_merge.add_argument("trace_dir")
+    p_merge.add_argument("-o", "--output", default=None)
+    p_summary = sub.add_parser("summary", help="打印已合并 trace 的各 span 耗时")
+    p_summary.add_argument("trace")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        out = merge(args.trace_dir, args.output)
+        print(f"已写入 {out} (chrome://tracing 或 ui.perfetto.dev 打开)")
+        print_summary(out)
+    else:
+        print_summary(args.trace)